@@ -1,13 +1,32 @@
 import os
 # external imports
 import requests
+from requests.adapters import HTTPAdapter
 
 # imports for coroutines
 import asyncio
 import aiohttp
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import functools
+import itertools
+import xml.etree.ElementTree as ET
 from aiohttp import ClientSession, web, errors
 import time
-from ratelimiter import RateLimiter
+
+from pyalma.codec import Codec
+from pyalma.diff import unchanged
+from pyalma.journal import Journal
+from pyalma.marc import MarcView
+from pyalma.models import MODELS
+from pyalma.parallel import parse_marc
+from pyalma.quota import DAILY_THRESHOLD, Quota, QuotaExceeded
+from pyalma.ratelimit import TokenBucket
+from pyalma.result import Result, status_error
+from pyalma.retry import MAX_ATTEMPTS, RetryPolicy
+from pyalma.singleflight import SingleFlight
+from pyalma.tracing import TracingConnector
+from pyalma.xmlstream import CHUNK_SIZE, ElementParser, iter_elements
 
 
 __version__ = '0.1.0'
@@ -29,6 +48,7 @@ FORMATS = {
 }
 
 RESOURCES = {
+    'bibs': 'bibs',
     'bib': 'bibs/{mms_id}',
     'holdings': 'bibs/{mms_id}/holdings',
     'holding': 'bibs/{mms_id}/holdings/{holding_id}',
@@ -51,13 +71,97 @@ RESOURCES = {
     'user': 'users/{user_id}'
 }
 
+# record key of the list resources in json responses
+LIST_RESOURCES = {
+    'holdings': 'holding',
+    'items': 'item',
+    'item_requests': 'user_request',
+    'requested_resources': 'requested_resource',
+    'users': 'user'
+}
+
+# most MMS IDs Alma accepts in one GET bibs?mms_id=a,b,c request
+BIBS_LIMIT = 100
+
+# page size and number of pages fetched ahead by the iter_* methods
+PAGE_LIMIT = 100
+PAGE_PREFETCH = 4
+
+# levels of the inventory tree walked by cor_walk(): the list resource
+# read for each record of the level above, and the id of its records
+INVENTORY_LEVELS = (
+    ('holdings', 'holding_id', lambda record: record['holding_id']),
+    ('items', 'item_pid', lambda record: record['item_data']['pid']),
+    ('item_requests', 'request_id', lambda record: record['request_id']),
+)
+
 MAX_CALLS_PER_SEC = 25
+RATE_LIMIT_BURST = 1
 SEMAPHORE_LIM = 500
 
+# errors after which a call may be made again (see RetryPolicy)
+RETRY_ERRORS = (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout)
+COR_RETRY_ERRORS = (aiohttp.errors.ClientError,
+                    aiohttp.errors.DisconnectedError,
+                    asyncio.TimeoutError)
+
+# connection pool settings for the synchronous client
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+
+# connection pool settings for the coroutine methods
+CONNECTOR_LIMIT = 100
+KEEPALIVE_TIMEOUT = 30
+
 
 class Alma(object):
 
-    def __init__(self, apikey=__apikey__, region=__region__):
+    def __init__(self, apikey=__apikey__, region=__region__,
+                 pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 pool_block=False, keep_alive=True,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), rate_limiter=None,
+                 cache=None, single_flight=True, retry_policy=None,
+                 codec=None, quota=None, hooks=None, tracing=False):
+        """
+        The synchronous methods share a single requests.Session, so every
+        call reuses pooled keep-alive connections to the Alma endpoint.
+
+        - pool_connections is the number of host pools to cache
+        - pool_maxsize is the maximum number of connections kept per host.
+        Set it to the number of threads sharing this object.
+        - pool_block makes threads wait for a free connection instead of
+        opening (and discarding) connections beyond pool_maxsize
+        - keep_alive=False closes the connection after every call
+        - timeout is a (connect, read) tuple in seconds, or a single number
+        - rate_limiter is the TokenBucket every call acquires before it is
+        sent. By default each client gets its own, allowing
+        MAX_CALLS_PER_SEC with a burst of RATE_LIMIT_BURST. Pass the same
+        bucket to several clients to make them share one limit.
+        - cache is an optional pyalma.cache.MemoryCache (or any object
+        with the same methods). GET responses are served from it while
+        they are fresh, and writes drop the cached responses they affect.
+        - single_flight=True makes identical GETs that overlap in time
+        (from several threads, or several coroutines) share one call
+        - retry_policy is the RetryPolicy deciding which failed calls are
+        made again (by default 429, 5xx and connection errors, up to
+        MAX_ATTEMPTS times with exponential backoff)
+        - codec is the pyalma.codec.Codec decoding response bodies and
+        encoding request data. The default decodes json into dicts and
+        leaves xml as str; pyalma.codec.RawCodec() returns the bytes
+        received.
+        - quota is the pyalma.quota.Quota tracking the daily API quota
+        reported by Alma. The default only stops calls once it is used
+        up. Pass the same Quota to several clients of an institution.
+        - hooks is a list of callables, each passed every event of every
+        request (start, waits, retries and end) as a dict. See
+        pyalma.metrics for the events and a Metrics hook aggregating them.
+        - tracing=True makes the coroutine methods time the phases of each
+        call (pool wait, DNS, connect, time to first byte and transfer)
+        and emit them to the hooks (see pyalma.tracing)
+        """
         if apikey is None:
             raise Exception("Please supply an API key")
         if region not in ENDPOINTS:
@@ -65,8 +169,60 @@ class Alma(object):
             raise Exception(msg)
         self.apikey = apikey
         self.endpoint = ENDPOINTS[region]
-        self.max_calls = MAX_CALLS_PER_SEC
+        if rate_limiter is None:
+            rate_limiter = TokenBucket(MAX_CALLS_PER_SEC, RATE_LIMIT_BURST)
+        self.rate_limiter = rate_limiter
         self.semaphore_limit = SEMAPHORE_LIM
+        self._semaphore = None
+        self.connector_limit = CONNECTOR_LIMIT
+        self.keepalive_timeout = KEEPALIVE_TIMEOUT
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.cache = cache
+        self.flights = SingleFlight() if single_flight else None
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        if codec is None:
+            codec = Codec()
+        self.codec = codec
+        if quota is None:
+            quota = Quota()
+        self.quota = quota
+        self.hooks = list(hooks or [])
+        self.tracing = tracing
+        self.session = self.build_session(pool_connections, pool_maxsize,
+                                          pool_block)
+
+    @property
+    def max_calls(self):
+        return self.rate_limiter.rate
+
+    @max_calls.setter
+    def max_calls(self, value):
+        self.rate_limiter.rate = value
+
+    def build_session(self, pool_connections, pool_maxsize, pool_block):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def close(self):
+        """
+        Closes the pooled connections held by this client
+        """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     @property
     def baseurl(self):
@@ -87,24 +243,215 @@ class Alma(object):
 
     def request(self, httpmethod, resource, ids={}, params={}, data=None,
                 accept='json', content_type=None):
-        response = requests.request(
-            method=httpmethod,
-            headers=self.headers(accept=accept, content_type=content_type),
-            url=self.fullurl(resource, ids),
-            params=params,
-            data=data)
+        if self.cache is not None and httpmethod == 'GET':
+            entry = self.cache.get(self.cache_key(resource, ids, params,
+                                                  accept))
+            if entry is not None:
+                return self.cached_response(self.fullurl(resource, ids),
+                                            entry)
+        if self.flights is not None and httpmethod == 'GET':
+            key = self.request_key(resource, ids, params, accept)
+            return self.flights.do(key, self.send, httpmethod, resource, ids,
+                                   params=params, data=data, accept=accept,
+                                   content_type=content_type)
+        return self.send(httpmethod, resource, ids, params=params, data=data,
+                         accept=accept, content_type=content_type)
+
+    def send(self, httpmethod, resource, ids={}, params={}, data=None,
+             accept='json', content_type=None, max_attempts=None,
+             stream=False):
+        """
+        Makes the call for request(), bypassing the cache lookup and the
+        single flight, and makes it again as self.retry_policy allows
+        (max_attempts overrides the policy's).
+        stream=True returns as soon as the headers have arrived, leaving
+        the body to be read (and the response not cached).
+        """
+        policy = self.retry_policy
+        headers = self.headers(accept=accept, content_type=content_type)
+        if not self.keep_alive:
+            headers['Connection'] = 'close'
+        data = self.codec.encode(data, content_type)
+        # a write finishing before the response makes it stale
+        generation = (self.cache.generation() if self.cache is not None
+                      else None)
+        begin = time.monotonic()
+        self.emit('start', httpmethod, resource, ids=ids)
+        attempt = 0
         try:
-            response.raise_for_status()
-            return response
-        except requests.exceptions.HTTPError:
-            raise HTTPError(response)
+            while True:
+                attempt += 1
+                waited = self.rate_limiter.acquire()
+                self.emit('wait', httpmethod, resource, ids=ids,
+                          kind='rate_limit', seconds=waited)
+                waited = self.quota.acquire()
+                self.emit('wait', httpmethod, resource, ids=ids,
+                          kind='quota', seconds=waited)
+                try:
+                    response = self.session.request(
+                        method=httpmethod,
+                        headers=headers,
+                        url=self.fullurl(resource, ids),
+                        params=params,
+                        data=data,
+                        timeout=self.timeout,
+                        stream=stream)
+                except RETRY_ERRORS as e:
+                    if self.cache is not None:
+                        self.cache_update(httpmethod, resource, ids, params,
+                                          accept)
+                    if not (policy.retry_error(httpmethod) and
+                            policy.attempt_again(attempt, max_attempts)):
+                        raise
+                    delay = policy.delay(attempt)
+                    self.emit('retry', httpmethod, resource, ids=ids,
+                              attempt=attempt, status=None,
+                              error=_exception_error(e), delay=delay)
+                    time.sleep(delay)
+                    continue
+                self.quota.update(response.headers)
+                try:
+                    response.raise_for_status()
+                    break
+                except requests.exceptions.HTTPError:
+                    status = response.status_code
+                    if status == 429 and DAILY_THRESHOLD in response.text:
+                        # no call will succeed before the daily reset
+                        self.quota.exhausted()
+                        raise QuotaExceeded(
+                            'Alma refused the call: daily API threshold '
+                            'reached') from HTTPError(response)
+                    if self.cache is not None:
+                        self.cache_update(httpmethod, resource, ids, params,
+                                          accept)
+                    if not (policy.retry_status(httpmethod, status) and
+                            policy.attempt_again(attempt, max_attempts)):
+                        raise HTTPError(response)
+                    delay = policy.delay(attempt,
+                                         response.headers.get('Retry-After'))
+                    self.emit('retry', httpmethod, resource, ids=ids,
+                              attempt=attempt, status=status,
+                              error=status_error(status), delay=delay)
+                    time.sleep(delay)
+        except Exception as e:
+            status = getattr(e, 'status', None)
+            self.emit('end', httpmethod, resource, ids=ids, status=status,
+                      error=(status_error(status) if status
+                             else _exception_error(e)),
+                      attempts=attempt, elapsed=time.monotonic() - begin,
+                      bytes=None)
+            raise
+        if self.hooks:
+            self.emit('end', httpmethod, resource, ids=ids,
+                      status=response.status_code, error=None,
+                      attempts=attempt, elapsed=time.monotonic() - begin,
+                      bytes=None if stream else len(response.content))
+        if self.cache is not None and not stream:
+            entry = (response.status_code,
+                     response.headers.get('Content-Type', ''),
+                     response.content)
+            self.cache_update(httpmethod, resource, ids, params, accept,
+                              entry, generation)
+        return response
+
+    def emit(self, name, httpmethod, resource, **fields):
+        """
+        Passes an event of a request to every hook in self.hooks
+        """
+        if not self.hooks:
+            return
+        fields['event'] = name
+        fields['method'] = httpmethod
+        fields['resource'] = resource
+        fields['time'] = time.time()
+        for hook in self.hooks:
+            hook(fields)
+
+    def request_key(self, resource, ids, params, accept):
+        # identifies identical GETs for the single flight
+        params = tuple(sorted((str(k), str(v)) for k, v in params.items()))
+        return (resource, RESOURCES[resource].format(**ids), params, accept)
+
+    def request_stream(self, httpmethod, resource, ids={}, params={},
+                       chunk_size=CHUNK_SIZE):
+        """
+        Makes an xml call to a list resource (see LIST_RESOURCES) and
+        yields its records as xml.etree.ElementTree elements, one at a
+        time, parsing the body as it arrives. Neither the whole body nor
+        the whole tree is ever held in memory.
+        """
+        response = self.send(httpmethod, resource, ids, params=params,
+                             accept='xml', stream=True)
+        with response:
+            for element in iter_elements(response.iter_content(chunk_size),
+                                         LIST_RESOURCES[resource]):
+                yield element
+
+    def cache_key(self, resource, ids, params, accept):
+        return self.cache.key('GET', resource,
+                              RESOURCES[resource].format(**ids), params,
+                              accept)
+
+    def cache_update(self, httpmethod, resource, ids, params, accept,
+                     entry=None, generation=None):
+        """
+        Keeps self.cache in step with a call that has been made.
+
+        - a GET stores its entry, unless a write has invalidated it since
+        generation, taken from self.cache when the GET was sent
+        - any other call drops the cached responses it may have changed,
+        whether it succeeded or not
+        - a successful PUT then stores its entry as the new GET response
+        """
+        if httpmethod == 'GET':
+            if entry is not None:
+                self.cache.set(self.cache_key(resource, ids, params, accept),
+                               entry, generation)
+            return
+        self.cache.invalidate(RESOURCES[resource].format(**ids))
+        if httpmethod == 'PUT' and entry is not None:
+            self.cache.set(self.cache_key(resource, ids, {}, accept), entry)
+
+    def cached_response(self, url, entry):
+        """
+        Builds a requests.Response from a cache entry
+        """
+        status, ctype, content = entry
+        response = requests.Response()
+        response.status_code = status
+        response.headers['Content-Type'] = ctype
+        response._content = content
+        response.encoding = 'utf-8'
+        response.url = url
+        return response
+
+    def decode_content(self, ctype, content):
+        return self.codec.decode(ctype, content)
 
     def extract_content(self, response):
-        ctype = response.headers['Content-Type']
-        if 'json' in ctype:
-            return response.json()
-        else:
-            return response.content.decode('utf-8')
+        return self.decode_content(response.headers['Content-Type'],
+                                   response.content)
+
+    def request_content(self, httpmethod, resource, ids={}, params={},
+                        data=None, accept='json', content_type=None):
+        """
+        Calls request() and returns the extracted content
+        """
+        response = self.request(httpmethod, resource, ids, params=params,
+                                data=data, accept=accept,
+                                content_type=content_type)
+        return self.extract_content(response)
+
+    def request_model(self, httpmethod, resource, ids={}, params={},
+                      data=None, accept='json', content_type=None):
+        """
+        Calls request() and returns the record as a pyalma.models.Model
+        (see MODELS), which keeps the body undecoded until a field is read
+        """
+        response = self.request(httpmethod, resource, ids, params=params,
+                                data=data, accept=accept,
+                                content_type=content_type)
+        return MODELS[resource].from_response(response)
 
     '''
     Below are convenience methods that call request() and extract_content() and
@@ -112,157 +459,161 @@ class Alma(object):
     '''
 
     def get_bib(self, mms_id, accept='xml'):
-        response = self.request('GET', 'bib', {'mms_id': mms_id},
-                                accept=accept)
-        return self.extract_content(response)
+        return self.request_content('GET', 'bib', {'mms_id': mms_id},
+                                    accept=accept)
 
     def put_bib(self, mms_id, data, content_type='xml', accept='xml'):
-        response = self.request('PUT', 'bib', {'mms_id': mms_id},
-                                data=data, content_type=content_type, accept=accept)
-        return self.extract_content(response)
-
-    def get_holdings(self, mms_id, accept='json'):
-        response = self.request('GET', 'holdings', {'mms_id': mms_id},
-                                accept=accept)
-        return self.extract_content(response)
+        return self.request_content('PUT', 'bib', {'mms_id': mms_id},
+                                    data=data, content_type=content_type, accept=accept)
+
+    def get_bibs(self, mms_ids, accept='xml'):
+        # up to BIBS_LIMIT mms_ids in one call, see cor_stream_bibs for more
+        mms_ids = [str(mms_id) for mms_id in mms_ids]
+        if len(mms_ids) > BIBS_LIMIT:
+            raise ValueError('at most {} mms_ids per call, got {}'.format(
+                BIBS_LIMIT, len(mms_ids)))
+        mms_id = ','.join(mms_ids)
+        return self.request_content('GET', 'bibs', params={'mms_id': mms_id},
+                                    accept=accept)
+
+    def get_holdings(self, mms_id, accept='json', limit=None, offset=None,
+                     stream=False):
+        # stream=True yields <holding> elements, see request_stream
+        if stream:
+            return self.request_stream('GET', 'holdings', {'mms_id': mms_id},
+                                       params=self.page_params(limit, offset))
+        return self.request_content('GET', 'holdings', {'mms_id': mms_id},
+                                    params=self.page_params(limit, offset),
+                                    accept=accept)
 
     def get_holding(self, mms_id, holding_id, accept='json'):
-        response = self.request('GET', 'holding',
-                                {'mms_id': mms_id, 'holding_id': holding_id},
-                                accept=accept)
-        return self.extract_content(response)
+        return self.request_content('GET', 'holding',
+                                    {'mms_id': mms_id, 'holding_id': holding_id},
+                                    accept=accept)
 
     def put_holding(self, mms_id, holding_id, data, content_type='json',
                     accept='json'):
-        response = self.request('PUT', 'holding',
-                                {'mms_id': mms_id, 'holding_id': holding_id},
-                                data=data, content_type=content_type, accept=accept)
-        return self.extract_content(response)
-
-    def get_items(self, mms_id, holding_id, accept='json'):
-        response = self.request('GET', 'items',
-                                {'mms_id': mms_id,
-                                 'holding_id': holding_id},
-                                accept=accept)
-        return self.extract_content(response)
+        return self.request_content('PUT', 'holding',
+                                    {'mms_id': mms_id, 'holding_id': holding_id},
+                                    data=data, content_type=content_type, accept=accept)
+
+    def get_items(self, mms_id, holding_id, accept='json', limit=None,
+                  offset=None, stream=False):
+        # stream=True yields <item> elements, see request_stream
+        if stream:
+            return self.request_stream('GET', 'items',
+                                       {'mms_id': mms_id,
+                                        'holding_id': holding_id},
+                                       params=self.page_params(limit, offset))
+        return self.request_content('GET', 'items',
+                                    {'mms_id': mms_id,
+                                     'holding_id': holding_id},
+                                    params=self.page_params(limit, offset),
+                                    accept=accept)
 
     def get_item(self, mms_id, holding_id, item_pid, accept='json'):
-        response = self.request('GET', 'item',
-                                {'mms_id': mms_id,
-                                 'holding_id': holding_id,
-                                 'item_pid': item_pid},
-                                accept=accept)
-        return self.extract_content(response)
+        return self.request_content('GET', 'item',
+                                    {'mms_id': mms_id,
+                                     'holding_id': holding_id,
+                                     'item_pid': item_pid},
+                                    accept=accept)
 
     def put_item(self, mms_id, holding_id, item_pid, data, content_type='json',
                  accept='json'):
-        response = self.request('PUT', 'item',
-                                {'mms_id': mms_id,
-                                 'holding_id': holding_id,
-                                 'item_pid': item_pid},
-                                data=data, content_type=content_type, accept=accept)
-        return self.extract_content(response)
+        return self.request_content('PUT', 'item',
+                                    {'mms_id': mms_id,
+                                     'holding_id': holding_id,
+                                     'item_pid': item_pid},
+                                    data=data, content_type=content_type, accept=accept)
 
     def del_item(self, mms_id, holding_id, item_pid):
         pass
 
     def post_loan(self, mms_id, holding_id, item_pid, data,
                   content_type='json', accept='json'):
-        response = self.request('POST', 'loan',
-                                {'mms_id': mms_id,
-                                 'holding_id': holding_id,
-                                 'item_pid': item_pid},
-                                data=data, content_type=content_type, accept=accept)
-        return self.extract_content(response)
+        return self.request_content('POST', 'loan',
+                                    {'mms_id': mms_id,
+                                     'holding_id': holding_id,
+                                     'item_pid': item_pid},
+                                    data=data, content_type=content_type, accept=accept)
 
     def get_bib_requests(self, mms_id, accept='json'):
-        response = self.request('GET', 'bib_requests', {'mms_id': mms_id},
-                                accept=accept)
-        return self.extract_content(response)
+        return self.request_content('GET', 'bib_requests', {'mms_id': mms_id},
+                                    accept=accept)
 
     def get_item_requests(self, mms_id, holding_id, item_pid, accept='json'):
-        response = self.request('GET', 'item_requests',
-                                {'mms_id': mms_id,
-                                 'holding_id': holding_id,
-                                 'item_pid': item_pid},
-                                accept=accept)
-        return self.extract_content(response)
+        return self.request_content('GET', 'item_requests',
+                                    {'mms_id': mms_id,
+                                     'holding_id': holding_id,
+                                     'item_pid': item_pid},
+                                    accept=accept)
 
     def post_bib_request(self, mms_id, data, content_type='json', accept='json'):
-        response = self.request('POST', 'bib_requests',
-                                {'mms_id': mms_id},
-                                data=data, content_type=content_type, accept=accept)
-        return self.extract_content(response)
+        return self.request_content('POST', 'bib_requests',
+                                    {'mms_id': mms_id},
+                                    data=data, content_type=content_type, accept=accept)
 
     def post_item_request(self, mms_id, holding_id, item_pid, data,
                           content_type='json', accept='json'):
-        response = self.request('POST', 'item_requests',
-                                {'mms_id': mms_id,
-                                 'holding_id': holding_id,
-                                 'item_pid': item_pid},
-                                 data=data, content_type=content_type, accept=accept)
-        return self.extract_content(response)
+        return self.request_content('POST', 'item_requests',
+                                    {'mms_id': mms_id,
+                                     'holding_id': holding_id,
+                                     'item_pid': item_pid},
+                                    data=data, content_type=content_type, accept=accept)
 
     def put_bib_request(self, mms_id, request_id, data, content_type='json', accept='json'):
-        response = self.request('PUT', 'bib_request',
-                                {'mms_id': mms_id,
-                                 'request_id': request_id},
-                                data=data, content_type=content_type, accept=accept)
-        return self.extract_content(response)
+        return self.request_content('PUT', 'bib_request',
+                                    {'mms_id': mms_id,
+                                     'request_id': request_id},
+                                    data=data, content_type=content_type, accept=accept)
 
     def put_item_request(self, mms_id, holding_id, item_pid, request_id,
                          data, content_type='json', accept='json'):
-        response = self.request('PUT', 'item_request',
-                                {'mms_id': mms_id,
-                                 'holding_id': holding_id,
-                                 'item_pid': item_pid,
-                                 'request_id': request_id},
-                                  data=data, content_type=content_type, accept=accept)
-        return self.extract_content(response)
+        return self.request_content('PUT', 'item_request',
+                                    {'mms_id': mms_id,
+                                     'holding_id': holding_id,
+                                     'item_pid': item_pid,
+                                     'request_id': request_id},
+                                     data=data, content_type=content_type, accept=accept)
 
     def del_item_request(self, mms_id, holding_id, item_pid, request_id):
-        response = self.request('DELETE', 'item_request',
-                                            {'mms_id': mms_id,
-                                             'holding_id': holding_id,
-                                             'item_pid': item_pid,
-                                             'request_id': request_id},)
-        return self.extract_content(response)
+        return self.request_content('DELETE', 'item_request',
+                                    {'mms_id': mms_id,
+                                     'holding_id': holding_id,
+                                     'item_pid': item_pid,
+                                     'request_id': request_id},)
 
     def del_bib_request(self, mms_id, request_id):
-        response = self.request('DELETE', 'bib_request',
-                                            {'mms_id': mms_id,
-                                             'request_id': request_id},)
-        return self.extract_content(response)
+        return self.request_content('DELETE', 'bib_request',
+                                    {'mms_id': mms_id,
+                                     'request_id': request_id},)
 
     def get_bib_booking_availability(self, mms_id, accept='json'):
-        response = self.request('GET', 'bib_booking_availability',
-                                {'mms_id': mms_id}, accept=accept)
-        return self.extract_content(response)
+        return self.request_content('GET', 'bib_booking_availability',
+                                    {'mms_id': mms_id}, accept=accept)
 
     def get_item_booking_availability(
             self, mms_id, holding_id, item_pid, accept='json'):
-        response = self.request('GET', 'item_booking_availability',
-                                {'mms_id': mms_id,
-                                 'holding_id': holding_id,
-                                 'item_pid': item_pid},
-                                accept=accept)
-        return self.extract_content(response)
+        return self.request_content('GET', 'item_booking_availability',
+                                    {'mms_id': mms_id,
+                                     'holding_id': holding_id,
+                                     'item_pid': item_pid},
+                                    accept=accept)
 
-    def get_users(self, accept='json'):
-        response = self.request('GET', 'users', accept=accept)
-        return self.extract_content(response)
+    def get_users(self, accept='json', limit=None, offset=None):
+        return self.request_content('GET', 'users',
+                                    params=self.page_params(limit, offset),
+                                    accept=accept)
 
     def get_user(self, user_id, accept='json'):
-        response = self.request('GET', 'user', {'user_id': user_id},
-                                accept=accept)
-        return self.extract_content(response)
+        return self.request_content('GET', 'user', {'user_id': user_id},
+                                    accept=accept)
 
     def put_user(self, user_id, data, content_type='json',
                  accept='json'):
-        response = self.request('PUT', 'user',
-                                {'user_id': user_id}, data=data,
-                                content_type=content_type, accept=accept)
-        return self.extract_content(response)
+        return self.request_content('PUT', 'user',
+                                    {'user_id': user_id}, data=data,
+                                    content_type=content_type, accept=accept)
 
     def get_digreps(self, mms_id, accept='json'):
         pass
@@ -277,10 +628,94 @@ class Alma(object):
         pass
 
     def get_requested_resources(self, library=__library__,
-                                circ_desk=__circ_desk__):
+                                circ_desk=__circ_desk__, limit=None,
+                                offset=None, stream=False):
+        # stream=True yields <requested_resource> elements, see
+        # request_stream
         params = {'library': library, 'circ_desk': circ_desk}
-        response = self.request('GET', 'requested_resources', params=params)
-        return self.extract_content(response)
+        if stream:
+            return self.request_stream('GET', 'requested_resources',
+                                       params=self.page_params(limit, offset,
+                                                               params))
+        return self.request_content('GET', 'requested_resources',
+                                    params=self.page_params(limit, offset,
+                                                            params))
+
+    '''
+    Below are iterators over the list resources in LIST_RESOURCES.
+    They walk every page of results, using total_record_count from the
+    first page, and yield one record (a dict) at a time.
+    '''
+
+    def page_params(self, limit=None, offset=None, params={}):
+        params = dict(params)
+        if limit is not None:
+            params['limit'] = limit
+        if offset is not None:
+            params['offset'] = offset
+        return params
+
+    def get_page(self, resource, ids={}, params={}, limit=PAGE_LIMIT,
+                 offset=0):
+        return self.request_content('GET', resource, ids,
+                                    params=self.page_params(limit, offset,
+                                                            params),
+                                    accept='json')
+
+    def iter_pages(self, resource, ids={}, params={}, limit=PAGE_LIMIT,
+                   prefetch=PAGE_PREFETCH):
+        """
+        Yields every record of a list resource.
+
+        - limit is the page size (Alma allows at most 100)
+        - prefetch is the number of pages fetched concurrently, on a thread
+        pool, once the first page has given the total. All of them still
+        go through the client's rate limiter.
+        """
+        key = LIST_RESOURCES[resource]
+        page = self.get_page(resource, ids, params, limit)
+        total = page.get('total_record_count', 0)
+        for record in page.get(key, []):
+            yield record
+        offsets = iter(range(limit, total, limit))
+        with ThreadPoolExecutor(max_workers=max(prefetch, 1)) as executor:
+            pages = collections.deque(
+                executor.submit(self.get_page, resource, ids, params,
+                                limit, offset)
+                for offset in itertools.islice(offsets, max(prefetch, 1)))
+            try:
+                while pages:
+                    page = pages.popleft().result()
+                    for offset in itertools.islice(offsets, 1):
+                        pages.append(executor.submit(self.get_page, resource,
+                                                     ids, params, limit,
+                                                     offset))
+                    for record in page.get(key, []):
+                        yield record
+            finally:
+                for future in pages:
+                    future.cancel()
+
+    def iter_users(self, params={}, limit=PAGE_LIMIT, prefetch=PAGE_PREFETCH):
+        return self.iter_pages('users', params=params, limit=limit,
+                               prefetch=prefetch)
+
+    def iter_holdings(self, mms_id, limit=PAGE_LIMIT, prefetch=PAGE_PREFETCH):
+        return self.iter_pages('holdings', {'mms_id': mms_id}, limit=limit,
+                               prefetch=prefetch)
+
+    def iter_items(self, mms_id, holding_id, params={}, limit=PAGE_LIMIT,
+                   prefetch=PAGE_PREFETCH):
+        return self.iter_pages('items',
+                               {'mms_id': mms_id, 'holding_id': holding_id},
+                               params=params, limit=limit, prefetch=prefetch)
+
+    def iter_requested_resources(self, library=__library__,
+                                 circ_desk=__circ_desk__, limit=PAGE_LIMIT,
+                                 prefetch=PAGE_PREFETCH):
+        params = {'library': library, 'circ_desk': circ_desk}
+        return self.iter_pages('requested_resources', params=params,
+                               limit=limit, prefetch=prefetch)
 
     '''
     Below are coroutine methods.
@@ -289,115 +724,1023 @@ class Alma(object):
     '''
 
     async def cor_request(self, httpmethod, resource, ids, session, params={},
-                          data=None, accept='xml', content_type=None, max_attempts=5):
+                          data=None, accept='xml', content_type=None,
+                          max_attempts=None, budget=None):
         """
         Asynchronous request method
         Uses session.request, an aiohttp method
 
-        To set rate limit:
-        - max_attempts is the maximum number of times you want to repeat a
-        call before giving up.
-        - set maximum calls per second in global variable MAX_CALLS_PER_SEC
-        """
-        attempts_left = max_attempts
-        rate_limiter = RateLimiter(max_calls=self.max_calls,
-                                   period=(6-attempts_left),
-                                   callback=self.cor_limited)
-
-        async with session.request(method=httpmethod,
-                                   headers=self.headers(accept='xml', content_type='xml'),
-                                   url=self.fullurl(resource, ids),
-                                   params=params,
-                                   data=data) as response:
-            try:
+        - failed calls are made again as self.retry_policy allows.
+        max_attempts overrides the policy's number of attempts, and budget
+        is the RetryBudget of the batch the call belongs to.
+        - every call acquires self.rate_limiter before it is sent, so the
+        maximum calls per second (self.max_calls) holds across all requests
+        in flight
+        - GET responses are served from self.cache, if there is one
+        - identical GETs in flight at the same time share one call
+        (see self.flights)
+
+        Returns a Result, also for errors: exceptions raised by the call
+        are caught and returned with a status of None.
+        """
+        if self.cache is not None and httpmethod == 'GET':
+            entry = self.cache.get(self.cache_key(resource, ids, params,
+                                                  accept))
+            if entry is not None:
+                status, ctype, content = entry
+                return Result(ids, status,
+                              self.decode_content(ctype, content),
+                              attempts=0, raw=content,
+                              request=self.request_info(httpmethod, resource,
+                                                        params, data, accept,
+                                                        content_type))
+        if self.flights is not None and httpmethod == 'GET':
+            key = self.request_key(resource, ids, params, accept)
+            result = await self.flights.cor_do(
+                key, self.cor_send, httpmethod, resource, ids, session,
+                params=params, data=data, accept=accept,
+                content_type=content_type, max_attempts=max_attempts,
+                budget=budget)
+            return result._replace(ids=ids)
+        return await self.cor_send(httpmethod, resource, ids, session,
+                                   params=params, data=data, accept=accept,
+                                   content_type=content_type,
+                                   max_attempts=max_attempts, budget=budget)
+
+    async def cor_send(self, httpmethod, resource, ids, session, params={},
+                       data=None, accept='xml', content_type=None,
+                       max_attempts=None, budget=None):
+        """
+        Makes the call for cor_request(), bypassing the cache lookup and
+        the single flight, and makes it again as self.retry_policy allows
+        """
+        request = self.request_info(httpmethod, resource, params, data,
+                                    accept, content_type)
+        data = self.codec.encode(data, content_type)
+        connector = getattr(session, 'connector', None)
+        if not (self.hooks and isinstance(connector, TracingConnector)):
+            connector = None
+        generation = (self.cache.generation() if self.cache is not None
+                      else None)
+        begin = time.monotonic()
+        self.emit('start', httpmethod, resource, ids=ids)
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                trace = None
                 try:
-                    ctype = response.headers['Content-Type']
-                except:
-                    ctype = ''
-                status = response.status
-                method = response.method
-                url = response.url_obj
-                async with rate_limiter:
-                    response.raise_for_status()
-                if 'json' in ctype:
-                    body = await response.json()
-                else:
-                    body = await response.text(encoding='utf-8')
-                return (ids, status, body)
-            except aiohttp.errors.HttpProcessingError:
-                body = await response.text()
-                msg = "\nError in {} \n  HTTP Status: {}\n  Method: {}\n  URL: {}\n  Response: {}".format(ids, status, method, url, body)
-
-                if status == 429:
-                    attempts_left -= 1
-                    if attempts_left < 0:
-                        print(msg)
-                        return (ids, status, msg)
-                    else:
-                        until = time.time() + (rate_limiter.period)
-                        asyncio.ensure_future(self.cor_limited(until))
-                        await asyncio.sleep(rate_limiter.period)
-                        async with rate_limiter:
-                            result = await self.cor_request(httpmethod, resource, ids, session, params=params, data=data, accept=accept, content_type=content_type, max_attempts=attempts_left)
-                            return result
-                else:
-                    return (ids, status, msg)
+                    await self.cor_wait(httpmethod, resource, ids, budget)
+                    if connector is not None:
+                        trace = connector.begin()
+                    async with session.request(method=httpmethod,
+                                               headers=self.headers(accept=accept, content_type=content_type),
+                                               url=self.fullurl(resource, ids),
+                                               params=params,
+                                               data=data) as response:
+                        if trace is not None:
+                            trace.received = time.monotonic()
+                        try:
+                            try:
+                                ctype = response.headers['Content-Type']
+                            except:
+                                ctype = ''
+                            status = response.status
+                            method = response.method
+                            url = response.url_obj
+                            self.quota.update(response.headers)
+                            response.raise_for_status()
+                            content = await response.read()
+                            if trace is not None:
+                                self.emit('trace', httpmethod, resource,
+                                          ids=ids, **trace.phases())
+                            if self.cache is not None:
+                                self.cache_update(httpmethod, resource, ids,
+                                                  params, accept,
+                                                  (status, ctype, content),
+                                                  generation)
+                            return self.finished(Result(
+                                ids, status,
+                                self.decode_content(ctype, content),
+                                attempts=attempt,
+                                elapsed=time.monotonic() - begin, raw=content,
+                                request=request))
+                        except aiohttp.errors.HttpProcessingError:
+                            if self.cache is not None:
+                                self.cache_update(httpmethod, resource, ids,
+                                                  params, accept)
+                            retry_after = response.headers.get('Retry-After')
+                            raw = await response.read()
+                            if trace is not None:
+                                self.emit('trace', httpmethod, resource,
+                                          ids=ids, **trace.phases())
+                            body = raw.decode('utf-8', 'replace')
+                            daily = status == 429 and DAILY_THRESHOLD in body
+                            if daily:
+                                self.quota.exhausted()
+                            msg = "\nError in {} \n  HTTP Status: {}\n  Method: {}\n  URL: {}\n  Response: {}".format(ids, status, method, url, body)
+                except COR_RETRY_ERRORS as e:
+                    if self.cache is not None:
+                        self.cache_update(httpmethod, resource, ids, params,
+                                          accept)
+                    if await self.cor_retry(httpmethod, resource, ids, attempt,
+                                            max_attempts, budget,
+                                            error=_exception_error(e)):
+                        continue
+                    return self.finished(self.exception_result(
+                        ids, e, attempt, time.monotonic() - begin, request))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    return self.finished(self.exception_result(
+                        ids, e, attempt, time.monotonic() - begin, request))
+
+                if daily:
+                    # not made again: no call succeeds before the daily reset
+                    return self.finished(Result(
+                        ids, status, msg, error='quota', attempts=attempt,
+                        elapsed=time.monotonic() - begin, raw=raw,
+                        request=request))
+                if await self.cor_retry(httpmethod, resource, ids, attempt,
+                                        max_attempts, budget, status=status,
+                                        retry_after=retry_after):
+                    continue
+                return self.finished(Result(
+                    ids, status, msg, error=status_error(status),
+                    attempts=attempt, elapsed=time.monotonic() - begin,
+                    raw=raw, request=request))
+        except asyncio.CancelledError:
+            # e.g. the consumer of a batch stopped early
+            self.emit('end', httpmethod, resource, ids=ids, status=None,
+                      error='cancelled', attempts=attempt,
+                      elapsed=time.monotonic() - begin, bytes=None)
+            raise
+
+    async def cor_wait(self, httpmethod, resource, ids, budget=None):
+        """
+        Waits for self.rate_limiter and self.quota before a call (raises
+        QuotaExceeded if the quota is used up), and counts the call in
+        the RetryBudget of its batch
+        """
+        if budget is not None:
+            budget.record_call()
+        waited = await self.rate_limiter.cor_acquire()
+        self.emit('wait', httpmethod, resource, ids=ids, kind='rate_limit',
+                  seconds=waited)
+        waited = await self.quota.cor_acquire()
+        self.emit('wait', httpmethod, resource, ids=ids, kind='quota',
+                  seconds=waited)
+
+    async def cor_retry(self, httpmethod, resource, ids, attempt,
+                        max_attempts=None, budget=None, status=None,
+                        error=None, retry_after=None):
+        """
+        Returns whether a failed call may be made again, as
+        self.retry_policy allows, after sleeping until it may.
+        status is that of the response, or None and error the category of
+        the exception if there was none.
+        """
+        policy = self.retry_policy
+        if status is None:
+            allowed = policy.retry_error(httpmethod)
+        else:
+            allowed = policy.retry_status(httpmethod, status)
+            error = status_error(status)
+        if not (allowed and
+                policy.attempt_again(attempt, max_attempts, budget)):
+            return False
+        delay = policy.delay(attempt, retry_after)
+        self.emit('retry', httpmethod, resource, ids=ids, attempt=attempt,
+                  status=status, error=error, delay=delay)
+        if status == 429:
+            await self.cor_limited(time.time() + delay)
+        await asyncio.sleep(delay)
+        return True
+
+    def finished(self, result):
+        """
+        Emits the 'end' event of a request made by cor_send() and returns
+        its Result
+        """
+        if self.hooks:
+            self.emit('end', result.request['method'],
+                      result.request['resource'], ids=result.ids,
+                      status=result.status, error=result.error,
+                      attempts=result.attempts, elapsed=result.elapsed,
+                      bytes=None if result.raw is None else len(result.raw))
+        return result
+
+    def request_info(self, httpmethod, resource, params={}, data=None,
+                     accept='xml', content_type=None):
+        # what a Result keeps to make its request again
+        return {'method': httpmethod, 'resource': resource,
+                'params': params, 'data': data, 'accept': accept,
+                'content_type': content_type}
+
+    def unchanged_result(self, resource, input_param, accept='xml',
+                         content_type=None):
+        """
+        Returns the Result of a PUT input_param whose data is the same as
+        its 'original' (see pyalma.diff), or None if it must be sent
+        """
+        original = input_param['original']
+        data = input_param.get('data')
+        if original is None or not unchanged(original, data, content_type):
+            return None
+        request = self.request_info('PUT', resource,
+                                    input_param.get('params', {}), data,
+                                    accept, content_type)
+        if isinstance(original, bytes):
+            original = self.decode_content(FORMATS[accept], original)
+        return Result(input_param['ids'], 304, original, attempts=0,
+                      request=request, unchanged=True)
+
+    def exception_result(self, ids, exception, attempts=0, elapsed=0.0,
+                         request=None):
+        """
+        Returns the Result of a request ended by an exception
+        """
+        msg = "\nError in {} \n  Exception: {!r}".format(ids, exception)
+        return Result(ids, None, msg, error=_exception_error(exception),
+                      attempts=attempts, elapsed=elapsed,
+                      exception=exception, request=request)
+
+    @property
+    def semaphore(self):
+        """
+        Bounds the number of requests in flight across all batches run by
+        this client on the current event loop (see self.semaphore_limit)
+        """
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.semaphore_limit)
+            self._semaphore_loop = loop
+        return self._semaphore
 
     async def cor_bound_request(self, sem, httpmethod, resource, ids, session, params={},
-                                data=None, accept='xml', content_type='xml'):
+                                data=None, accept='xml', content_type='xml',
+                                budget=None):
         """
         Bounds request, so that no more than x connections can be
-        open at once (set inside self.cor_run)
+        open at once (see self.semaphore)
         """
+        begin = time.monotonic()
         async with sem:
-            request = await self.cor_request(httpmethod, resource, ids, session, data=data, accept=accept, content_type=content_type)
+            self.emit('wait', httpmethod, resource, ids=ids,
+                      kind='semaphore', seconds=time.monotonic() - begin)
+            request = await self.cor_request(httpmethod, resource, ids, session, params=params, data=data, accept=accept, content_type=content_type, budget=budget)
             return request
 
     async def cor_limited(self, until):
         """
-        Rate limits calls to the server (set in cor_run)
+        Reports that Alma rate limited a call (HTTP 429)
+        """
+        duration = until - time.time()
+        print("Rate limited, sleeping for {:.1f} seconds".format(duration))
+
+    def cor_session(self):
+        """
+        Returns a ClientSession backed by a keep-alive TCPConnector with a
+        DNS cache (a TracingConnector if self.tracing). Alma clients only
+        talk to one regional endpoint, so the connector limit is also the
+        limit per host.
+        """
+        if isinstance(self.timeout, tuple):
+            conn_timeout, read_timeout = self.timeout
+        else:
+            conn_timeout = read_timeout = self.timeout
+        connector_class = (TracingConnector if self.tracing
+                           else aiohttp.TCPConnector)
+        if self.keep_alive:
+            connector = connector_class(
+                use_dns_cache=True,
+                limit=self.connector_limit,
+                keepalive_timeout=self.keepalive_timeout,
+                conn_timeout=conn_timeout)
+        else:
+            connector = connector_class(use_dns_cache=True,
+                                        limit=self.connector_limit,
+                                        force_close=True,
+                                        conn_timeout=conn_timeout)
+        return ClientSession(connector=connector, read_timeout=read_timeout)
+
+    def cor_execute(self, coro):
+        """
+        Runs a coroutine to completion on the current event loop.
+        The loop is left open, so later batches in the same process can
+        run on it too. Inside an already running loop use AsyncAlma.
+        """
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or loop.is_closed():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+        if loop.is_running():
+            coro.close()
+            raise RuntimeError("The event loop is already running, "
+                               "use AsyncAlma and await its methods instead")
+        return loop.run_until_complete(coro)
+
+    def cor_batch(self, httpmethod, resource, input_params, accept='xml',
+                  content_type=None, journal=None):
+        """
+        Runs cor_run() to completion and returns the list of responses
+        """
+        return self.cor_execute(self.cor_run(httpmethod, resource,
+                                             input_params, accept=accept,
+                                             content_type=content_type,
+                                             journal=journal))
+
+    async def cor_run(self, httpmethod, resource, input_params, accept='xml',
+                      content_type=None, session=None, journal=None):
+        """
+        Takes input_params (any iterable or async iterable), makes requests,
+        returns a list of responses in input order
+
+        If no session is given, a new one is opened for this run only.
+        journal is a Journal, or the path of one (see cor_stream)
+        """
+        if isinstance(journal, str):
+            with Journal(journal) as journal:
+                return await self.cor_run(httpmethod, resource, input_params,
+                                          accept=accept,
+                                          content_type=content_type,
+                                          session=session, journal=journal)
+        responses = [response async for response in
+                     self.cor_stream(httpmethod, resource, input_params,
+                                     accept=accept, content_type=content_type,
+                                     ordered=True, session=session,
+                                     journal=journal)]
+        return responses
+
+    def cor_replay(self, results):
+        """
+        Takes the results of a finished batch, makes the requests that
+        failed with a retryable error again (see
+        RetryPolicy.replay_result) and returns the results in the same
+        order, with those of the replayed requests replaced
+        """
+        return self.cor_execute(self.cor_rerun(results))
+
+    async def cor_rerun(self, results, session=None):
         """
-        duration = int(round(until - time.time()))
-        print("Rate limited, sleeping for {:d} seconds".format(duration))
+        Coroutine of cor_replay()
+        """
+        results = list(results)
+        batches = collections.OrderedDict()
+        for index, result in enumerate(results):
+            if self.retry_policy.replay_result(result):
+                request = result.request
+                batch = (request['method'], request['resource'],
+                         request['accept'], request['content_type'])
+                batches.setdefault(batch, []).append(index)
+        for batch, indexes in batches.items():
+            httpmethod, resource, accept, content_type = batch
+            input_params = [{'ids': results[index].ids,
+                             'params': results[index].request['params'],
+                             'data': results[index].request['data']}
+                            for index in indexes]
+            replayed = await self.cor_run(httpmethod, resource, input_params,
+                                          accept=accept,
+                                          content_type=content_type,
+                                          session=session)
+            for index, result in zip(indexes, replayed):
+                results[index] = result
+        return results
+
+    async def cor_stream(self, httpmethod, resource, input_params,
+                         accept='xml', content_type=None, ordered=False,
+                         session=None, workers=None, journal=None,
+                         expected=None):
+        """
+        Async generator version of cor_run: yields each
+        (ids, status, response) as soon as its request has finished,
+        and keeps no reference to it afterwards.
+
+        A fixed pool of workers pulls input_params from a bounded queue,
+        so input_params may be any iterable or async iterable and is only
+        read as fast as responses are consumed: memory use does not depend
+        on the size of the input.
+
+        - workers is the number of requests in flight at once
+        (default self.semaphore_limit)
+        - ordered=False yields responses in the order they complete,
+        ordered=True in the order of input_params (a finished response
+        is then held back until all responses before it are yielded)
+
+        No more than 2 * workers inputs are read ahead of the consumer.
+        All the requests of the stream share one RetryBudget.
+
+        - journal is an optional Journal. Inputs it records as succeeded
+        are skipped (and not yielded), and every finished request is
+        recorded in it, so a stream that died can be run again with the
+        same journal and input_params to finish the work.
+
+        A batch that needs more calls than self.quota has left is refused
+        with QuotaExceeded: before it starts if the quota is known, else
+        as soon as the first response reports it. The number of calls is
+        taken from input_params if it is a list, else from expected
+        (e.g. the number of rows of a file).
+
+        If no session is given, a new one is opened for this run only
+        """
+        if session is None:
+            async with self.cor_session() as session:
+                async for response in self.cor_stream(httpmethod, resource,
+                                                      input_params,
+                                                      accept=accept,
+                                                      content_type=content_type,
+                                                      ordered=ordered,
+                                                      session=session,
+                                                      workers=workers,
+                                                      journal=journal,
+                                                      expected=expected):
+                    yield response
+            return
+
+        calls = self.batch_calls(httpmethod, resource, input_params, journal,
+                                 expected)
+        checked = self.check_quota(calls)
+        received = 0
+        if workers is None:
+            workers = self.semaphore_limit
+        # the window bounds both queues: it counts inputs that have been
+        # read but whose responses have not been yielded yet
+        window = asyncio.Semaphore(2 * workers)
+        budget = self.retry_policy.budget()
+        queue = asyncio.Queue()
+        finished = asyncio.Queue()
+
+        async def produce():
+            try:
+                index = 0
+                async for input_param in _aiter(input_params):
+                    if journal is not None and journal.succeeded(
+                            httpmethod, resource, input_param['ids']):
+                        continue
+                    await window.acquire()
+                    queue.put_nowait((index, input_param, time.monotonic()))
+                    index += 1
+            finally:
+                for i in range(workers):
+                    queue.put_nowait(None)
+
+        async def work():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                index, input_param, queued = item
+                self.emit('wait', httpmethod, resource,
+                          ids=input_param.get('ids'), kind='queue',
+                          seconds=time.monotonic() - queued)
+                response = None
+                try:
+                    if httpmethod == 'PUT' and 'original' in input_param:
+                        # PUTs that would change nothing are not sent
+                        response = self.unchanged_result(resource,
+                                                         input_param, accept,
+                                                         content_type)
+                    if response is None:
+                        response = await self.cor_bound_request(self.semaphore,
+                                                                httpmethod,
+                                                                resource,
+                                                                input_param['ids'],
+                                                                session,
+                                                                params=input_param.get('params', {}),
+                                                                data=input_param.get('data'),
+                                                                accept=accept,
+                                                                content_type=content_type,
+                                                                budget=budget)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # one failed input must not end the whole stream
+                    response = self.exception_result(
+                        input_param.get('ids'), e,
+                        request=self.request_info(
+                            httpmethod, resource,
+                            input_param.get('params', {}),
+                            input_param.get('data'), accept, content_type))
+                if journal is not None:
+                    journal.record(httpmethod, resource, input_param['ids'],
+                                   response[1])
+                finished.put_nowait((index, response))
+
+        producer = asyncio.ensure_future(produce())
+        tasks = [producer] + [asyncio.ensure_future(work())
+                              for i in range(workers)]
+        for task in tasks:
+            task.add_done_callback(finished.put_nowait)
+        running = workers
+        held = {}
+        next_index = 0
+        try:
+            while running:
+                item = await finished.get()
+                if isinstance(item, asyncio.Future):
+                    # raises any error from a worker or from input_params
+                    item.result()
+                    if item is not producer:
+                        running -= 1
+                    continue
+                index, response = item
+                received += 1
+                if (not checked and calls is not None and
+                        self.quota.remaining is not None):
+                    # the quota is known from the first response: the
+                    # calls in flight are still counted as to be made
+                    checked = self.check_quota(calls - received)
+                if ordered:
+                    held[index] = response
+                    while next_index in held:
+                        window.release()
+                        yield held.pop(next_index)
+                        next_index += 1
+                else:
+                    window.release()
+                    yield response
+        finally:
+            for task in tasks:
+                task.cancel()
 
-    async def cor_run(self, httpmethod, resource, input_params, accept='xml', content_type=None):
+    async def cor_walk(self, input_params, depth=2, session=None,
+                       workers=None, limit=PAGE_LIMIT):
         """
-        Takes a list of input_params, makes requests, returns responses
+        Async generator walking the inventory tree under each MMS ID of
+        input_params (dicts with ids {'mms_id': ...}, like cor_stream):
+        the holdings of the bib, then the items of each holding, then the
+        requests on each item, as deep as depth (1 to 3).
+
+        Yields one Result per record found, as soon as its page arrives.
+        Its ids locate it in the tree ({'mms_id', 'holding_id',
+        'item_pid'}, plus 'request_id' at depth 3), its body is the json
+        record and its request is the list call it came from. A failed
+        call is yielded as its own Result, and nothing below it is walked.
+
+        All levels share one pool of workers, one retry budget and the
+        client's rate limiter. Pending calls at deeper levels go first,
+        and the remaining pages of a list are all requested as soon as
+        its first page gives the total, so the pipeline stays full.
+        At most workers bibs are walked at once, input_params is read as
+        they finish, and no more than workers * limit records wait to be
+        yielded: a slow consumer holds the workers back.
         """
-        tasks = []
+        if not 1 <= depth <= len(INVENTORY_LEVELS):
+            raise ValueError('depth must be between 1 and {}'.format(
+                len(INVENTORY_LEVELS)))
+        if session is None:
+            async with self.cor_session() as session:
+                async for result in self.cor_walk(input_params, depth=depth,
+                                                  session=session,
+                                                  workers=workers,
+                                                  limit=limit):
+                    yield result
+            return
+
+        if workers is None:
+            workers = self.semaphore_limit
+        window = asyncio.Semaphore(workers)
+        # bounds the results waiting in finished for the consumer
+        room = asyncio.Semaphore(workers * limit)
+        budget = self.retry_policy.budget()
+        # (-level, sequence, (root, level, ids, offset)), deepest first
+        queue = asyncio.PriorityQueue()
+        finished = asyncio.Queue()
+        sequence = itertools.count()
+        # number of calls still to make in the tree of each input
+        pending = {}
+        state = {'reading': True}
+
+        def put(root, level, ids, offset):
+            # counted when queued, so that the tree cannot look finished
+            # while a worker waits for room to queue its records
+            pending[root] = pending.get(root, 0) + 1
+            queue.put_nowait((-level, next(sequence),
+                              (root, level, ids, offset)))
+
+        def stop():
+            for i in range(workers):
+                # sorts after every call
+                queue.put_nowait((1, next(sequence), None))
+
+        def done(root):
+            # a call of the tree of root has finished
+            pending[root] -= 1
+            if not pending[root]:
+                del pending[root]
+                window.release()
+                if not state['reading'] and not pending:
+                    stop()
+
+        async def produce():
+            try:
+                root = 0
+                async for input_param in _aiter(input_params):
+                    await window.acquire()
+                    put(root, 0, {'mms_id': input_param['ids']['mms_id']}, 0)
+                    root += 1
+            finally:
+                state['reading'] = False
+                if not pending:
+                    stop()
+
+        async def work():
+            while True:
+                item = (await queue.get())[2]
+                if item is None:
+                    break
+                root, level, ids, offset = item
+                resource, id_name, record_id = INVENTORY_LEVELS[level]
+                params = self.page_params(limit, offset)
+                try:
+                    result = await self.cor_bound_request(
+                        self.semaphore, 'GET', resource, ids, session,
+                        params=params, accept='json', content_type=None,
+                        budget=budget)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    result = self.exception_result(
+                        ids, e, request=self.request_info(
+                            'GET', resource, params, accept='json'))
+                if not result.ok:
+                    await room.acquire()
+                    finished.put_nowait(result)
+                    done(root)
+                    continue
+                body = result.body
+                if not isinstance(body, dict):
+                    body = self.codec.loads(result.raw)
+                if offset == 0:
+                    for page in range(limit, body.get('total_record_count',
+                                                      0), limit):
+                        put(root, level, ids, page)
+                for record in body.get(LIST_RESOURCES[resource], []):
+                    record_ids = dict(ids)
+                    record_ids[id_name] = record_id(record)
+                    await room.acquire()
+                    finished.put_nowait(result._replace(ids=record_ids,
+                                                        body=record,
+                                                        raw=None))
+                    if level + 1 < depth:
+                        put(root, level + 1, record_ids, 0)
+                done(root)
+
+        producer = asyncio.ensure_future(produce())
+        tasks = [producer] + [asyncio.ensure_future(work())
+                              for i in range(workers)]
+        for task in tasks:
+            task.add_done_callback(finished.put_nowait)
+        running = workers
+        try:
+            while running:
+                item = await finished.get()
+                if isinstance(item, asyncio.Future):
+                    # raises any error from a worker or from input_params
+                    item.result()
+                    if item is not producer:
+                        running -= 1
+                    continue
+                room.release()
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def cor_get_inventory(self, input_params, depth=2, workers=None):
+        # input_params includes mms_id
+        # returns the Result of every holding, item (and item request, at
+        # depth 3) under the bibs, see cor_walk
+        return self.cor_execute(self.cor_collect(
+            self.cor_walk(input_params, depth=depth, workers=workers)))
 
-        # set the simultaneous connection limit here
-        sem = asyncio.Semaphore(self.semaphore_limit)
+    def batch_calls(self, httpmethod, resource, input_params, journal=None,
+                    expected=None):
+        """
+        Returns the number of calls a batch will make: expected if given,
+        else the number of input_params (if it is a list) the journal
+        does not record as done, else None
+        """
+        if expected is not None:
+            return expected
+        if not hasattr(input_params, '__len__'):
+            return None
+        if journal is None:
+            return len(input_params)
+        return sum(1 for input_param in input_params
+                   if not journal.succeeded(httpmethod, resource,
+                                            input_param['ids']))
+
+    def check_quota(self, calls):
+        """
+        Raises QuotaExceeded if calls (see batch_calls) are more than
+        self.quota has left. Returns False if that cannot be told yet:
+        the number of calls or the quota is unknown.
+        """
+        if calls is None or self.quota.remaining is None:
+            return False
+        self.quota.check(calls)
+        return True
 
-        # set the rate limit here
-        rate_limiter = RateLimiter(max_calls=self.max_calls,
-                                   period=1,
-                                   callback=self.cor_limited)
+    async def cor_collect(self, stream):
+        """
+        Collects the responses yielded by an async generator into a list
+        """
+        return [response async for response in stream]
 
-        async with ClientSession() as session:
-            for input_param in input_params:
+    async def cor_map(self, stream, func, executor=None, processes=None,
+                      ordered=False, raw=True):
+        """
+        Async generator running func on every successful Result of stream
+        (any async iterable of Results, such as cor_stream()) in a process
+        pool, yielding each Result with its body replaced by what func
+        returned. CPU bound parsing then uses every core, while the event
+        loop keeps making requests.
+
+        func gets the raw response bytes (or the body, for the results
+        split from a GET bibs call) and must be picklable: a module level
+        function or a functools.partial of one (see pyalma.parallel).
+        Failed Results are passed through, and if func raises, its Result
+        is yielded with error 'exception'.
+
+        - executor is the concurrent.futures executor to use. By default
+        a ProcessPoolExecutor with processes workers (default: one per
+        CPU) is opened for this run only.
+        - ordered=True yields results in the order of stream, otherwise
+        as soon as they are ready
+        - raw=False gives func the decoded body instead of the bytes
+        No more than 2 * processes results are in the pool at once.
+        """
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(processes)
+        limit = 2 * (processes or os.cpu_count() or 1)
+        loop = asyncio.get_event_loop()
+        pending = collections.deque()
+
+        async def finish(result):
+            if not result.ok:
+                return result
+            if raw and result.raw is not None:
+                data = result.raw
+            else:
+                data = result.body
+            try:
+                body = await loop.run_in_executor(executor, func, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                return self.exception_result(result.ids, e, result.attempts,
+                                             result.elapsed, result.request)
+            return result._replace(body=body)
+
+        def ready(block):
+            # the tasks that may be yielded now, in order
+            if ordered:
+                tasks = []
+                while pending and (pending[0].done() or block):
+                    tasks.append(pending.popleft())
+                    block = False
+                return tasks
+            tasks = [task for task in pending if task.done()]
+            if not tasks and block:
+                tasks = [pending.popleft()]
+            for task in tasks:
+                if task in pending:
+                    pending.remove(task)
+            return tasks
 
-                task = asyncio.ensure_future(self.cor_bound_request(sem,
-                                                                    httpmethod,
-                                                                    resource,
-                                                                    input_param['ids'],
-                                                                    session,
-                                                                    data=input_param['data'],
-                                                                    accept=accept,
-                                                                    content_type=content_type))
-                # create a delay of between calls
-                # to help prevent API rate errors
-                await asyncio.sleep(1/self.max_calls)
-                tasks.append(task)
-            async with rate_limiter:
-                responses = await asyncio.gather(*tasks)
-            return responses
+        try:
+            async for result in _aiter(stream):
+                pending.append(asyncio.ensure_future(finish(result)))
+                if len(pending) >= limit and not ordered:
+                    await asyncio.wait(pending,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                for task in ready(len(pending) >= limit):
+                    yield await task
+            while pending:
+                if not ordered:
+                    await asyncio.wait(pending,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                for task in ready(True):
+                    yield await task
+        finally:
+            for task in pending:
+                task.cancel()
+            if own_executor:
+                executor.shutdown(wait=False)
+
+    async def cor_transform(self, resource, input_params, func,
+                            accept='xml', content_type=None, executor=None,
+                            session=None, workers=None, journal=None,
+                            expected=None):
+        """
+        Async generator updating every record of input_params in one
+        pipeline: each record is fetched (GET resource), func(body)
+        returns its new data, and that is sent back (PUT resource) as soon
+        as it is ready. Yields the Result of every PUT, and the Results of
+        the GETs or funcs that failed.
+
+        - func gets the body as decoded by self.codec (xml as str, json as
+        a dict) and returns the new data, or None to leave the record
+        alone. Records it returns unchanged (see pyalma.diff) are not
+        sent either: both are yielded with status 304 and unchanged=True.
+        - executor runs func, e.g. a ThreadPoolExecutor, or a
+        ProcessPoolExecutor if func is CPU bound (it must then be
+        picklable, see cor_map). By default func runs on the event loop.
+        - content_type of the PUT defaults to accept
+        - journal works as in cor_stream: records already updated are
+        not even fetched
+        - expected is the number of records, if input_params has no len,
+        to check the quota for (see cor_stream)
+
+        The GETs and the PUTs each have workers requests in flight at
+        most, and only a few records wait between the stages, so memory
+        use does not depend on the size of input_params, and the run
+        takes about as long as the slower of the two stages.
+        """
+        if session is None:
+            async with self.cor_session() as session:
+                async for result in self.cor_transform(
+                        resource, input_params, func, accept=accept,
+                        content_type=content_type, executor=executor,
+                        session=session, workers=workers, journal=journal,
+                        expected=expected):
+                    yield result
+            return
+
+        if workers is None:
+            workers = self.semaphore_limit
+        records = self.batch_calls('PUT', resource, input_params, journal,
+                                   expected)
+        if content_type is None:
+            content_type = accept
+        # the Results to yield, from the PUTs and from failures before them
+        out = asyncio.Queue(maxsize=workers)
+
+        async def todo():
+            async for input_param in _aiter(input_params):
+                if journal is None or not journal.succeeded(
+                        'PUT', resource, input_param['ids']):
+                    yield input_param
+
+        # the quota is checked for a GET and a PUT per record
+        gets = self.cor_stream('GET', resource, todo(), accept=accept,
+                               session=session, workers=workers,
+                               expected=(2 * records if records is not None
+                                         else None))
+        if executor is not None:
+            gets = self.cor_map(gets, func, executor=executor, raw=False)
+
+        async def puts():
+            async for result in gets:
+                if result.ok and executor is None:
+                    try:
+                        result = result._replace(body=func(result.body))
+                    except Exception as e:
+                        result = self.exception_result(
+                            result.ids, e, result.attempts, result.elapsed,
+                            result.request)
+                if not result.ok:
+                    await out.put(result)
+                elif result.body is None:
+                    await out.put(Result(
+                        result.ids, 304,
+                        self.decode_content(FORMATS[accept], result.raw),
+                        attempts=0, unchanged=True,
+                        request=self.request_info('PUT', resource,
+                                                  accept=accept,
+                                                  content_type=content_type)))
+                else:
+                    yield {'ids': result.ids, 'data': result.body,
+                           'original': result.raw}
+
+        async def pump():
+            async for result in self.cor_stream('PUT', resource, puts(),
+                                                accept=accept,
+                                                content_type=content_type,
+                                                session=session,
+                                                workers=workers,
+                                                journal=journal):
+                await out.put(result)
+
+        pumping = asyncio.ensure_future(pump())
+        try:
+            while True:
+                get = asyncio.ensure_future(out.get())
+                await asyncio.wait([get, pumping],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if get.done():
+                    yield get.result()
+                    continue
+                get.cancel()
+                # raises any error from the pipeline
+                pumping.result()
+                while not out.empty():
+                    yield out.get_nowait()
+                break
+        finally:
+            pumping.cancel()
+
+    def cor_update(self, resource, input_params, func, accept='xml',
+                   content_type=None, executor=None, journal=None):
+        # input_params includes the ids of resource
+        # returns the Results of cor_transform: every record is fetched,
+        # passed to func, and the new data sent back
+        return self.cor_execute(self.cor_collect(
+            self.cor_transform(resource, input_params, func, accept=accept,
+                               content_type=content_type, executor=executor,
+                               journal=journal)))
+
+    async def cor_stream_bibs(self, input_params, accept='xml',
+                              ordered=False, session=None, workers=None,
+                              expected=None):
+        """
+        Like cor_stream('GET', 'bib', input_params), but fetches up to
+        BIBS_LIMIT bibs per call with GET bibs?mms_id=a,b,c and splits each
+        response back into one (ids, status, bib) per input.
+        MMS IDs missing from a response are yielded with status 404.
+        expected is the number of calls, for the quota (see cor_stream).
+        """
+        async def chunks():
+            chunk = []
+            async for input_param in _aiter(input_params):
+                chunk.append(str(input_param['ids']['mms_id']))
+                if len(chunk) == BIBS_LIMIT:
+                    yield self.bibs_input_param(chunk)
+                    chunk = []
+            if chunk:
+                yield self.bibs_input_param(chunk)
+
+        async for result in self.cor_stream('GET', 'bibs', chunks(),
+                                            accept=accept, ordered=ordered,
+                                            session=session, workers=workers,
+                                            expected=expected):
+            for response in self.split_bibs(result):
+                yield response
+
+    def bibs_input_param(self, mms_ids):
+        # duplicates are only requested once, but answered for every input
+        unique = ','.join(collections.OrderedDict.fromkeys(mms_ids))
+        return {'ids': {'mms_id': ','.join(mms_ids)},
+                'params': {'mms_id': unique}}
+
+    def split_bibs(self, result):
+        """
+        Splits the Result of a GET bibs call into one Result per MMS ID,
+        each of which replays as a GET bib (see cor_replay)
+        """
+        ids, status, body = result
+        mms_ids = ids['mms_id'].split(',')
+        request = self.request_info('GET', 'bib',
+                                    accept=result.request.get('accept'))
+        if not result.ok:
+            for mms_id in mms_ids:
+                yield result._replace(ids={'mms_id': mms_id}, request=request)
+            return
+        bibs = self.split_bibs_body(body, result.request.get('accept'))
+        for mms_id in mms_ids:
+            if mms_id in bibs:
+                yield result._replace(ids={'mms_id': mms_id},
+                                      body=bibs[mms_id], raw=None,
+                                      request=request)
+            else:
+                msg = "\nError in {} \n  HTTP Status: 404\n  Response: MMS ID not returned by GET bibs".format({'mms_id': mms_id})
+                yield result._replace(ids={'mms_id': mms_id}, status=404,
+                                      body=msg, error='client', raw=None,
+                                      request=request)
+
+    def split_bibs_body(self, body, accept):
+        # {mms_id: bib} from a GET bibs body, each bib of the same type as
+        # the body the codec returned (dict, str, bytes or element)
+        if isinstance(body, dict):
+            return dict((str(bib['mms_id']), bib)
+                        for bib in body.get('bib', []))
+        if isinstance(body, (str, bytes)):
+            if accept == 'json':
+                return dict((mms_id, self.codec.dumps(bib))
+                            for mms_id, bib in self.split_bibs_body(
+                                self.codec.loads(body), accept).items())
+            root = ET.fromstring(body)
+            bibs = dict((bib.findtext('mms_id'),
+                         ET.tostring(bib, encoding='unicode'))
+                        for bib in root.findall('bib'))
+            if isinstance(body, bytes):
+                bibs = dict((mms_id, bib.encode('utf-8'))
+                            for mms_id, bib in bibs.items())
+            return bibs
+        return dict((bib.findtext('mms_id'), bib)
+                    for bib in body.findall('bib'))
 
     """
     Each of the below asynchronous methods takes input_params as a variable,
     and returns a list of tuples.
 
-    input_params is a list of dictionaries in the following form:
+    input_params is a list (or any iterable) of dictionaries in the
+    following form:
         [{
             'data': data,
             'ids':  {
@@ -409,159 +1752,129 @@ class Alma(object):
           },
           ...
           ]
+    'data' may be left out for GET and DELETE, and an optional 'params'
+    dictionary is sent as the query string.
 
     Returns a list of tuples in form
         [(ids, status, response),
         ...
         ]
+    Each tuple is a Result, which also carries the error category, number
+    of attempts, timing and raw body of its request. A request that fails
+    does not stop the others, and cor_replay() makes the retryable ones
+    again.
     """
 
-    def cor_get_bib(self, input_params, accept='xml'):
+    def cor_get_bib(self, input_params, accept='xml', journal=None):
         # input_params includes mms_id
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('GET',
-                                                             'bib',
-                                                             input_params,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('GET', 'bib', input_params, accept=accept,
+                              journal=journal)
 
-    def cor_put_bib(self, input_params, content_type='xml', accept='xml'):
+    def cor_get_bibs(self, input_params, accept='xml'):
+        # input_params includes mms_id
+        # same responses as cor_get_bib, with BIBS_LIMIT bibs per call
+        return self.cor_execute(self.cor_collect(
+            self.cor_stream_bibs(input_params, accept=accept, ordered=True)))
+
+    def cor_get_marc(self, input_params, transform=None, processes=None,
+                     lazy=False):
+        # input_params includes mms_id
+        # same responses as cor_get_bib, with the bib parsed into a
+        # pymarc.Record (or transform(record)) in a process pool.
+        # transform must be picklable, see cor_map
+        # lazy=True returns pyalma.marc.MarcView records instead, built
+        # as the responses arrive: no pool, and only the fields read are
+        # ever decoded
+        stream = self.cor_stream('GET', 'bib', input_params, accept='xml',
+                                 ordered=True)
+        if lazy:
+            return self.cor_execute(self.cor_collect(
+                self.cor_marc_views(stream, transform)))
+        func = functools.partial(parse_marc, transform=transform)
+        return self.cor_execute(self.cor_collect(
+            self.cor_map(stream, func, processes=processes, ordered=True)))
+
+    async def cor_marc_views(self, stream, transform=None):
+        """
+        Yields the results of stream with each successful body replaced
+        by its MarcView, or transform(view)
+        """
+        async for result in stream:
+            if result.ok:
+                raw = result.raw if result.raw is not None else result.body
+                try:
+                    view = MarcView.from_bib(raw)
+                    if transform is not None:
+                        view = transform(view)
+                except Exception as e:
+                    result = self.exception_result(result.ids, e,
+                                                   result.attempts,
+                                                   result.elapsed,
+                                                   result.request)
+                else:
+                    result = result._replace(body=view)
+            yield result
+
+    def cor_put_bib(self, input_params, content_type='xml', accept='xml',
+                    journal=None):
         # input_params includes mms_id, data
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('PUT',
-                                                             'bib',
-                                                             input_params,
-                                                             content_type=content_type,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('PUT', 'bib', input_params,
+                              content_type=content_type, accept=accept,
+                              journal=journal)
 
-    def cor_get_holdings(self, input_params, accept='xml'):
+    def cor_get_holdings(self, input_params, accept='xml', journal=None):
         # input_params includes mms_id
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('GET',
-                                                             'holdings',
-                                                             input_params,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('GET', 'holdings', input_params, accept=accept,
+                              journal=journal)
 
-    def cor_get_holding(self, input_params, accept='xml'):
+    def cor_get_holding(self, input_params, accept='xml', journal=None):
         # input_params includes mms_id, holding_id
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('GET',
-                                                             'holding',
-                                                             input_params,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('GET', 'holding', input_params, accept=accept,
+                              journal=journal)
 
     def cor_put_holding(self, input_params, content_type='xml',
-                    accept='xml'):
+                    accept='xml', journal=None):
         # input_params includes mms_id, holding_id, data
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('PUT',
-                                                             'holding',
-                                                             input_params,
-                                                             content_type=content_type,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('PUT', 'holding', input_params,
+                              content_type=content_type, accept=accept,
+                              journal=journal)
 
-    def cor_get_items(self, input_params, accept='xml'):
+    def cor_get_items(self, input_params, accept='xml', journal=None):
         # input_params includes mms_id, holding_id
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('GET',
-                                                             'items',
-                                                             input_params,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('GET', 'items', input_params, accept=accept,
+                              journal=journal)
 
-    def cor_get_item(self, input_params, accept='xml'):
+    def cor_get_item(self, input_params, accept='xml', journal=None):
         # input_params includes mms_id, holding_id, item_pid
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('GET',
-                                                             'item',
-                                                             input_params,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('GET', 'item', input_params, accept=accept,
+                              journal=journal)
 
     def cor_put_item(self, input_params, content_type='xml',
-                 accept='xml'):
+                 accept='xml', journal=None):
         # input_params includes mms_id, holding_id, item_pid, data
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('PUT',
-                                                             'item',
-                                                             input_params,
-                                                             content_type=content_type,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('PUT', 'item', input_params,
+                              content_type=content_type, accept=accept,
+                              journal=journal)
 
-    def cor_get_bib_requests(self, input_params, accept='xml'):
+    def cor_get_bib_requests(self, input_params, accept='xml', journal=None):
         # input_params includes mms_id
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('GET',
-                                                             'bib_requests',
-                                                             input_params,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('GET', 'bib_requests', input_params, accept=accept,
+                              journal=journal)
 
-    def cor_get_item_requests(self, input_params, accept='xml'):
+    def cor_get_item_requests(self, input_params, accept='xml', journal=None):
         # input_params includes mms_id, holding_id, item_pid
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('GET',
-                                                             'item_requests',
-                                                             input_params,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('GET', 'item_requests', input_params, accept=accept,
+                              journal=journal)
 
-    def cor_del_item_request(self, input_params):
+    def cor_del_item_request(self, input_params, journal=None):
         # input_params includes mms_id, holding_id, item_pid, request_id
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('DELETE',
-                                                             'item_request',
-                                                             input_params))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('DELETE', 'item_request', input_params,
+                              journal=journal)
 
-    def cor_del_bib_request(self, input_params):
+    def cor_del_bib_request(self, input_params, journal=None):
         # input_params includes mms_id, request_id
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('DELETE',
-                                                             'bib_request',
-                                                             input_params))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('DELETE', 'bib_request', input_params,
+                              journal=journal)
 
     '''
     WARNING: below methods have not been fully implemented or
@@ -573,99 +1886,51 @@ class Alma(object):
         pass
 
     def cor_post_loan(self, input_params,
-                  content_type='xml', accept='xml'):
+                  content_type='xml', accept='xml', journal=None):
         # input_params includes mms_id, holding_id, item_pid, data
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('POST',
-                                                             'loan',
-                                                             input_params,
-                                                             content_type=content_type,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('POST', 'loan', input_params,
+                              content_type=content_type, accept=accept,
+                              journal=journal)
 
     def cor_post_bib_request(self, input_params,
-                         content_type='xml', accept='xml'):
+                         content_type='xml', accept='xml', journal=None):
         # input_params includes mms_id, data
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('POST',
-                                                             'bib_requests',
-                                                             input_params,
-                                                             content_type=content_type,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('POST', 'bib_requests', input_params,
+                              content_type=content_type, accept=accept,
+                              journal=journal)
 
     def cor_post_item_request(self, input_params,
-                          content_type='xml', accept='xml'):
+                          content_type='xml', accept='xml', journal=None):
         # input_params includes mms_id, holding_id, item_pid, data
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('POST',
-                                                             'item_requests',
-                                                             input_params,
-                                                             content_type=content_type,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('POST', 'item_requests', input_params,
+                              content_type=content_type, accept=accept,
+                              journal=journal)
 
     def cor_put_bib_request(self, input_params,
-                            content_type='xml', accept='xml'):
+                            content_type='xml', accept='xml', journal=None):
         # input_params includes mms_id, request_id, data
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('PUT',
-                                                             'bib_request',
-                                                             input_params,
-                                                             content_type=content_type,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('PUT', 'bib_request', input_params,
+                              content_type=content_type, accept=accept,
+                              journal=journal)
 
     def cor_put_item_request(self, input_params,
-                             content_type='xml', accept='xml'):
+                             content_type='xml', accept='xml', journal=None):
         # input_params includes mms_id, holding_id, item_pid, request_id, data
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('PUT',
-                                                             'item_request',
-                                                             input_params,
-                                                             content_type=content_type,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('PUT', 'item_request', input_params,
+                              content_type=content_type, accept=accept,
+                              journal=journal)
 
-    def cor_get_bib_booking_availability(self, input_params, accept='xml'):
+    def cor_get_bib_booking_availability(self, input_params, accept='xml',
+                                         journal=None):
         # input_params includes mms_id
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('GET',
-                                                             'bib_booking_availability',
-                                                             input_params,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('GET', 'bib_booking_availability',
+                              input_params, accept=accept, journal=journal)
 
     def cor_get_item_booking_availability(
-            self, input_params, accept='xml'):
+            self, input_params, accept='xml', journal=None):
         # input_params includes mms_id, holding_id, item_pid
-        loop = asyncio.get_event_loop()
-        try:
-            responses = loop.run_until_complete(self.cor_run('GET',
-                                                             'item_booking_availability',
-                                                             input_params,
-                                                             accept=accept))
-        finally:
-            loop.close()
-        return responses
+        return self.cor_batch('GET', 'item_booking_availability',
+                              input_params, accept=accept, journal=journal)
 
     def cor_get_digreps(self, input_params, accept='json'):
         pass
@@ -680,12 +1945,285 @@ class Alma(object):
         pass
 
 
+def _exception_error(exception):
+    """
+    Returns the Result error category of an exception
+    """
+    if isinstance(exception, (asyncio.TimeoutError,
+                              requests.exceptions.Timeout)):
+        return 'timeout'
+    if isinstance(exception, RETRY_ERRORS + COR_RETRY_ERRORS):
+        return 'connection'
+    if isinstance(exception, QuotaExceeded):
+        return 'quota'
+    return 'exception'
+
+
+async def _aiter(iterable):
+    """
+    Iterates over an iterable or an async iterable
+    """
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+class AsyncAlma(Alma):
+    """
+    Alma client for code that already runs inside an event loop, such as
+    a web application or a Jupyter notebook.
+
+    One ClientSession is kept open for the lifetime of the client, so
+    every call and batch reuses warm connections. The convenience methods
+    and the cor_* batch methods return awaitables:
+
+        async with AsyncAlma() as api:
+            bib = await api.get_bib(mms_id)
+            responses = await api.cor_get_bib(input_params)
+    """
+
+    def __init__(self, apikey=__apikey__, region=__region__,
+                 connector_limit=CONNECTOR_LIMIT,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, **kwargs):
+        super().__init__(apikey, region, **kwargs)
+        self.connector_limit = connector_limit
+        self.keepalive_timeout = keepalive_timeout
+        self._client_session = None
+
+    @property
+    def client_session(self):
+        """
+        The ClientSession shared by all calls, opened on first use
+        """
+        if self._client_session is None or self._client_session.closed:
+            self._client_session = self.cor_session()
+        return self._client_session
+
+    async def close(self):
+        """
+        Closes the ClientSession and the pooled synchronous connections
+        """
+        if self._client_session is not None:
+            await self._client_session.close()
+            self._client_session = None
+        super().close()
+
+    def __enter__(self):
+        raise TypeError("AsyncAlma closes asynchronously, "
+                        "use 'async with AsyncAlma() as api' instead")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def request_content(self, httpmethod, resource, ids={}, params={},
+                              data=None, accept='json', content_type=None):
+        """
+        Awaits cor_request() on the shared session and returns the body.
+        Raises AsyncHTTPError for error responses, and the exception that
+        ended the call for any other failure.
+        """
+        result = await self.request_result(httpmethod, resource, ids,
+                                           params=params, data=data,
+                                           accept=accept,
+                                           content_type=content_type)
+        return result.body
+
+    async def request_model(self, httpmethod, resource, ids={}, params={},
+                            data=None, accept='json', content_type=None):
+        """
+        Awaits cor_request() on the shared session and returns the record
+        as a pyalma.models.Model (see Alma.request_model). Raises as
+        request_content() does.
+        """
+        result = await self.request_result(httpmethod, resource, ids,
+                                           params=params, data=data,
+                                           accept=accept,
+                                           content_type=content_type)
+        return MODELS[resource].from_result(result)
+
+    async def request_result(self, httpmethod, resource, ids={}, params={},
+                             data=None, accept='json', content_type=None):
+        # the Result of a successful call, for the methods above
+        result = await self.cor_request(httpmethod, resource, ids,
+                                        self.client_session, params=params,
+                                        data=data, accept=accept,
+                                        content_type=content_type)
+        if result.exception is not None:
+            raise result.exception
+        if not result.ok:
+            raise AsyncHTTPError(result.ids, result.status, result.body)
+        return result
+
+    def cor_execute(self, coro):
+        """
+        Returns the coroutine for the caller to await
+        """
+        return coro
+
+    async def request_stream(self, httpmethod, resource, ids={}, params={},
+                             chunk_size=CHUNK_SIZE):
+        """
+        Async generator version of Alma.request_stream(), reading the body
+        from the shared session as it arrives.
+
+        As in cor_send(), the call waits for the rate limiter and the
+        quota, is reported to the hooks and is made again as
+        self.retry_policy allows, until the body has begun to arrive.
+        Raises AsyncHTTPError for error responses, and QuotaExceeded once
+        the daily quota is used up.
+        """
+        begin = time.monotonic()
+        self.emit('start', httpmethod, resource, ids=ids)
+        attempt = 0
+        received = 0
+        # reported unless the stream is read to the end or fails: it was
+        # closed early or cancelled
+        end_status, error = None, 'cancelled'
+        try:
+            while True:
+                attempt += 1
+                await self.cor_wait(httpmethod, resource, ids)
+                try:
+                    async with self.client_session.request(
+                            method=httpmethod,
+                            headers=self.headers(accept='xml'),
+                            url=self.fullurl(resource, ids),
+                            params=params) as response:
+                        status = response.status
+                        self.quota.update(response.headers)
+                        if status < 400:
+                            parser = ElementParser(LIST_RESOURCES[resource])
+                            while True:
+                                chunk = await response.content.read(
+                                    chunk_size)
+                                if not chunk:
+                                    break
+                                received += len(chunk)
+                                for element in parser.feed(chunk):
+                                    yield element
+                            for element in parser.close():
+                                yield element
+                            break
+                        retry_after = response.headers.get('Retry-After')
+                        body = await response.text()
+                except COR_RETRY_ERRORS as e:
+                    # records already yielded cannot be taken back
+                    if received or not await self.cor_retry(
+                            httpmethod, resource, ids, attempt,
+                            error=_exception_error(e)):
+                        raise
+                    continue
+                if status == 429 and DAILY_THRESHOLD in body:
+                    self.quota.exhausted()
+                    raise QuotaExceeded(
+                        'Alma refused the call: daily API threshold '
+                        'reached') from AsyncHTTPError(ids, status, body)
+                if not await self.cor_retry(httpmethod, resource, ids,
+                                            attempt, status=status,
+                                            retry_after=retry_after):
+                    raise AsyncHTTPError(ids, status, body)
+            end_status, error = status, None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            end_status = getattr(e, 'status', None)
+            error = (status_error(end_status) if end_status
+                     else _exception_error(e))
+            received = None
+            raise
+        finally:
+            self.emit('end', httpmethod, resource, ids=ids,
+                      status=end_status, error=error, attempts=attempt,
+                      elapsed=time.monotonic() - begin, bytes=received)
+
+    async def iter_pages(self, resource, ids={}, params={}, limit=PAGE_LIMIT,
+                         prefetch=PAGE_PREFETCH):
+        """
+        Async generator version of Alma.iter_pages(): the prefetched
+        pages are requested concurrently on the shared session.
+        """
+        key = LIST_RESOURCES[resource]
+        page = await self.get_page(resource, ids, params, limit)
+        total = page.get('total_record_count', 0)
+        for record in page.get(key, []):
+            yield record
+        offsets = iter(range(limit, total, limit))
+        pages = collections.deque(
+            asyncio.ensure_future(self.get_page(resource, ids, params, limit,
+                                                offset))
+            for offset in itertools.islice(offsets, max(prefetch, 1)))
+        try:
+            while pages:
+                page = await pages.popleft()
+                for offset in itertools.islice(offsets, 1):
+                    pages.append(asyncio.ensure_future(
+                        self.get_page(resource, ids, params, limit, offset)))
+                for record in page.get(key, []):
+                    yield record
+        finally:
+            for task in pages:
+                task.cancel()
+
+    def cor_stream(self, httpmethod, resource, input_params, accept='xml',
+                   content_type=None, ordered=False, session=None,
+                   workers=None, journal=None, expected=None):
+        """
+        Alma.cor_stream() on the shared session
+        """
+        if session is None:
+            session = self.client_session
+        return super().cor_stream(httpmethod, resource, input_params,
+                                  accept=accept, content_type=content_type,
+                                  ordered=ordered, session=session,
+                                  workers=workers, journal=journal,
+                                  expected=expected)
+
+    def cor_transform(self, resource, input_params, func, accept='xml',
+                      content_type=None, executor=None, session=None,
+                      workers=None, journal=None, expected=None):
+        """
+        Alma.cor_transform() on the shared session
+        """
+        if session is None:
+            session = self.client_session
+        return super().cor_transform(resource, input_params, func,
+                                     accept=accept, content_type=content_type,
+                                     executor=executor, session=session,
+                                     workers=workers, journal=journal,
+                                     expected=expected)
+
+    def cor_walk(self, input_params, depth=2, session=None, workers=None,
+                 limit=PAGE_LIMIT):
+        """
+        Alma.cor_walk() on the shared session
+        """
+        if session is None:
+            session = self.client_session
+        return super().cor_walk(input_params, depth=depth, session=session,
+                                workers=workers, limit=limit)
+
+
 class HTTPError(Exception):
 
     def __init__(self, response):
+        self.status = response.status_code
         super().__init__(self.msg(response))
 
     def msg(self, response):
         msg = "\n  HTTP Status: {}\n  Method: {}\n  URL: {}\n  Response: {}"
         return msg.format(response.status_code, response.request.method,
                           response.url, response.text)
+
+
+class AsyncHTTPError(HTTPError):
+
+    def __init__(self, ids, status, msg):
+        self.ids = ids
+        self.status = status
+        Exception.__init__(self, msg)
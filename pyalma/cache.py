@@ -0,0 +1,299 @@
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+CACHE_MAXSIZE = 1024
+CACHE_TTL = 300
+
+# SQLiteCache settings
+SQLITE_MAXSIZE = 100000
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+SQLITE_TIMEOUT = 30
+
+# invalidated paths remembered to tell stale responses from fresh ones
+GENERATIONS_MAXSIZE = 4096
+
+
+class BaseCache(object):
+    """
+    Key and ttl handling shared by the cache stores.
+
+    - ttl is the number of seconds a response is served from the cache
+    - ttls maps resource names (see alma.RESOURCES) to their own ttl,
+    e.g. {'bib': 3600, 'item': 60}. A ttl of 0 turns caching off for
+    that resource.
+
+    Entries are (status, content_type, content) tuples, content being the
+    raw bytes of the response body, so every hit is decoded afresh and
+    callers never share a mutable record.
+
+    A GET that was sent before a write to its record may finish after it:
+    set() drops its entry, so the writer does not read the record it has
+    just changed back from the cache. Writes are only seen by the process
+    that makes them.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, ttls=None):
+        self.ttl = ttl
+        self.ttls = dict(ttls or {})
+        self._lock = threading.Lock()
+        # counts the invalidations. _invalidated holds the count when each
+        # path was last invalidated, _below when a path below it was.
+        self._generation = 0
+        self._invalidated = collections.OrderedDict()
+        self._below = collections.OrderedDict()
+        # every generation before it is treated as stale, once older
+        # invalidations have been forgotten
+        self._floor = 0
+
+    def key(self, httpmethod, resource, path, params={}, accept='json'):
+        params = tuple(sorted((str(k), str(v)) for k, v in params.items()))
+        return (httpmethod, resource, path, params, accept)
+
+    def ttl_for(self, resource):
+        return self.ttls.get(resource, self.ttl)
+
+    def generation(self):
+        """
+        Returns the generation to pass to set() for a response requested
+        from now on
+        """
+        return self._generation
+
+    def _stale(self, path, generation):
+        # whether a path related to path was invalidated after generation
+        if generation is None:
+            return False
+        if generation < self._floor:
+            return True
+        parts = path.strip('/').split('/')
+        for n in range(1, len(parts) + 1):
+            if self._invalidated.get('/'.join(parts[:n]), 0) > generation:
+                return True
+        return self._below.get('/'.join(parts), 0) > generation
+
+    def _invalidate(self, path):
+        self._generation += 1
+        parts = path.strip('/').split('/')
+        for n in range(1, len(parts)):
+            self._stamp(self._below, '/'.join(parts[:n]))
+        self._stamp(self._invalidated, '/'.join(parts))
+
+    def _stamp(self, stamps, path):
+        stamps[path] = self._generation
+        stamps.move_to_end(path)
+        while len(stamps) > GENERATIONS_MAXSIZE:
+            self._floor = max(self._floor, stamps.popitem(last=False)[1])
+
+
+class MemoryCache(BaseCache):
+    """
+    In-memory cache of GET responses, shared by the synchronous and the
+    coroutine methods of a client created with Alma(cache=MemoryCache()).
+
+    - maxsize is the number of responses kept. Once it is full, the least
+    recently used response is dropped.
+    - ttl and ttls: see BaseCache
+    """
+
+    def __init__(self, maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL, ttls=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        super().__init__(ttl, ttls)
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        """
+        Returns the entry stored under key, or None if it is missing or
+        has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, generation=None):
+        """
+        Stores value under key, unless the path of key has been
+        invalidated since generation (see generation())
+        """
+        ttl = self.ttl_for(key[1])
+        if ttl <= 0:
+            return
+        with self._lock:
+            if self._stale(key[2], generation):
+                return
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path):
+        """
+        Drops every entry whose path contains path or is contained in it:
+        a write to bibs/1/holdings/2/items/3 drops that item, the item
+        list of its holding, the holding and the bib.
+        """
+        with self._lock:
+            self._invalidate(path)
+            stale = [key for key in self._entries
+                     if _related(key[2], path)]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(BaseCache):
+    """
+    Cache of GET responses in an SQLite database file, shared by every
+    process and thread that opens the same path, and kept across restarts:
+    Alma(cache=SQLiteCache('/var/cache/pyalma.db')).
+
+    The database runs in WAL mode, so readers never wait for a writer or
+    for each other, and is memory-mapped (SQLITE_MMAP_SIZE), so reads
+    come straight from the page cache rather than through read() calls.
+    Each thread of each process opens its own connection.
+
+    - maxsize is the number of responses kept. Once it is full, the
+    oldest responses are dropped (by the time they were stored, not
+    last read, so reads never write to the database).
+    - ttl and ttls: see BaseCache. Expiry uses the wall clock, as it is
+    compared across processes.
+    """
+
+    def __init__(self, path, maxsize=SQLITE_MAXSIZE, ttl=CACHE_TTL,
+                 ttls=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        super().__init__(ttl, ttls)
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        with self.connection as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, path TEXT, status INTEGER, '
+                'content_type TEXT, content BLOB, stored_at REAL, '
+                'expires REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS responses_path '
+                               'ON responses (path)')
+            connection.execute('CREATE INDEX IF NOT EXISTS responses_stored '
+                               'ON responses (stored_at)')
+
+    @property
+    def connection(self):
+        """
+        The connection of the current thread (and process)
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'PRAGMA mmap_size={:d}'.format(SQLITE_MMAP_SIZE))
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.connection = None
+
+    def get(self, key):
+        """
+        Returns the entry stored under key, or None if it is missing or
+        has expired
+        """
+        row = self.connection.execute(
+            'SELECT status, content_type, content FROM responses '
+            'WHERE key = ? AND expires > ?',
+            (json.dumps(key), time.time())).fetchone()
+        if row is None:
+            return None
+        return tuple(row)
+
+    def set(self, key, value, generation=None):
+        """
+        Stores value under key, unless the path of key has been
+        invalidated since generation (see MemoryCache.set)
+        """
+        ttl = self.ttl_for(key[1])
+        if ttl <= 0:
+            return
+        status, ctype, content = value
+        now = time.time()
+        with self._lock, self.connection as connection:
+            if self._stale(key[2], generation):
+                return
+            connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (json.dumps(key), key[2], status, ctype,
+                 sqlite3.Binary(content), now, now + ttl))
+            size, = connection.execute(
+                'SELECT COUNT(*) FROM responses').fetchone()
+            if size > self.maxsize:
+                connection.execute(
+                    'DELETE FROM responses WHERE key IN (SELECT key FROM '
+                    'responses ORDER BY stored_at LIMIT ?)',
+                    (size - self.maxsize,))
+
+    def invalidate(self, path):
+        """
+        Drops every entry whose path contains path or is contained in it
+        (see MemoryCache.invalidate)
+        """
+        parts = path.strip('/').split('/')
+        paths = ['/'.join(parts[:n]) for n in range(1, len(parts) + 1)]
+        prefix = paths[-1].replace('\\', '\\\\').replace(
+            '%', '\\%').replace('_', '\\_') + '/%'
+        with self._lock, self.connection as connection:
+            self._invalidate(path)
+            connection.execute(
+                'DELETE FROM responses WHERE path IN ({}) '
+                "OR path LIKE ? ESCAPE '\\'".format(
+                    ', '.join('?' * len(paths))),
+                paths + [prefix])
+
+    def purge(self):
+        """
+        Deletes expired entries
+        """
+        with self.connection as connection:
+            connection.execute('DELETE FROM responses WHERE expires <= ?',
+                               (time.time(),))
+
+    def clear(self):
+        with self.connection as connection:
+            connection.execute('DELETE FROM responses')
+
+    def __len__(self):
+        size, = self.connection.execute(
+            'SELECT COUNT(*) FROM responses').fetchone()
+        return size
+
+
+def _related(path, other):
+    path = path.strip('/').split('/')
+    other = other.strip('/').split('/')
+    size = min(len(path), len(other))
+    return path[:size] == other[:size]
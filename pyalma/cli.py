@@ -0,0 +1,400 @@
+"""
+Command line batch runner:
+
+    pyalma get_bib mms.csv -o bibs.jsonl
+    pyalma put_item items.csv -o put.csv --journal put.journal
+
+Input rows are read lazily from CSV or JSON lines, fed to cor_stream()
+and every result is written as soon as it arrives, so neither file has
+to fit in memory. Run pyalma --help for the options.
+"""
+import argparse
+import ast
+import csv
+import json
+import os
+import sys
+import time
+
+from pyalma import alma
+from pyalma.journal import Journal
+from pyalma.metrics import Metrics
+from pyalma.quota import Quota, QuotaExceeded
+from pyalma.ratelimit import TokenBucket
+from pyalma.retry import RetryPolicy
+from pyalma.tracing import PHASES
+
+
+# operation name: (httpmethod, resource), as in the cor_* batch methods
+OPERATIONS = {
+    'get_bib': ('GET', 'bib'),
+    'get_bibs': ('GET', 'bibs'),
+    'put_bib': ('PUT', 'bib'),
+    'get_holdings': ('GET', 'holdings'),
+    'get_holding': ('GET', 'holding'),
+    'put_holding': ('PUT', 'holding'),
+    'get_items': ('GET', 'items'),
+    'get_item': ('GET', 'item'),
+    'put_item': ('PUT', 'item'),
+    'get_bib_requests': ('GET', 'bib_requests'),
+    'get_item_requests': ('GET', 'item_requests'),
+    'del_item_request': ('DELETE', 'item_request'),
+    'del_bib_request': ('DELETE', 'bib_request'),
+    'post_loan': ('POST', 'loan'),
+    'post_bib_request': ('POST', 'bib_requests'),
+    'post_item_request': ('POST', 'item_requests'),
+    'put_bib_request': ('PUT', 'bib_request'),
+    'put_item_request': ('PUT', 'item_request'),
+    'get_bib_booking_availability': ('GET', 'bib_booking_availability'),
+    'get_item_booking_availability': ('GET', 'item_booking_availability'),
+}
+
+PROGRESS_INTERVAL = 2
+
+
+def parser():
+    parser = argparse.ArgumentParser(
+        prog='pyalma',
+        description='Runs a batch of Alma API calls, one per input row.')
+    parser.add_argument('operation', choices=sorted(OPERATIONS),
+                        help='the cor_* batch method to run, without cor_')
+    parser.add_argument('input', help='CSV or JSON lines file, - for stdin')
+    parser.add_argument('-o', '--output', default='-',
+                        help='CSV or JSON lines file, - for stdout '
+                             '(the default)')
+    parser.add_argument('--input-format', choices=['csv', 'jsonl'],
+                        help='default: from the file extension, else jsonl')
+    parser.add_argument('--output-format', choices=['csv', 'jsonl'],
+                        help='default: from the file extension, else jsonl')
+    parser.add_argument('--accept', choices=sorted(alma.FORMATS),
+                        default='xml')
+    parser.add_argument('--content-type', choices=sorted(alma.FORMATS),
+                        default='xml')
+    parser.add_argument('--apikey', default=alma.__apikey__,
+                        help='default: $ALMA_API_KEY')
+    parser.add_argument('--region', default=alma.__region__,
+                        help='default: $ALMA_API_REGION')
+    parser.add_argument('--concurrency', type=int, default=alma.SEMAPHORE_LIM,
+                        help='requests in flight at once')
+    parser.add_argument('--rate', type=float, default=alma.MAX_CALLS_PER_SEC,
+                        help='calls per second')
+    parser.add_argument('--burst', type=int, default=alma.RATE_LIMIT_BURST)
+    parser.add_argument('--max-attempts', type=int,
+                        default=alma.MAX_ATTEMPTS,
+                        help='calls per request, retries included')
+    parser.add_argument('--quota-reserve', type=int, default=0,
+                        help='stop once this many calls are left in the '
+                             'daily API quota')
+    parser.add_argument('--quota-wait', action='store_true',
+                        help='wait for the daily quota to be reset '
+                             'instead of stopping')
+    parser.add_argument('--expected-calls', type=int,
+                        help='calls the run will make (e.g. the number of '
+                             'rows), to refuse to start it if the daily '
+                             'quota has fewer left')
+    parser.add_argument('--journal',
+                        help='journal file: rows that already succeeded '
+                             'are skipped, so a failed run can be resumed')
+    parser.add_argument('--ordered', action='store_true',
+                        help='write results in input order')
+    parser.add_argument('--metrics',
+                        help='file to write request metrics to at the '
+                             'end, in the Prometheus text format')
+    parser.add_argument('--trace', action='store_true',
+                        help='time the phases of every call (pool wait, '
+                             'DNS, connect, time to first byte, transfer) '
+                             'and report them at the end')
+    parser.add_argument('--quiet', action='store_true',
+                        help='no progress report on stderr')
+    return parser
+
+
+def main(argv=None):
+    arguments = parser()
+    args = arguments.parse_args(argv)
+    if args.journal and OPERATIONS[args.operation][1] == 'bibs':
+        # the bibs are fetched in chunks that the journal cannot record
+        arguments.error('--journal is not supported by {}'.format(
+            args.operation))
+    api = alma.Alma(args.apikey, args.region,
+                    rate_limiter=TokenBucket(args.rate, args.burst),
+                    retry_policy=RetryPolicy(max_attempts=args.max_attempts),
+                    quota=Quota(reserve=args.quota_reserve,
+                                wait=args.quota_wait),
+                    tracing=args.trace)
+    api.semaphore_limit = args.concurrency
+    metrics = Metrics() if args.metrics or args.trace else None
+    if metrics is not None:
+        api.hooks.append(metrics)
+    input_format = args.input_format or file_format(args.input)
+    output_format = args.output_format or file_format(args.output)
+    journal = Journal(args.journal) if args.journal else None
+    try:
+        with open_input(args.input) as source, \
+                open_output(args.output) as target:
+            rows = source.read_rows(input_format)
+            write = writer(target, output_format)
+            progress = None if args.quiet else Progress(source,
+                                                        quota=api.quota,
+                                                        metrics=metrics)
+            try:
+                errors = api.cor_execute(run(api, args, rows, write,
+                                             progress, journal))
+            except QuotaExceeded as e:
+                sys.stderr.write('Stopped: {}\n'.format(e))
+                errors = 1
+    finally:
+        if journal is not None:
+            journal.close()
+        if args.metrics:
+            with open(args.metrics, 'w') as f:
+                f.write(metrics.prometheus())
+        api.close()
+    return 1 if errors else 0
+
+
+async def run(api, args, rows, write, progress, journal):
+    """
+    Streams rows through the operation, writes each result, returns the
+    number of errors
+    """
+    httpmethod, resource = OPERATIONS[args.operation]
+    if resource == 'bibs':
+        stream = api.cor_stream_bibs(rows, accept=args.accept,
+                                     ordered=args.ordered,
+                                     workers=args.concurrency,
+                                     expected=args.expected_calls)
+    else:
+        content_type = args.content_type
+        if httpmethod not in ('PUT', 'POST'):
+            content_type = None
+        stream = api.cor_stream(httpmethod, resource, rows,
+                                accept=args.accept,
+                                content_type=content_type,
+                                ordered=args.ordered,
+                                workers=args.concurrency, journal=journal,
+                                expected=args.expected_calls)
+    errors = 0
+    async for result in stream:
+        write(result)
+        if not result.ok:
+            errors += 1
+        if progress is not None:
+            progress.update(result)
+    if progress is not None:
+        progress.report(final=True)
+    return errors
+
+
+def file_format(path):
+    if path.lower().endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+
+class open_input(object):
+    """
+    Opens the input in binary mode (stdin for -), for LineReader
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        if self.path == '-':
+            self.handle = sys.stdin.buffer
+            self.reader = LineReader(self.handle)
+        else:
+            self.handle = open(self.path, 'rb')
+            self.reader = LineReader(self.handle,
+                                     os.path.getsize(self.path))
+        return self.reader
+
+    def __exit__(self, *exc_info):
+        if self.handle is not sys.stdin.buffer:
+            self.handle.close()
+
+
+class open_output(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        if self.path == '-':
+            self.handle = sys.stdout
+        else:
+            self.handle = open(self.path, 'w', encoding='utf-8', newline='')
+        return self.handle
+
+    def __exit__(self, *exc_info):
+        if self.handle is sys.stdout:
+            self.handle.flush()
+        else:
+            self.handle.close()
+
+
+class LineReader(object):
+    """
+    Reads the rows of a binary file lazily, counting the bytes and rows
+    read so far for the progress report
+    """
+
+    def __init__(self, handle, size=None):
+        self.handle = handle
+        self.size = size
+        self.bytes_read = 0
+        self.rows_read = 0
+
+    def __iter__(self):
+        for line in self.handle:
+            if not self.bytes_read and line.startswith(b'\xef\xbb\xbf'):
+                line = line[3:]
+            self.bytes_read += len(line)
+            yield line.decode('utf-8')
+
+    def read_rows(self, input_format):
+        """
+        Yields input_params one at a time from CSV or JSON lines.
+
+        A row either has an 'ids' column (a JSON object) or one column
+        per id (mms_id, holding_id, item_pid, request_id, user_id), plus
+        optional 'data', 'original' (the record before it was edited: a
+        PUT is skipped if data is the same) and 'params' (a JSON object)
+        columns. Empty values and columns without a name are ignored.
+        """
+        if input_format == 'csv':
+            rows = csv.DictReader(self)
+        else:
+            rows = (json.loads(line) for line in self if line.strip())
+        for row in rows:
+            self.rows_read += 1
+            yield input_param(row)
+
+
+def input_param(row):
+    # with an 'ids' column, other columns (e.g. the status of an earlier
+    # run) are ignored
+    param = {'ids': {}, 'data': row.get('data') or None}
+    if row.get('original'):
+        param['original'] = row['original']
+    if row.get('params'):
+        param['params'] = parse_object(row['params'])
+    if 'ids' in row:
+        param['ids'] = parse_object(row['ids'])
+        return param
+    for key, value in row.items():
+        if (key and key not in ('data', 'params', 'original') and
+                value not in (None, '')):
+            param['ids'][key] = value
+    return param
+
+
+def parse_object(value):
+    if isinstance(value, dict):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        # files written by older scripts, with str(dict) in the column
+        return ast.literal_eval(value)
+
+
+def writer(handle, output_format):
+    """
+    Returns a function writing one result to handle. CSV output has the
+    ids, status and data columns read_rows() accepts, so the output of a
+    GET can be edited and fed to the matching PUT.
+    """
+    if output_format == 'csv':
+        csvwriter = csv.writer(handle)
+        csvwriter.writerow(['ids', 'status', 'error', 'data'])
+
+        def write(result):
+            body = result.body
+            if not isinstance(body, str):
+                body = json.dumps(body)
+            csvwriter.writerow([json.dumps(result.ids, default=str),
+                                result.status, result.error or '', body])
+    else:
+        def write(result):
+            handle.write(json.dumps({'ids': result.ids,
+                                     'status': result.status,
+                                     'error': result.error,
+                                     'attempts': result.attempts,
+                                     'elapsed': round(result.elapsed, 3),
+                                     'unchanged': result.unchanged,
+                                     'data': result.body},
+                                    default=str) + '\n')
+    return write
+
+
+class Progress(object):
+    """
+    Reports the throughput, and for files an estimate of the time left,
+    on stderr every PROGRESS_INTERVAL seconds. At the end, the phases of
+    the traced calls are reported from metrics, if given.
+    """
+
+    def __init__(self, reader, stream=None, interval=PROGRESS_INTERVAL,
+                 quota=None, metrics=None):
+        self.reader = reader
+        self.quota = quota
+        self.metrics = metrics
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.begin = self.reported = time.monotonic()
+        self.done = 0
+        self.errors = 0
+        self.unchanged = 0
+
+    def update(self, result):
+        self.done += 1
+        if not result.ok:
+            self.errors += 1
+        if result.unchanged:
+            self.unchanged += 1
+        if time.monotonic() - self.reported >= self.interval:
+            self.report()
+
+    def report(self, final=False):
+        now = time.monotonic()
+        self.reported = now
+        elapsed = now - self.begin
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        line = '{} done, {} errors, {:.1f}/s, {:.0f}s elapsed'.format(
+            self.done, self.errors, rate, elapsed)
+        if self.unchanged:
+            line += ', {} unchanged (not sent)'.format(self.unchanged)
+        remaining = self.quota.remaining if self.quota is not None else None
+        if remaining is not None:
+            line += ', {} calls left today'.format(remaining)
+        size = self.reader.size
+        read = self.reader.bytes_read
+        if not final and size and read and rate:
+            # rows are read ahead of the results: estimate the total rows
+            # from the share of the file read so far
+            total = self.reader.rows_read * size / read
+            left = max(0, total - self.done) / rate
+            line += ', about {:.0f}s left'.format(left)
+        self.stream.write(line + ('\n' if final else '\r'))
+        if final and self.metrics is not None:
+            self.report_phases()
+        self.stream.flush()
+
+    def report_phases(self):
+        for name, summary in sorted(self.metrics.summary().items()):
+            if not summary['phases']:
+                continue
+            phases = ', '.join('{} {:.3f}s'.format(phase,
+                                                   summary['phases'][phase])
+                               for phase in PHASES)
+            connections = summary['connections']
+            self.stream.write(
+                '{}: {} per call, {} new and {} reused connections\n'.format(
+                    name, phases, connections.get('new', 0),
+                    connections.get('reused', 0)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import json
+import xml.etree.ElementTree as ET
+
+# optional faster backends, used when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+
+class Codec(object):
+    """
+    Decodes response bodies and encodes request bodies for a client
+    (see Alma.codec).
+
+    - json bodies are decoded into dicts, with orjson if it is installed,
+    else with the json module
+    - xml bodies are returned as str by default. xml_tree=True parses
+    them into elements instead, with lxml if it is installed, else with
+    xml.etree.ElementTree.
+    - request data may be a str or bytes (sent as is), a dict for json,
+    an element for xml, or a pyalma.models.Model
+    """
+
+    def __init__(self, xml_tree=False):
+        self.xml_tree = xml_tree
+
+    @property
+    def json_backend(self):
+        return 'orjson' if orjson is not None else 'json'
+
+    @property
+    def xml_backend(self):
+        return 'lxml' if lxml_etree is not None else 'xml.etree'
+
+    def decode(self, ctype, content):
+        if 'json' in ctype:
+            return self.loads(content)
+        if self.xml_tree and 'xml' in ctype:
+            return self.parse_xml(content)
+        return content.decode('utf-8')
+
+    def encode(self, data, content_type=None):
+        if data is None or isinstance(data, (str, bytes)):
+            return data
+        if hasattr(data, '__bytes__'):
+            # a pyalma.models.Model, sent as it was received
+            return bytes(data)
+        if content_type == 'json' or isinstance(data, (dict, list)):
+            return self.dumps(data)
+        if lxml_etree is not None and isinstance(data, lxml_etree._Element):
+            return lxml_etree.tostring(data, encoding='utf-8')
+        return ET.tostring(data, encoding='utf-8')
+
+    def loads(self, content):
+        if orjson is not None:
+            return orjson.loads(content)
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        return json.loads(content)
+
+    def dumps(self, obj):
+        """
+        Returns obj encoded as json bytes
+        """
+        if orjson is not None:
+            return orjson.dumps(obj)
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def parse_xml(self, content):
+        if lxml_etree is not None:
+            return lxml_etree.fromstring(content)
+        return ET.fromstring(content)
+
+
+class RawCodec(Codec):
+    """
+    Skips decoding: every response body is returned as the bytes
+    received, for callers that store or forward them untouched.
+    """
+
+    def decode(self, ctype, content):
+        return content
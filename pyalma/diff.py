@@ -0,0 +1,73 @@
+"""
+Change detection for GET-modify-PUT jobs.
+
+canonical() reduces a record to a form that only changes when its
+content does: json with sorted keys and no insignificant whitespace,
+xml with sorted attributes and the whitespace around elements removed.
+Alma.cor_stream() compares the data of a PUT with the 'original' of its
+input_param this way, and does not send PUTs that change nothing.
+"""
+import json
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+from pyalma.codec import Codec
+
+
+_codec = Codec()
+
+
+def unchanged(original, data, format=None):
+    """
+    Whether data is the same record as original. Either may be the body
+    as str or bytes, a dict for json, an element for xml, or a
+    pyalma.models.Model. A body that cannot be parsed is never the same.
+    """
+    try:
+        return canonical(original, format) == canonical(data, format)
+    except (ValueError, ET.ParseError):
+        return False
+
+
+def canonical(body, format=None):
+    """
+    Returns body in canonical form, as a str
+    """
+    if hasattr(body, '__bytes__') and getattr(body, 'format', None):
+        body, format = bytes(body), body.format
+    if format is None:
+        format = body_format(body)
+    if format == 'json':
+        if isinstance(body, (str, bytes)):
+            body = _codec.loads(body)
+        return json.dumps(body, sort_keys=True, separators=(',', ':'),
+                          ensure_ascii=False)
+    if isinstance(body, (str, bytes)):
+        body = ET.fromstring(body)
+    parts = []
+    _canonical_element(body, parts)
+    return ''.join(parts)
+
+
+def body_format(body):
+    if isinstance(body, (dict, list)):
+        return 'json'
+    if isinstance(body, bytes):
+        return 'xml' if body.lstrip()[:1] == b'<' else 'json'
+    if isinstance(body, str):
+        return 'xml' if body.lstrip()[:1] == '<' else 'json'
+    return 'xml'
+
+
+def _canonical_element(element, parts):
+    # <tag a="1" b="2">text<child></child>tail</tag>, with the
+    # attributes sorted and the text stripped
+    parts.append('<' + element.tag)
+    for name, value in sorted(element.attrib.items()):
+        parts.append(' {}={}'.format(name, quoteattr(value)))
+    parts.append('>')
+    parts.append(escape((element.text or '').strip()))
+    for child in element:
+        _canonical_element(child, parts)
+        parts.append(escape((child.tail or '').strip()))
+    parts.append('</' + element.tag + '>')
@@ -0,0 +1,76 @@
+import json
+import os
+import time
+
+
+class Journal(object):
+    """
+    Append-only record of the requests a batch has finished, one JSON
+    object per line:
+
+        {"method": "PUT", "resource": "item", "ids": {...}, "status": 200,
+         "time": 1500000000.0}
+
+    Passed to cor_run() or a cor_* batch method, it lets a job that died
+    part way be started again with the same journal: requests that
+    already succeeded (status below 400) are skipped, those that failed
+    or never finished are made again.
+
+    - path is the journal file. It is created if missing and read back
+    if it exists; a last line cut short by a crash is ignored.
+    - fsync=True forces every line to disk, at the cost of one sync
+    per request, so a power cut loses nothing either
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.statuses = {}
+        if os.path.exists(path):
+            self.load()
+        self._file = open(path, 'a', encoding='utf-8')
+        if self._file.tell() and not self._ends_with_newline():
+            # finish the line cut short, so the next record is readable
+            self._file.write('\n')
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as journal:
+            journal.seek(-1, os.SEEK_END)
+            return journal.read(1) == b'\n'
+
+    def key(self, httpmethod, resource, ids):
+        ids = sorted((str(k), str(v)) for k, v in ids.items())
+        return json.dumps([httpmethod, resource, ids])
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                key = self.key(entry['method'], entry['resource'],
+                               entry['ids'])
+                self.statuses[key] = entry['status']
+
+    def succeeded(self, httpmethod, resource, ids):
+        status = self.statuses.get(self.key(httpmethod, resource, ids))
+        return status is not None and status < 400
+
+    def record(self, httpmethod, resource, ids, status):
+        entry = {'method': httpmethod, 'resource': resource, 'ids': ids,
+                 'status': status, 'time': time.time()}
+        self._file.write(json.dumps(entry, default=str) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.statuses[self.key(httpmethod, resource, ids)] = status
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,202 @@
+"""
+Lazy MARC view over the MARC-XML of an Alma bib.
+
+MarcView scans the record once with a regular expression, keeping only
+the offsets of each field by tag. A field is decoded when it is asked
+for, and nothing else is, so reading a few fields of a large record costs
+little more than finding them:
+
+    >>> view = MarcView.from_bib(api.get_bib(mms_id))
+    >>> view.control('001'), view.value('245', 'a')
+    >>> [f['a'] for f in view.get_fields('035')]
+    >>> record = view.to_pymarc()
+
+The names follow pymarc (view['245']['a'], get_fields(), get_subfields())
+so code can move between the two.
+"""
+import html
+import re
+
+from pyalma.parallel import parse_marc
+
+
+# only control and data fields have a tag attribute: finding these is
+# the whole scan, the elements around them are read when needed. The
+# patterns start with a literal (no \b) so that re skips ahead quickly.
+_TAG = re.compile(br'tag="([^"]*)"')
+_INDICATOR = re.compile(br'ind([12])="([^"]*)"')
+_SUBFIELD = re.compile(br'code="([^"]*)"[^>]*?(/?)>([^<]*)')
+_LEADER = re.compile(br'leader\s*>([^<]*)<')
+_RECORD = re.compile(br'<(?:\w+:)?record\b')
+
+
+class Field(object):
+    """
+    A control field (data) or a data field (indicators and subfields)
+    """
+    __slots__ = ('tag', 'data', 'indicators', 'subfields')
+
+    def __init__(self, tag, data=None, indicators=None, subfields=None):
+        self.tag = tag
+        self.data = data
+        self.indicators = indicators
+        self.subfields = subfields
+
+    def is_control_field(self):
+        return self.data is not None
+
+    def __getitem__(self, code):
+        # the first subfield with this code, or None
+        for subfield_code, value in self.subfields or ():
+            if subfield_code == code:
+                return value
+        return None
+
+    def get_subfields(self, *codes):
+        return [value for code, value in self.subfields or ()
+                if code in codes]
+
+    def value(self):
+        if self.is_control_field():
+            return self.data
+        return ' '.join(value for code, value in self.subfields)
+
+    def __repr__(self):
+        if self.is_control_field():
+            return '<Field {} {!r}>'.format(self.tag, self.data)
+        return '<Field {} {!r}>'.format(self.tag, self.subfields)
+
+
+class MarcView(object):
+    """
+    Read-only view of one MARC-XML record, str or bytes (a whole <bib>
+    document, or just its <record>).
+
+    - the fields are indexed by tag when the view is created; each is
+    decoded when it is read, and not kept
+    - to_pymarc() parses the record into a pymarc.Record, for anything
+    the view does not offer
+    """
+    __slots__ = ('raw', '_index', '_positions', '_start', '_end')
+
+    def __init__(self, raw):
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        self.raw = raw
+        start = _RECORD.search(raw)
+        self._start = start.start() if start else 0
+        end = raw.rfind(b'record>', self._start)
+        self._end = end + len(b'record>') if end != -1 else len(raw)
+        # tag: numbers of its fields in self._positions, the offsets of
+        # their tag attributes
+        index = {}
+        positions = []
+        for match in _TAG.finditer(raw, self._start, self._end):
+            index.setdefault(match.group(1), []).append(len(positions))
+            positions.append(match.start())
+        self._index = dict((tag.decode('utf-8'), numbers)
+                           for tag, numbers in index.items())
+        self._positions = positions
+
+    @classmethod
+    def from_bib(cls, bib):
+        """
+        Returns the view of a bib as returned by get_bib(): the xml (str
+        or bytes), the json dict (MARC-XML in its 'anies'), or a
+        pyalma.models.Bib
+        """
+        if hasattr(bib, '__bytes__') and getattr(bib, 'format', None):
+            if bib.format == 'xml':
+                return cls(bytes(bib))
+            bib = bib.data
+        if isinstance(bib, dict):
+            return cls(bib['anies'][0])
+        return cls(bib)
+
+    @property
+    def leader(self):
+        match = _LEADER.search(self.raw, self._start, self._end)
+        return _text(match.group(1)) if match else None
+
+    def tags(self):
+        return list(self._index)
+
+    def __contains__(self, tag):
+        return tag in self._index
+
+    def __getitem__(self, tag):
+        # the first field with this tag, or None
+        numbers = self._index.get(tag)
+        if not numbers:
+            return None
+        return self._field(tag, numbers[0])
+
+    def get_fields(self, *tags):
+        """
+        Returns the fields with these tags (all fields if none), in
+        record order
+        """
+        if not tags:
+            tags = self._index
+        numbers = sorted((number, tag) for tag in tags
+                         for number in self._index.get(tag, ()))
+        return [self._field(tag, number) for number, tag in numbers]
+
+    def control(self, tag):
+        field = self[tag]
+        return field.data if field is not None else None
+
+    def value(self, tag, code):
+        """
+        Returns the first subfield code of the first field tag, or None
+        """
+        field = self[tag]
+        return field[code] if field is not None else None
+
+    def values(self, tag, code):
+        return [value for field in self.get_fields(tag)
+                for value in field.get_subfields(code)]
+
+    def to_pymarc(self):
+        return parse_marc(self.raw[self._start:self._end])
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __getstate__(self):
+        return self.raw
+
+    def __setstate__(self, raw):
+        self.__init__(raw)
+
+    def _field(self, tag, number):
+        raw = self.raw
+        positions = self._positions
+        start = raw.rfind(b'<', self._start, positions[number])
+        if number + 1 < len(positions):
+            end = positions[number + 1]
+        else:
+            # the last field ends at the </record> tag
+            end = raw.rfind(b'</', self._start, self._end)
+        head = raw.find(b'>', positions[number], end)
+        attributes = raw[start:head]
+        if attributes.endswith(b'/'):
+            content = b''
+        else:
+            # the last end tag before the next field closes this one
+            content = raw[head + 1:raw.rfind(b'</', head, end)]
+        if b'controlfield' in attributes:
+            return Field(tag, data=_text(content))
+        indicators = [' ', ' ']
+        for number, value in _INDICATOR.findall(attributes):
+            indicators[int(number) - 1] = _text(value) or ' '
+        subfields = [(_text(code), '' if empty else _text(value))
+                     for code, empty, value in _SUBFIELD.findall(content)]
+        return Field(tag, indicators=indicators, subfields=subfields)
+
+
+def _text(value):
+    value = value.decode('utf-8')
+    if '&' in value:
+        return html.unescape(value)
+    return value
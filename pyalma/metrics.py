@@ -0,0 +1,273 @@
+"""
+Aggregation of the events a client emits to its hooks.
+
+Every request made by Alma.request() or Alma.cor_request() passes events
+to the callables in Alma.hooks, as dicts with the keys event, method,
+resource and time (time.time()), and depending on the event:
+
+- 'start': ids. A call is about to be made, retries included.
+- 'wait': ids, kind and seconds. The time spent waiting before a call,
+for the rate limiter ('rate_limit'), the daily quota ('quota'), the
+semaphore bounding the requests in flight ('semaphore') or, in a batch,
+in the queue of inputs waiting for a worker ('queue')
+- 'retry': ids, attempt, status, error and delay (the seconds before
+the next attempt)
+- 'end': ids, status, error, attempts, elapsed (seconds, retries
+included) and bytes (of the response body, None if unknown). A request
+that is cancelled, or a stream closed before its end, ends with error
+'cancelled'
+- 'trace': ids, the seconds spent in each phase of a call (pool, dns,
+connect, ttfb and transfer) and reused, only with Alma(tracing=True)
+(see pyalma.tracing)
+
+Cache hits and GETs that share the call of an identical GET (see
+Alma.flights) make no call and emit no events.
+
+Metrics is a hook that keeps counters and latency histograms per
+resource and method, cheap enough to leave on in production.
+"""
+import bisect
+import threading
+
+from pyalma.tracing import PHASES
+
+
+# upper bounds in seconds of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+PREFIX = 'pyalma'
+
+
+class Histogram(object):
+    """
+    Counts observations in fixed buckets, as a Prometheus histogram does
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # the last bucket is +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimates the q quantile (0 to 1) by interpolating inside its
+        bucket, None if nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index - 1] if index else 0.0
+                if index == len(self.bounds):
+                    return lower
+                upper = self.bounds[index]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def cumulative(self):
+        """
+        Yields (le, count) pairs as in the Prometheus text format
+        """
+        total = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics(object):
+    """
+    Hook aggregating the events of one or more clients, per resource
+    (a key of RESOURCES) and method:
+
+        >>> metrics = Metrics()
+        >>> api = Alma(hooks=[metrics])
+        >>> metrics.summary()['GET bib']['p95']
+        >>> print(metrics.prometheus())
+
+    - requests counts the finished requests per status (or error, for
+    requests that got no response)
+    - latency is a Histogram of the elapsed time of requests
+    - waits are Histograms of the waits, per kind
+    - in_flight is the number of requests started but not finished
+    - phases are Histograms of the phases of traced calls, and
+    connections counts the calls per connection (new or reused)
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.requests = {}
+        self.latency = {}
+        self.bytes = {}
+        self.retries = {}
+        self.waits = {}
+        self.in_flight = {}
+        self.phases = {}
+        self.connections = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        name = event['event']
+        key = (event['resource'], event['method'])
+        with self._lock:
+            if name == 'end':
+                outcome = event['status'] or event['error']
+                counts = self.requests.setdefault(key, {})
+                counts[outcome] = counts.get(outcome, 0) + 1
+                self.histogram(self.latency, key).observe(event['elapsed'])
+                if event['bytes']:
+                    self.bytes[key] = self.bytes.get(key, 0) + event['bytes']
+                self.in_flight[key] = self.in_flight.get(key, 0) - 1
+            elif name == 'start':
+                self.in_flight[key] = self.in_flight.get(key, 0) + 1
+            elif name == 'wait':
+                self.histogram(self.waits,
+                               key + (event['kind'],)).observe(
+                                   event['seconds'])
+            elif name == 'retry':
+                self.retries[key] = self.retries.get(key, 0) + 1
+            elif name == 'trace':
+                for phase in PHASES:
+                    self.histogram(self.phases,
+                                   key + (phase,)).observe(event[phase])
+                counts = self.connections.setdefault(key, {})
+                connection = 'reused' if event['reused'] else 'new'
+                counts[connection] = counts.get(connection, 0) + 1
+
+    def histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def reset(self):
+        with self._lock:
+            for values in (self.requests, self.latency, self.bytes,
+                           self.retries, self.waits, self.in_flight,
+                           self.phases, self.connections):
+                values.clear()
+
+    def summary(self):
+        """
+        Returns a dict of 'METHOD resource' to the requests, errors,
+        retries, bytes and the mean, p50, p95 and p99 latency, plus the
+        total seconds waited per kind and, for traced calls, the mean
+        seconds per phase and the connections (new and reused)
+        """
+        summary = {}
+        with self._lock:
+            for (resource, method), latency in sorted(self.latency.items()):
+                counts = self.requests[(resource, method)]
+                key = (resource, method)
+                summary['{} {}'.format(method, resource)] = {
+                    'requests': latency.count,
+                    'errors': sum(count for outcome, count in counts.items()
+                                  if not isinstance(outcome, int) or
+                                  outcome >= 400),
+                    'retries': self.retries.get(key, 0),
+                    'bytes': self.bytes.get(key, 0),
+                    'mean': latency.sum / latency.count,
+                    'p50': latency.quantile(0.5),
+                    'p95': latency.quantile(0.95),
+                    'p99': latency.quantile(0.99),
+                    'waits': {kind: wait.sum for (r, m, kind), wait
+                              in self.waits.items()
+                              if (r, m) == key},
+                    'phases': {phase: histogram.sum / histogram.count
+                               for (r, m, phase), histogram
+                               in self.phases.items() if (r, m) == key},
+                    'connections': dict(self.connections.get(key, {}))}
+        return summary
+
+    def prometheus(self, prefix=PREFIX):
+        """
+        Returns the metrics in the Prometheus text exposition format, to
+        serve on a /metrics page or to write for the textfile collector
+        """
+        lines = []
+        with self._lock:
+            family(lines, prefix + '_requests_total', 'counter',
+                   'Requests finished, by status or error',
+                   [(labels(key, status=outcome), count)
+                    for key, counts in sorted(self.requests.items())
+                    for outcome, count in sorted(counts.items(), key=str)])
+            histogram_family(lines, prefix + '_request_duration_seconds',
+                             'Time taken by requests, retries included',
+                             [(labels(key), histogram) for key, histogram
+                              in sorted(self.latency.items())])
+            family(lines, prefix + '_response_bytes_total', 'counter',
+                   'Bytes of response bodies received',
+                   [(labels(key), count)
+                    for key, count in sorted(self.bytes.items())])
+            family(lines, prefix + '_retries_total', 'counter',
+                   'Calls made again after a failure',
+                   [(labels(key), count)
+                    for key, count in sorted(self.retries.items())])
+            histogram_family(lines, prefix + '_wait_seconds',
+                             'Time spent waiting before calls, by kind',
+                             [(labels(key[:2], kind=key[2]), histogram)
+                              for key, histogram
+                              in sorted(self.waits.items())])
+            histogram_family(lines, prefix + '_phase_seconds',
+                             'Time spent in each phase of traced calls',
+                             [(labels(key[:2], phase=key[2]), histogram)
+                              for key, histogram
+                              in sorted(self.phases.items())])
+            family(lines, prefix + '_connections_total', 'counter',
+                   'Traced calls, by new or reused connection',
+                   [(labels(key, connection=connection), count)
+                    for key, counts in sorted(self.connections.items())
+                    for connection, count in sorted(counts.items())])
+            family(lines, prefix + '_in_flight', 'gauge',
+                   'Requests started and not finished',
+                   [(labels(key), count)
+                    for key, count in sorted(self.in_flight.items())])
+        return ''.join(lines)
+
+
+def labels(key, **extra):
+    resource, method = key
+    pairs = [('resource', resource), ('method', method)]
+    pairs.extend(sorted(extra.items()))
+    return ','.join('{}="{}"'.format(name, escape_label(value))
+                    for name, value in pairs)
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+def family(lines, name, kind, help, samples):
+    if not samples:
+        return
+    lines.append('# HELP {} {}\n# TYPE {} {}\n'.format(name, help, name,
+                                                       kind))
+    for label, value in samples:
+        lines.append('{}{{{}}} {}\n'.format(name, label, value))
+
+
+def histogram_family(lines, name, help, samples):
+    if not samples:
+        return
+    lines.append('# HELP {} {}\n# TYPE {} histogram\n'.format(name, help,
+                                                             name))
+    for label, histogram in samples:
+        for bound, count in histogram.cumulative():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('{}_bucket{{{},le="{}"}} {}\n'.format(
+                name, label, le, count))
+        lines.append('{}_sum{{{}}} {!r}\n'.format(name, label, histogram.sum))
+        lines.append('{}_count{{{}}} {}\n'.format(name, label,
+                                                  histogram.count))
@@ -0,0 +1,237 @@
+"""
+Compact record models for Alma responses.
+
+A model keeps the response body as the bytes received and nothing else
+until a field is read. The first field read parses the body once, keeps
+the values of the class's fields (a few short strings) and drops the
+parsed document, so a job can hold hundreds of thousands of records at
+roughly the size of their wire format.
+
+    >>> item = Item.from_response(api.send('GET', 'item', ids))
+    >>> item.barcode, item.library
+    >>> api.put_item(mms_id, holding_id, item_pid, item,
+    ...              content_type=item.format)
+
+Fields are paths into the record, the same for json and xml
+('item_data/barcode'). Alma's {'value': ..., 'desc': ...} codes are read
+as their value. xml values are str, json values keep their json type.
+"""
+from pyalma.codec import Codec
+from pyalma.marc import MarcView
+
+
+_codec = Codec()
+
+
+class field(object):
+    """
+    A lazily decoded field of a Model, read from path
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, model, owner):
+        if model is None:
+            return self
+        return model.values()[owner._index[self.name]]
+
+
+class Model(object):
+    """
+    Wraps the body of one Alma record.
+
+    - raw is the body as bytes, returned unchanged by bytes(model), so
+    an unmodified record is sent back exactly as it was received
+    - format is 'json' or 'xml'
+    - data decodes the whole record (a dict, or an element) on every
+    access, to edit it: Model.from_data() wraps the edited record again
+    """
+    __slots__ = ('raw', 'format', '_values')
+
+    # resource name in pyalma.alma.RESOURCES
+    resource = None
+    _fields = ()
+    _index = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = [name for name in dir(cls)
+                  if isinstance(getattr(cls, name, None), field)]
+        cls._fields = tuple(sorted(fields))
+        cls._index = dict((name, i) for i, name in enumerate(cls._fields))
+
+    def __init__(self, raw, format='json'):
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        if format not in ('json', 'xml'):
+            raise ValueError("format must be 'json' or 'xml'")
+        self.raw = raw
+        self.format = format
+        self._values = None
+
+    @classmethod
+    def from_response(cls, response):
+        """
+        Wraps the body of a requests.Response
+        """
+        return cls(response.content,
+                   _format(response.headers.get('Content-Type', '')))
+
+    @classmethod
+    def from_result(cls, result):
+        """
+        Wraps the body of a successful Result of a batch
+        """
+        format = result.request.get('accept') or 'json'
+        raw = result.raw
+        if raw is None:
+            # split from a larger response (see Alma.split_bibs)
+            raw = _codec.encode(result.body, format)
+        return cls(raw, format)
+
+    @classmethod
+    def from_data(cls, data, format='json'):
+        """
+        Wraps a decoded record (a dict for json, an element for xml)
+        """
+        return cls(_codec.encode(data, format), format)
+
+    @property
+    def data(self):
+        if self.format == 'json':
+            return _codec.loads(self.raw)
+        return _codec.parse_xml(self.raw)
+
+    def values(self):
+        if self._values is None:
+            self._values = self.decode_fields()
+        return self._values
+
+    def decode_fields(self):
+        data = self.data
+        if self.format == 'json':
+            return tuple(_json_value(data, getattr(type(self), name).path)
+                         for name in self._fields)
+        return tuple(data.findtext(getattr(type(self), name).path)
+                     for name in self._fields)
+
+    def __bytes__(self):
+        return self.raw
+
+    def __eq__(self, other):
+        if not isinstance(other, Model):
+            return NotImplemented
+        return (type(self) is type(other) and self.raw == other.raw and
+                self.format == other.format)
+
+    def __hash__(self):
+        return hash((type(self), self.raw, self.format))
+
+    def __getstate__(self):
+        return (self.raw, self.format)
+
+    def __setstate__(self, state):
+        self.raw, self.format = state
+        self._values = None
+
+    def __repr__(self):
+        return '<{} {}>'.format(type(self).__name__, ' '.join(
+            '{}={!r}'.format(name, getattr(self, name))
+            for name in self._fields if name.endswith('id')))
+
+
+def _format(ctype):
+    return 'json' if 'json' in ctype else 'xml'
+
+
+def _json_value(data, path):
+    for key in path.split('/'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    if isinstance(data, dict) and 'value' in data:
+        return data['value']
+    return data
+
+
+class Bib(Model):
+    __slots__ = ()
+    resource = 'bib'
+    mms_id = field('mms_id')
+    title = field('title')
+    author = field('author')
+    isbn = field('isbn')
+    record_format = field('record_format')
+
+    @property
+    def marc(self):
+        # a pyalma.marc.MarcView of the record, built on every access
+        return MarcView.from_bib(self)
+
+
+class Holding(Model):
+    __slots__ = ()
+    resource = 'holding'
+    holding_id = field('holding_id')
+    created_date = field('created_date')
+    suppress_from_publishing = field('suppress_from_publishing')
+
+
+class Item(Model):
+    __slots__ = ()
+    resource = 'item'
+    mms_id = field('bib_data/mms_id')
+    holding_id = field('holding_data/holding_id')
+    item_pid = field('item_data/pid')
+    barcode = field('item_data/barcode')
+    title = field('bib_data/title')
+    call_number = field('holding_data/call_number')
+    library = field('item_data/library')
+    location = field('item_data/location')
+    base_status = field('item_data/base_status')
+    process_type = field('item_data/process_type')
+
+
+class Request(Model):
+    __slots__ = ()
+    resource = 'item_request'
+    request_id = field('request_id')
+    user_primary_id = field('user_primary_id')
+    request_type = field('request_type')
+    request_status = field('request_status')
+    pickup_location_library = field('pickup_location_library')
+    request_date = field('request_date')
+
+
+class Loan(Model):
+    __slots__ = ()
+    resource = 'loan'
+    loan_id = field('loan_id')
+    user_id = field('user_id')
+    item_barcode = field('item_barcode')
+    loan_status = field('loan_status')
+    due_date = field('due_date')
+    library = field('library')
+    circ_desk = field('circ_desk')
+
+
+class User(Model):
+    __slots__ = ()
+    resource = 'user'
+    primary_id = field('primary_id')
+    first_name = field('first_name')
+    last_name = field('last_name')
+    user_group = field('user_group')
+    status = field('status')
+    expiry_date = field('expiry_date')
+
+
+# model class of each resource returning one record
+MODELS = dict((model.resource, model)
+              for model in (Bib, Holding, Item, Request, Loan, User))
+MODELS['bib_request'] = Request
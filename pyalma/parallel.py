@@ -0,0 +1,23 @@
+"""
+Functions run in worker processes by Alma.cor_map().
+
+They live at module level so that the process pool can pickle them;
+functions passed to cor_map() as func or transform must do the same.
+"""
+import io
+
+import pymarc
+
+
+def parse_marc(raw, transform=None):
+    """
+    Parses the MARC-XML of an Alma bib (the <record> inside <bib>) into
+    a pymarc.Record, then returns transform(record) if transform is given
+    """
+    if isinstance(raw, str):
+        raw = raw.encode('utf-8')
+    records = pymarc.parse_xml_to_array(io.BytesIO(raw))
+    record = records[0] if records else None
+    if transform is not None:
+        return transform(record)
+    return record
@@ -0,0 +1,179 @@
+import asyncio
+import datetime
+import threading
+import time
+
+
+# response header in which Alma reports the calls left today
+QUOTA_HEADER = 'X-Exl-Api-Remaining'
+# error code in the body of a 429 once the daily threshold is reached
+DAILY_THRESHOLD = 'DAILY_THRESHOLD'
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class Quota(object):
+    """
+    Tracks the daily API quota of an institution from the
+    X-Exl-Api-Remaining header of every response, shared by the
+    synchronous and the coroutine methods of a client (see Alma.quota).
+
+    Between two responses, remaining is estimated as the last reported
+    value minus the calls sent since. Before it is first reported nothing
+    is limited.
+
+    - reserve is the number of calls kept for other jobs: once the
+    estimate is down to it, calls raise QuotaExceeded (in a batch, their
+    Result has error 'quota')
+    - wait=True makes calls wait for the next daily reset, at reset_hour
+    UTC, instead of raising
+    - below slow_below calls left, calls are spaced out, by up to
+    max_delay seconds each as the estimate nears reserve, so that a
+    runaway batch slows down before it stops
+    """
+
+    def __init__(self, reserve=0, slow_below=None, max_delay=1.0, wait=False,
+                 reset_hour=0):
+        if slow_below is not None and slow_below <= reserve:
+            raise ValueError("slow_below must be above reserve")
+        self.reserve = reserve
+        self.slow_below = slow_below
+        self.max_delay = max_delay
+        self.wait = wait
+        self.reset_hour = reset_hour
+        self.reported = None
+        self.updated = None
+        self.calls = 0
+        self._since = 0
+        self._next = 0.0
+        self._resume = None
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self):
+        """
+        The estimated number of calls left today, None if unknown
+        """
+        with self._lock:
+            return self._estimate()
+
+    def _estimate(self):
+        if self.reported is None:
+            return None
+        return max(0, self.reported - self._since)
+
+    def state(self):
+        """
+        Returns the quota as a dict: remaining (estimated), reported (the
+        last X-Exl-Api-Remaining), updated (time.time() of that report)
+        and calls (made through this object)
+        """
+        with self._lock:
+            return {'remaining': self._estimate(), 'reported': self.reported,
+                    'updated': self.updated, 'calls': self.calls}
+
+    def update(self, headers):
+        """
+        Reads the quota from the headers of a response
+        """
+        value = headers.get(QUOTA_HEADER)
+        if value is None:
+            return
+        try:
+            reported = int(value)
+        except ValueError:
+            return
+        with self._lock:
+            self.reported = reported
+            self.updated = time.time()
+            self._since = 0
+
+    def exhausted(self):
+        """
+        Records that Alma refused a call for the daily threshold
+        """
+        with self._lock:
+            self.reported = 0
+            self.updated = time.time()
+            self._since = 0
+
+    def check(self, calls):
+        """
+        Raises QuotaExceeded if calls more calls would go below reserve,
+        before a job is started
+        """
+        remaining = self.remaining
+        if remaining is not None and calls > remaining - self.reserve:
+            raise QuotaExceeded(
+                '{} calls needed, {} left today with {} in reserve'.format(
+                    calls, remaining, self.reserve))
+
+    def take(self):
+        """
+        Counts a call and returns the time (on the time.monotonic() clock)
+        at which it may be made. Raises QuotaExceeded if it may not.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._resume is not None:
+                if now < self._resume:
+                    return self._take(self._resume)
+                # the quota has been reset: the next response reports it
+                self._resume = None
+                self.reported = None
+            remaining = self._estimate()
+            if remaining is None:
+                return self._take(now)
+            if remaining <= self.reserve:
+                if not self.wait:
+                    raise QuotaExceeded(
+                        '{} calls left today, {} in reserve'.format(
+                            remaining, self.reserve))
+                self._resume = now + self.until_reset()
+                return self._take(self._resume)
+            if self.slow_below is not None and remaining < self.slow_below:
+                delay = self.max_delay * (self.slow_below - remaining) / (
+                    self.slow_below - self.reserve)
+                # calls are spaced out across all threads and coroutines
+                start = max(now, self._next)
+                self._next = start + delay
+                return self._take(start)
+            return self._take(now)
+
+    def _take(self, until):
+        self._since += 1
+        self.calls += 1
+        return until
+
+    def until_reset(self):
+        """
+        Returns the seconds until the next daily reset
+        """
+        now = datetime.datetime.utcnow()
+        reset = now.replace(hour=self.reset_hour, minute=0, second=0,
+                            microsecond=0)
+        if reset <= now:
+            reset += datetime.timedelta(days=1)
+        return (reset - now).total_seconds()
+
+    def acquire(self):
+        """
+        Blocks until a call may be made, returns the time waited
+        """
+        until = self.take()
+        delay = until - time.monotonic()
+        while until > time.monotonic():
+            time.sleep(until - time.monotonic())
+        return max(0.0, delay)
+
+    async def cor_acquire(self):
+        """
+        Sleeps until a call may be made, returns the time waited
+        """
+        until = self.take()
+        delay = until - time.monotonic()
+        while until > time.monotonic():
+            await asyncio.sleep(until - time.monotonic())
+        return max(0.0, delay)
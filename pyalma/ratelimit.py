@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter, shared by the synchronous and the coroutine
+    methods of a client (and by several clients, if you pass the same
+    bucket to each of them).
+
+    - rate is the number of calls allowed per second
+    - burst is the number of calls that may go out back to back
+    once the bucket has filled up
+
+    The bucket is empty until the first call and only starts filling then,
+    so a new client never opens with a burst on top of calls made just
+    before it was created (e.g. by a restarted job). Changing the rate
+    empties it again, so tokens saved up under the old rate are not spent
+    under the new one.
+    Tokens are reserved under a lock: callers are served in the order they
+    arrive, whether they are threads or coroutines.
+    """
+
+    def __init__(self, rate, burst=1):
+        if rate <= 0 or burst < 1:
+            raise ValueError("rate must be positive and burst at least 1")
+        self._rate = rate
+        self.burst = burst
+        self._tokens = 0
+        self._updated = None
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, value):
+        if value <= 0:
+            raise ValueError("rate must be positive")
+        with self._lock:
+            if self._tokens >= 0:
+                self._tokens = 0
+                self._updated = None
+            self._rate = value
+
+    def _refill(self):
+        now = time.monotonic()
+        if self._updated is None:
+            self._updated = now
+        elapsed = now - self._updated
+        self._tokens = min(self.burst, self._tokens + elapsed * self._rate)
+        self._updated = now
+        return now
+
+    def reserve(self):
+        """
+        Takes a token and returns the time (on the time.monotonic() clock)
+        at which the caller may make its call
+        """
+        with self._lock:
+            now = self._refill()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return now
+            return now - self._tokens / self._rate
+
+    def acquire(self):
+        """
+        Blocks until a call may be made, returns the time waited
+        """
+        begin = time.monotonic()
+        until = self.reserve()
+        # sleeps can end a little early, so check the clock again
+        while until > time.monotonic():
+            time.sleep(until - time.monotonic())
+        return until - begin
+
+    async def cor_acquire(self):
+        """
+        Sleeps until a call may be made, returns the time waited
+        """
+        begin = time.monotonic()
+        until = self.reserve()
+        while until > time.monotonic():
+            await asyncio.sleep(until - time.monotonic())
+        return until - begin
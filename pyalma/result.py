@@ -0,0 +1,78 @@
+class Result(tuple):
+    """
+    Outcome of one request made by a batch. It is still the
+    (ids, status, body) tuple the batch methods have always returned, so
+    it unpacks and compares the same way, with more attributes:
+
+    - error is None for a success, or the category of the failure:
+    'rate_limited' (429), 'server' (5xx), 'client' (other 4xx),
+    'timeout', 'connection', 'quota' (the daily API quota is used up:
+    not sent, or refused by Alma with a 429, see pyalma.quota) or
+    'exception' (any other error)
+    - attempts is the number of calls made (0 if served from the cache)
+    - elapsed is the time taken in seconds, retries included
+    - raw is the response body as bytes, if there was one
+    - exception is the exception that ended the request, if any.
+    status is then None and body a message describing it.
+    - request is a dict of the method, resource, params, data, accept
+    and content_type of the request, to make it again (see
+    Alma.cor_replay)
+    - unchanged is True for a PUT that was not sent because its data was
+    the same as its original (see pyalma.diff). status is then 304 and
+    body the original.
+    """
+
+    def __new__(cls, ids, status, body, error=None, attempts=1, elapsed=0.0,
+                raw=None, exception=None, request=None, unchanged=False):
+        result = tuple.__new__(cls, (ids, status, body))
+        result.error = error
+        result.attempts = attempts
+        result.elapsed = elapsed
+        result.raw = raw
+        result.exception = exception
+        result.request = request or {}
+        result.unchanged = unchanged
+        return result
+
+    @property
+    def ids(self):
+        return self[0]
+
+    @property
+    def status(self):
+        return self[1]
+
+    @property
+    def body(self):
+        return self[2]
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def _replace(self, **kwargs):
+        fields = {'ids': self.ids, 'status': self.status, 'body': self.body,
+                  'error': self.error, 'attempts': self.attempts,
+                  'elapsed': self.elapsed, 'raw': self.raw,
+                  'exception': self.exception, 'request': self.request,
+                  'unchanged': self.unchanged}
+        fields.update(kwargs)
+        return Result(**fields)
+
+    def __repr__(self):
+        return 'Result(ids={!r}, status={!r}, error={!r}, attempts={!r})'.format(
+            self.ids, self.status, self.error, self.attempts)
+
+
+def status_error(status):
+    """
+    Returns the error category of an HTTP status, None for a success
+    """
+    if status < 400:
+        return None
+    if status == 429:
+        return 'rate_limited'
+    if status >= 500:
+        return 'server'
+    return 'client'
+
@@ -0,0 +1,150 @@
+import email.utils
+import random
+import threading
+import time
+
+
+MAX_ATTEMPTS = 5
+BACKOFF = 0.5
+MAX_BACKOFF = 30
+
+# statuses worth another attempt: rate limited, or a server side hiccup
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# methods that may safely be sent twice
+IDEMPOTENT_METHODS = frozenset(['GET', 'PUT', 'DELETE', 'HEAD', 'OPTIONS'])
+
+# a batch may retry BUDGET_RATIO of its calls, plus BUDGET_MINIMUM
+BUDGET_RATIO = 0.2
+BUDGET_MINIMUM = 10
+
+
+class RetryPolicy(object):
+    """
+    Decides whether a failed call is made again, and after how long.
+    One policy is used by both the synchronous and the coroutine methods
+    of a client (see Alma.retry_policy).
+
+    - max_attempts is the most calls made for one request (1 never retries)
+    - backoff is the delay before the first retry. It doubles on every
+    attempt up to max_backoff, and the actual delay is drawn at random
+    between 0 and that ("full jitter"), so clients that failed together
+    do not come back together.
+    - a Retry-After header from Alma is honoured instead, if it is longer
+    - 429 is retried for every method, as Alma did not process the call.
+    Other statuses in RETRY_STATUSES and connection or timeout errors are
+    only retried for IDEMPOTENT_METHODS: a POST may have gone through.
+    - budget_ratio and budget_minimum bound the retries of a whole batch
+    (see budget()), so a failing Alma is not hit with max_attempts times
+    the load.
+    """
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF,
+                 max_backoff=MAX_BACKOFF, statuses=RETRY_STATUSES,
+                 methods=IDEMPOTENT_METHODS, budget_ratio=BUDGET_RATIO,
+                 budget_minimum=BUDGET_MINIMUM):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(methods)
+        self.budget_ratio = budget_ratio
+        self.budget_minimum = budget_minimum
+
+    def budget(self):
+        """
+        Returns a new RetryBudget for a batch
+        """
+        return RetryBudget(self.budget_ratio, self.budget_minimum)
+
+    def retry_status(self, httpmethod, status):
+        if status == 429:
+            return True
+        return status in self.statuses and httpmethod in self.methods
+
+    def retry_error(self, httpmethod):
+        return httpmethod in self.methods
+
+    def replay_result(self, result):
+        """
+        Whether a failed Result of a finished batch is worth another try
+        """
+        httpmethod = result.request.get('method')
+        if result.error == 'rate_limited':
+            return True
+        if result.error == 'server':
+            return httpmethod in self.methods
+        if result.error in ('timeout', 'connection'):
+            return self.retry_error(httpmethod)
+        return False
+
+    def attempt_again(self, attempt, max_attempts=None, budget=None):
+        """
+        Checks the attempts left for the request and for its batch,
+        and takes a retry from the batch budget if there is one
+        """
+        if max_attempts is None:
+            max_attempts = self.max_attempts
+        if attempt >= max_attempts:
+            return False
+        return budget is None or budget.spend()
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Returns the number of seconds to wait before the next attempt
+        """
+        delay = random.uniform(0, min(self.max_backoff,
+                                      self.backoff * 2 ** (attempt - 1)))
+        retry_after = parse_retry_after(retry_after)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class RetryBudget(object):
+    """
+    Retries left to a batch: budget_minimum, plus budget_ratio for every
+    call made. Shared by all the calls of the batch.
+    """
+
+    def __init__(self, ratio=BUDGET_RATIO, minimum=BUDGET_MINIMUM):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.calls = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def record_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def spend(self):
+        """
+        Takes one retry, returns False if none is left
+        """
+        with self._lock:
+            if self.retries >= self.minimum + self.ratio * self.calls:
+                return False
+            self.retries += 1
+            return True
+
+
+def parse_retry_after(value):
+    """
+    Returns the seconds to wait from a Retry-After header, which is either
+    a number of seconds or an HTTP date, or None
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
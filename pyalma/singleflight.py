@@ -0,0 +1,84 @@
+import asyncio
+import threading
+
+
+class SingleFlight(object):
+    """
+    Coalesces identical calls that overlap in time: the first caller for a
+    key runs the call, and every caller that arrives while it is still
+    running waits for it and gets the same result (or exception).
+
+    do() coalesces threads, cor_do() coroutines on the same event loop.
+    Once a call has finished its key is forgotten, so nothing is cached.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._futures = {}
+        self._waiters = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            return call.wait()
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def cor_do(self, key, coro_fn, *args, **kwargs):
+        """
+        Awaits coro_fn(*args, **kwargs), or the same call already in
+        flight. A caller that is cancelled does not cancel the call for
+        the others, but the call is cancelled once all its callers are.
+        """
+        key = (asyncio.get_event_loop(), key)
+        future = self._futures.get(key)
+        if future is None:
+            future = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            self._futures[key] = future
+            future.add_done_callback(
+                lambda future: self._forget(key, future))
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                # nobody waits for the call any more: a caller arriving
+                # while it unwinds starts a new one
+                self._forget(key, future)
+                future.cancel()
+
+    def _forget(self, key, future):
+        if self._futures.get(key) is future:
+            del self._futures[key]
+
+    def __len__(self):
+        return len(self._calls) + len(self._futures)
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
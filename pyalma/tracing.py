@@ -0,0 +1,114 @@
+"""
+Timing of the phases of each call made by the coroutine methods.
+
+aiohttp 1.x has no tracing callbacks, so TracingConnector times the
+steps of its connector instead. With Alma(tracing=True), cor_send() emits
+a 'trace' event after each call (see pyalma.metrics), with the seconds
+spent in each phase:
+
+- pool: waiting for a free connection under the connector limit
+- dns: resolving the endpoint (0 when the DNS cache answers)
+- connect: opening a new connection, TCP and TLS handshakes together
+(aiohttp opens both in one call)
+- ttfb: from the connection being ready to the response headers:
+sending the request and waiting for Alma
+- transfer: reading the response body
+
+and reused, which is True if a keep-alive connection was used (dns and
+connect are then 0). A slow pool means the connector limit is too low,
+many connects that keep-alive connections are not reused, and a slow
+ttfb that the time goes on Alma's side.
+"""
+import asyncio
+import time
+import weakref
+
+import aiohttp
+
+
+PHASES = ('pool', 'dns', 'connect', 'ttfb', 'transfer')
+
+
+class Trace(object):
+    """
+    Times of one call, on the time.monotonic() clock
+    """
+
+    __slots__ = ('sent', 'connection', 'dns', 'connect', 'received')
+
+    def __init__(self):
+        self.sent = time.monotonic()
+        self.connection = 0.0
+        self.dns = 0.0
+        self.connect = None
+        self.received = None
+
+    def phases(self):
+        """
+        Returns the seconds spent in each phase up to now, and reused
+        """
+        done = time.monotonic()
+        received = self.received or done
+        connect = self.connect or 0.0
+        return {'pool': max(0.0, self.connection - connect),
+                'dns': self.dns,
+                'connect': max(0.0, connect - self.dns),
+                'ttfb': max(0.0, received - self.sent - self.connection),
+                'transfer': done - received,
+                'reused': self.connect is None}
+
+
+class TracingConnector(aiohttp.TCPConnector):
+    """
+    TCPConnector that times the calls it serves. begin() starts the Trace
+    of the call the current task is about to make.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the Trace of the call each task is making
+        self.traces = weakref.WeakKeyDictionary()
+        # the Trace of each request being connected, which may be done
+        # in another task (when there is a connection timeout)
+        self.connecting = {}
+
+    def begin(self):
+        trace = Trace()
+        self.traces[asyncio.Task.current_task(loop=self._loop)] = trace
+        return trace
+
+    def current(self):
+        task = asyncio.Task.current_task(loop=self._loop)
+        return self.traces.get(task) if task is not None else None
+
+    async def connect(self, req):
+        trace = self.current()
+        if trace is None:
+            return await super().connect(req)
+        self.connecting[id(req)] = trace
+        begin = time.monotonic()
+        try:
+            return await super().connect(req)
+        finally:
+            trace.connection = time.monotonic() - begin
+            del self.connecting[id(req)]
+
+    async def _create_connection(self, req):
+        trace = self.connecting.get(id(req))
+        if trace is None:
+            return await super()._create_connection(req)
+        self.traces[asyncio.Task.current_task(loop=self._loop)] = trace
+        begin = time.monotonic()
+        try:
+            return await super()._create_connection(req)
+        finally:
+            trace.connect = time.monotonic() - begin
+
+    async def _resolve_host(self, host, port):
+        trace = self.current()
+        begin = time.monotonic()
+        try:
+            return await super()._resolve_host(host, port)
+        finally:
+            if trace is not None:
+                trace.dns += time.monotonic() - begin
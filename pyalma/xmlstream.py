@@ -0,0 +1,64 @@
+import xml.etree.ElementTree as ET
+
+
+# bytes read from the network at a time when streaming a response
+CHUNK_SIZE = 64 * 1024
+
+
+class ElementParser(object):
+    """
+    Incremental parser for Alma list responses such as
+    <items total_record_count="..."><item>...</item>...</items>.
+
+    Feed it the body as it arrives: every call returns the record
+    elements (children of the root with the given tag) completed so far.
+    Each one is detached from the tree before it is returned, so memory
+    use depends on the size of a record, not of the response.
+    """
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.root = None
+        self._depth = 0
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+
+    def feed(self, data):
+        self._parser.feed(data)
+        return self._elements()
+
+    def close(self):
+        self._parser.close()
+        return self._elements()
+
+    @property
+    def total_record_count(self):
+        if self.root is None or 'total_record_count' not in self.root.attrib:
+            return None
+        return int(self.root.get('total_record_count'))
+
+    def _elements(self):
+        elements = []
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                self._depth += 1
+                if self._depth == 1:
+                    self.root = element
+                continue
+            self._depth -= 1
+            if self._depth == 1 and element.tag == self.tag:
+                self.root.remove(element)
+                elements.append(element)
+        return elements
+
+
+def iter_elements(chunks, tag):
+    """
+    Yields the record elements with the given tag from an iterable of
+    byte chunks, parsing them as they arrive
+    """
+    parser = ElementParser(tag)
+    for chunk in chunks:
+        for element in parser.feed(chunk):
+            yield element
+    for element in parser.close():
+        yield element
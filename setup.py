@@ -9,7 +9,11 @@ setup(
     author = 'Getty Research Institute',
     author_email = 'jgomez@getty.edu',
     url = 'https://stash.getty.edu/projects/GRIIS/repos/pyalma/browse',
-    install_requires = ['pymarc', 'requests', 'aiohttp==1.3', 'ratelimiter'],
+    python_requires = '>=3.6',
+    install_requires = ['pymarc', 'requests', 'aiohttp==1.3'],
+    entry_points = {
+        'console_scripts': ['pyalma = pyalma.cli:main'],
+    },
     classifiers = [
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
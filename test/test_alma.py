@@ -1,12 +1,19 @@
 import json
 import os
 import re
+import tempfile
+import time
 from importlib import reload
 import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
+import requests
 import responses
 
 from pyalma import alma
+from pyalma.cache import MemoryCache, SQLiteCache
+from pyalma.retry import RetryPolicy
 
 
 def setUpModule():
@@ -54,6 +61,27 @@ class TestAlmaSetup(unittest.TestCase):
         headers = alma.Alma().headers(content_type='xml')
         self.assertEqual(headers, expect)
 
+    def test_session_pool(self):
+        api = alma.Alma(pool_maxsize=25, timeout=(2, 30))
+        adapter = api.session.get_adapter(api.baseurl)
+        self.assertEqual(adapter._pool_maxsize, 25)
+        self.assertEqual(api.timeout, (2, 30))
+
+    def test_shared_rate_limiter(self):
+        bucket = alma.TokenBucket(10)
+        first = alma.Alma(rate_limiter=bucket)
+        second = alma.Alma(rate_limiter=bucket)
+        self.assertIs(first.rate_limiter, second.rate_limiter)
+        first.max_calls = 5
+        self.assertEqual(second.max_calls, 5)
+
+    def test_context_manager(self):
+        api = alma.Alma()
+        with mock.patch.object(api.session, 'close') as close:
+            with api:
+                close.assert_not_called()
+        close.assert_called_once_with()
+
 
 class TestAlmaGETRequests(unittest.TestCase):
     maxDiff = None
@@ -164,6 +192,23 @@ class TestAlmaGETRequests(unittest.TestCase):
         data = resp.json()
         self.assertEqual(data['created_date'], '2013-07-14Z')
 
+    @responses.activate
+    def test_alma_request_reuses_session(self):
+        self.buildResponses()
+        with mock.patch.object(self.api.session, 'request',
+                               wraps=self.api.session.request) as request:
+            self.api.get_bib(9922405930001552)
+            self.api.get_holdings(99100383900121)
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(request.call_args[1]['timeout'], self.api.timeout)
+
+    @responses.activate
+    def test_alma_request_rate_limited(self):
+        self.buildResponses()
+        with mock.patch.object(self.api.rate_limiter, 'acquire') as acquire:
+            self.api.get_bib(9922405930001552)
+        acquire.assert_called_once_with()
+
     @responses.activate
     def test_extract_content_xml(self):
         self.buildXMLResponses()
@@ -187,6 +232,22 @@ class TestAlmaGETRequests(unittest.TestCase):
         with open('test/bib.dat', 'r') as dat:
             self.assertEqual(bib_data, json.loads(dat.read()))
 
+    @responses.activate
+    def test_alma_get_bibs(self):
+        body = {'bib': [{'mms_id': 1}, {'mms_id': 2}], 'total_record_count': 2}
+        responses.add(responses.GET, self.api.fullurl('bibs'),
+                      status=200,
+                      content_type='application/json',
+                      body=json.dumps(body))
+        bibs = self.api.get_bibs([1, 2], accept='json')
+        self.assertEqual(bibs, body)
+        query = parse_qs(urlparse(responses.calls[0].request.url).query)
+        self.assertEqual(query['mms_id'], ['1,2'])
+
+    def test_alma_get_bibs_limit(self):
+        self.assertRaises(ValueError, self.api.get_bibs,
+                          range(alma.BIBS_LIMIT + 1))
+
     @responses.activate
     def test_alma_get_holdings(self):
         self.buildResponses()
@@ -210,6 +271,22 @@ class TestAlmaGETRequests(unittest.TestCase):
         with open('test/items.dat', 'r') as dat:
             self.assertEqual(items_data, json.loads(dat.read()))
 
+    @responses.activate
+    def test_alma_get_items_stream(self):
+        ids = {'mms_id': 1, 'holding_id': 2}
+        body = '<items total_record_count="2">'
+        body += '<item><item_data><pid>3</pid></item_data></item>'
+        body += '<item><item_data><pid>4</pid></item_data></item></items>'
+        responses.add(responses.GET, self.api.fullurl('items', ids),
+                      status=200,
+                      content_type='application/xml',
+                      body=body)
+        items = self.api.get_items(1, 2, stream=True)
+        self.assertEqual([item.findtext('item_data/pid') for item in items],
+                         ['3', '4'])
+        self.assertEqual(responses.calls[0].request.headers['Accept'],
+                         'application/xml')
+
     @responses.activate
     def test_alma_get_item(self):
         self.buildResponses()
@@ -259,6 +336,241 @@ class TestAlmaGETRequests(unittest.TestCase):
                     dat.read()))
 
 
+class TestAlmaPagination(unittest.TestCase):
+    maxDiff = None
+
+    def setUp(self):
+        self.api = alma.Alma(apikey='unreal', region='EU')
+        self.api.max_calls = 1000
+
+    def buildResponses(self, total):
+
+        def users_page(request):
+            query = parse_qs(urlparse(request.url).query)
+            limit = int(query['limit'][0])
+            offset = int(query['offset'][0])
+            users = [{'primary_id': str(n)}
+                     for n in range(offset, min(offset + limit, total))]
+            body = {'user': users, 'total_record_count': total}
+            return (200, {}, json.dumps(body))
+
+        usersurl = self.api.baseurl + r'users'
+        users_re = re.compile(usersurl)
+        responses.add_callback(
+            responses.GET, users_re,
+            callback=users_page,
+            content_type='application/json',
+        )
+
+    @responses.activate
+    def test_get_users_page(self):
+        self.buildResponses(250)
+        users = self.api.get_users(limit=10, offset=20)
+        self.assertEqual(users['user'][0]['primary_id'], '20')
+        self.assertEqual(len(users['user']), 10)
+
+    @responses.activate
+    def test_iter_users(self):
+        self.buildResponses(250)
+        users = list(self.api.iter_users(limit=100, prefetch=2))
+        self.assertEqual([u['primary_id'] for u in users],
+                         [str(n) for n in range(250)])
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_iter_users_single_page(self):
+        self.buildResponses(5)
+        users = list(self.api.iter_users())
+        self.assertEqual(len(users), 5)
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_iter_users_stop_early(self):
+        self.buildResponses(1000)
+        users = self.api.iter_users(limit=10, prefetch=3)
+        self.assertEqual(next(users)['primary_id'], '0')
+        users.close()
+        self.assertLessEqual(len(responses.calls), 4)
+
+
+class TestAlmaCache(unittest.TestCase):
+
+    def setUp(self):
+        self.api = alma.Alma(apikey='unreal', region='EU',
+                             cache=MemoryCache())
+        self.ids = {'mms_id': 9922405930001552}
+        with open('test/bib.dat', 'r') as dat:
+            self.body = dat.read()
+        responses.add(responses.GET, self.api.fullurl('bib', self.ids),
+                      status=200,
+                      content_type='application/json',
+                      body=self.body)
+
+    @responses.activate
+    def test_get_cached(self):
+        first = self.api.get_bib(self.ids['mms_id'], accept='json')
+        first['title'] = 'changed by the caller'
+        second = self.api.get_bib(self.ids['mms_id'], accept='json')
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(second, json.loads(self.body))
+
+    @responses.activate
+    def test_accept_in_key(self):
+        self.api.get_bib(self.ids['mms_id'], accept='json')
+        self.api.get_bib(self.ids['mms_id'], accept='xml')
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_put_updates_cache(self):
+        responses.add(responses.PUT, self.api.fullurl('bib', self.ids),
+                      status=200,
+                      content_type='application/json',
+                      body='{"title": "new"}')
+        self.api.get_bib(self.ids['mms_id'], accept='json')
+        self.api.put_bib(self.ids['mms_id'], '{"title": "new"}',
+                         content_type='json', accept='json')
+        bib = self.api.get_bib(self.ids['mms_id'], accept='json')
+        self.assertEqual(bib, {'title': 'new'})
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_put_during_get(self):
+        responses.reset()
+        responses.add(responses.PUT, self.api.fullurl('bib', self.ids),
+                      status=200,
+                      content_type='application/json',
+                      body='{"title": "new"}')
+
+        def old_bib(request):
+            # the PUT finishes while the GET is in flight
+            self.api.put_bib(self.ids['mms_id'], '{"title": "new"}',
+                             content_type='json', accept='json')
+            return (200, {}, '{"title": "old"}')
+
+        responses.add_callback(responses.GET,
+                               self.api.fullurl('bib', self.ids),
+                               callback=old_bib,
+                               content_type='application/json')
+        self.assertEqual(self.api.get_bib(self.ids['mms_id'], accept='json'),
+                         {'title': 'old'})
+        bib = self.api.get_bib(self.ids['mms_id'], accept='json')
+        self.assertEqual(bib, {'title': 'new'})
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_sqlite_cache_shared(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = SQLiteCache(os.path.join(tmpdir, 'cache.db'))
+            worker = alma.Alma(apikey='unreal', region='EU', cache=cache)
+            worker.get_bib(self.ids['mms_id'], accept='json')
+            # another worker, with its own connection to the same file
+            other = alma.Alma(apikey='unreal', region='EU',
+                              cache=SQLiteCache(cache.path))
+            bib = other.get_bib(self.ids['mms_id'], accept='json')
+            other.cache.close()
+            cache.close()
+        self.assertEqual(bib, json.loads(self.body))
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_failed_write_invalidates(self):
+        responses.add(responses.DELETE,
+                      self.api.fullurl('bib_request',
+                                       {'mms_id': self.ids['mms_id'],
+                                        'request_id': 1}),
+                      status=400)
+        self.api.get_bib(self.ids['mms_id'], accept='json')
+        self.assertRaises(alma.HTTPError, self.api.del_bib_request,
+                          self.ids['mms_id'], 1)
+        self.api.get_bib(self.ids['mms_id'], accept='json')
+        self.assertEqual(len(responses.calls), 3)
+
+
+class TestAlmaRetries(unittest.TestCase):
+
+    def setUp(self):
+        policy = RetryPolicy(max_attempts=3, backoff=0.01)
+        self.api = alma.Alma(apikey='unreal', region='EU',
+                             retry_policy=policy)
+        self.url = self.api.fullurl('bib', {'mms_id': 1})
+
+    @responses.activate
+    def test_retry_5xx(self):
+        responses.add(responses.GET, self.url, status=503)
+        responses.add(responses.GET, self.url, status=200, json={'mms_id': 1})
+        self.assertEqual(self.api.get_bib(1, accept='json'), {'mms_id': 1})
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_retry_connection_error(self):
+        responses.add(responses.GET, self.url,
+                      body=requests.exceptions.ConnectionError('reset'))
+        responses.add(responses.GET, self.url, status=200, json={'mms_id': 1})
+        self.assertEqual(self.api.get_bib(1, accept='json'), {'mms_id': 1})
+
+    @responses.activate
+    def test_retry_gives_up(self):
+        responses.add(responses.GET, self.url, status=500)
+        self.assertRaises(alma.HTTPError, self.api.get_bib, 1)
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_retry_after(self):
+        responses.add(responses.GET, self.url, status=429,
+                      headers={'Retry-After': '0.2'})
+        responses.add(responses.GET, self.url, status=200, json={})
+        begin = time.monotonic()
+        self.api.get_bib(1, accept='json')
+        self.assertGreaterEqual(time.monotonic() - begin, 0.2)
+
+    @responses.activate
+    def test_no_retry_post_5xx(self):
+        url = self.api.fullurl('bib_requests', {'mms_id': 1})
+        responses.add(responses.POST, url, status=503)
+        self.assertRaises(alma.HTTPError, self.api.post_bib_request, 1, '{}')
+        self.assertEqual(len(responses.calls), 1)
+
+
+    @responses.activate
+    def test_quota(self):
+        responses.add(responses.GET, self.url, status=200, json={},
+                      headers={'X-Exl-Api-Remaining': '0'})
+        self.api.get_bib(1, accept='json')
+        self.assertEqual(self.api.quota.remaining, 0)
+        self.assertRaises(alma.QuotaExceeded, self.api.get_bib, 1)
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_daily_threshold(self):
+        responses.add(responses.GET, self.url, status=429,
+                      headers={'Retry-After': '2'},
+                      body='{"errorList": {"error": [{"errorCode": '
+                           '"DAILY_THRESHOLD"}]}}')
+        events = []
+        self.api.hooks.append(events.append)
+        begin = time.monotonic()
+        # not retried, nor waited for
+        self.assertRaises(alma.QuotaExceeded, self.api.get_bib, 1)
+        self.assertLess(time.monotonic() - begin, 1)
+        self.assertEqual(len(responses.calls), 1)
+        self.assertNotIn('retry', [e['event'] for e in events])
+        self.assertEqual(events[-1]['error'], 'quota')
+        self.assertEqual(self.api.quota.remaining, 0)
+
+    @responses.activate
+    def test_hooks(self):
+        events = []
+        self.api.hooks.append(events.append)
+        responses.add(responses.GET, self.url, status=503)
+        responses.add(responses.GET, self.url, status=404)
+        self.assertRaises(alma.HTTPError, self.api.get_bib, 1)
+        self.assertEqual([e['event'] for e in events],
+                         ['start', 'wait', 'wait', 'retry', 'wait', 'wait',
+                          'end'])
+        end = events[-1]
+        self.assertEqual((end['status'], end['error'], end['attempts']),
+                         (404, 'client', 2))
+
 class TestAlmaPUTRequests(unittest.TestCase):
     maxDiff = None
 
@@ -0,0 +1,180 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from pyalma.cache import MemoryCache, SQLiteCache
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MemoryCache(maxsize=3, ttl=60)
+
+    def key(self, path, params={}):
+        return self.cache.key('GET', path.split('/')[0], path, params, 'json')
+
+    def test_init_errors(self):
+        self.assertRaises(ValueError, MemoryCache, maxsize=0)
+
+    def test_key_params_order(self):
+        self.assertEqual(self.key('users', {'limit': 10, 'offset': 0}),
+                         self.key('users', {'offset': '0', 'limit': '10'}))
+
+    def test_get_set(self):
+        key = self.key('bibs/1')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, (200, 'application/json', b'{}'))
+        self.assertEqual(self.cache.get(key), (200, 'application/json', b'{}'))
+
+    def test_lru(self):
+        for n in range(3):
+            self.cache.set(self.key('bibs/{}'.format(n)), n)
+        # using bibs/0 makes bibs/1 the least recently used
+        self.cache.get(self.key('bibs/0'))
+        self.cache.set(self.key('bibs/3'), 3)
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get(self.key('bibs/1')))
+        self.assertEqual(self.cache.get(self.key('bibs/0')), 0)
+
+    def test_ttl(self):
+        cache = MemoryCache(ttl=0.05)
+        key = cache.key('GET', 'bib', 'bibs/1')
+        cache.set(key, 1)
+        self.assertEqual(cache.get(key), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(len(cache), 0)
+
+    def test_ttls(self):
+        cache = MemoryCache(ttls={'item': 0})
+        cache.set(cache.key('GET', 'item', 'bibs/1/holdings/2/items/3'), 1)
+        cache.set(cache.key('GET', 'bib', 'bibs/1'), 1)
+        self.assertEqual(len(cache), 1)
+
+    def test_invalidate(self):
+        cache = MemoryCache()
+        paths = ['bibs', 'bibs/1', 'bibs/1/holdings/2/items',
+                 'bibs/1/holdings/2/items/3', 'bibs/1/holdings/2/items/4',
+                 'bibs/12', 'users/1']
+        for path in paths:
+            cache.set(cache.key('GET', 'x', path), path)
+        cache.invalidate('bibs/1/holdings/2/items/3')
+        kept = [path for path in paths
+                if cache.get(cache.key('GET', 'x', path)) is not None]
+        self.assertEqual(kept, ['bibs/1/holdings/2/items/4', 'bibs/12',
+                                'users/1'])
+
+    def test_generation(self):
+        cache = MemoryCache()
+        paths = ['bibs', 'bibs/1', 'bibs/1/holdings/2/items/3',
+                 'bibs/1/holdings/2/items/4', 'bibs/12']
+        # GETs sent before a write to bibs/1/holdings/2 finish after it
+        generation = cache.generation()
+        cache.invalidate('bibs/1/holdings/2')
+        for path in paths:
+            cache.set(cache.key('GET', 'x', path), path, generation)
+        kept = [path for path in paths
+                if cache.get(cache.key('GET', 'x', path)) is not None]
+        self.assertEqual(kept, ['bibs/12'])
+        # sent after it
+        cache.set(cache.key('GET', 'x', 'bibs/1'), 1, cache.generation())
+        self.assertEqual(cache.get(cache.key('GET', 'x', 'bibs/1')), 1)
+
+    def test_generation_forgotten(self):
+        cache = MemoryCache()
+        generation = cache.generation()
+        with mock.patch('pyalma.cache.GENERATIONS_MAXSIZE', 2):
+            for n in range(3):
+                cache.invalidate('users/{}'.format(n))
+        # too old to tell whether bibs/1 was written since
+        cache.set(cache.key('GET', 'x', 'bibs/1'), 1, generation)
+        self.assertEqual(len(cache), 0)
+
+
+class TestSQLiteCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.db')
+        self.cache = SQLiteCache(self.path, maxsize=3, ttl=60)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def key(self, path):
+        return self.cache.key('GET', path.split('/')[0], path, {}, 'json')
+
+    def test_get_set(self):
+        key = self.key('bibs/1')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, (200, 'application/json', b'{}'))
+        self.assertEqual(self.cache.get(key), (200, 'application/json', b'{}'))
+
+    def test_persistent(self):
+        self.cache.set(self.key('bibs/1'), (200, 'application/xml', b'<bib/>'))
+        self.cache.close()
+        # a new process opening the same file, e.g. after a restart
+        cache = SQLiteCache(self.path)
+        self.assertEqual(cache.get(self.key('bibs/1')),
+                         (200, 'application/xml', b'<bib/>'))
+        cache.close()
+
+    def test_threads(self):
+        results = []
+
+        def read():
+            results.append(self.cache.get(self.key('bibs/1')))
+
+        self.cache.set(self.key('bibs/1'), (200, 'application/xml', b'<bib/>'))
+        threads = [threading.Thread(target=read) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [(200, 'application/xml', b'<bib/>')] * 4)
+
+    def test_maxsize(self):
+        for n in range(5):
+            self.cache.set(self.key('bibs/{}'.format(n)), (200, '', b''))
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get(self.key('bibs/1')))
+        self.assertIsNotNone(self.cache.get(self.key('bibs/4')))
+
+    def test_ttl(self):
+        cache = SQLiteCache(self.path, ttl=0.05)
+        cache.set(self.key('bibs/1'), (200, '', b''))
+        time.sleep(0.06)
+        self.assertIsNone(cache.get(self.key('bibs/1')))
+        cache.purge()
+        self.assertEqual(len(cache), 0)
+        cache.close()
+
+    def test_invalidate(self):
+        cache = SQLiteCache(self.path)
+        paths = ['bibs', 'bibs/1', 'bibs/1/holdings/2/items',
+                 'bibs/1/holdings/2/items/3', 'bibs/1/holdings/2/items/4',
+                 'bibs/12', 'users/1']
+        for path in paths:
+            cache.set(self.key(path), (200, '', b''))
+        cache.invalidate('bibs/1/holdings/2/items')
+        kept = [path for path in paths
+                if cache.get(self.key(path)) is not None]
+        self.assertEqual(kept, ['bibs/12', 'users/1'])
+        cache.close()
+
+    def test_generation(self):
+        generation = self.cache.generation()
+        self.cache.invalidate('bibs/1')
+        self.cache.set(self.key('bibs/1'), (200, '', b''), generation)
+        self.cache.set(self.key('bibs/2'), (200, '', b''), generation)
+        self.assertIsNone(self.cache.get(self.key('bibs/1')))
+        self.assertIsNotNone(self.cache.get(self.key('bibs/2')))
+
+
+if __name__ == '__main__':
+    unittest.main()
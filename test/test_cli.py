@@ -0,0 +1,176 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from importlib import reload
+
+from aioresponses import aioresponses
+
+from pyalma import alma, cli
+from pyalma.metrics import Metrics
+
+
+def setUpModule():
+    os.environ['ALMA_API_KEY'] = 'my fake key'
+    os.environ['ALMA_API_REGION'] = 'APAC'
+    reload(alma)
+
+
+class TestReadRows(unittest.TestCase):
+
+    def rows(self, text, input_format):
+        reader = cli.LineReader(io.BytesIO(text.encode('utf-8')))
+        return list(reader.read_rows(input_format))
+
+    def test_csv_id_columns(self):
+        rows = self.rows('mms_id,holding_id,,\n1,2,,\n3,4,,\n', 'csv')
+        self.assertEqual(rows, [
+            {'ids': {'mms_id': '1', 'holding_id': '2'}, 'data': None},
+            {'ids': {'mms_id': '3', 'holding_id': '4'}, 'data': None}])
+
+    def test_csv_ids_column(self):
+        text = 'ids,status,data\n"{""mms_id"": 1}",200,"<bib>\n</bib>"\n' \
+               '"{\'mms_id\': \'2\'}",200,<bib/>\n'
+        rows = self.rows(text, 'csv')
+        self.assertEqual(rows, [
+            {'ids': {'mms_id': 1}, 'data': '<bib>\n</bib>'},
+            {'ids': {'mms_id': '2'}, 'data': '<bib/>'}])
+
+    def test_csv_original_column(self):
+        rows = self.rows('mms_id,original,data\n1,<bib/>,<bib> </bib>\n',
+                         'csv')
+        self.assertEqual(rows, [{'ids': {'mms_id': '1'}, 'data': '<bib> </bib>',
+                                 'original': '<bib/>'}])
+
+    def test_jsonl(self):
+        text = '{"ids": {"mms_id": 1}, "params": {"view": "brief"}}\n\n' \
+               '{"mms_id": 2}\n'
+        rows = self.rows(text, 'jsonl')
+        self.assertEqual(rows, [
+            {'ids': {'mms_id': 1}, 'params': {'view': 'brief'},
+             'data': None},
+            {'ids': {'mms_id': 2}, 'data': None}])
+
+    def test_fixture(self):
+        with open('test/mms_holding_item.csv', 'rb') as f:
+            reader = cli.LineReader(f, os.path.getsize(f.name))
+            rows = list(reader.read_rows('csv'))
+        self.assertEqual(sorted(rows[0]['ids']),
+                         ['holding_id', 'item_pid', 'mms_id'])
+        self.assertEqual(reader.bytes_read, reader.size)
+        self.assertEqual(reader.rows_read, len(rows))
+
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.input = os.path.join(self.tmpdir, 'mms.jsonl')
+        with open(self.input, 'w') as f:
+            for n in range(3):
+                f.write(json.dumps({'mms_id': n}) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def mock(self, m, status=200, headers=None):
+        for n in range(3):
+            m.get(alma.Alma().fullurl('bib', {'mms_id': n}), status=status,
+                  content_type='application/json',
+                  body=json.dumps({'mms_id': n}), headers=headers)
+
+    def test_jsonl_output(self):
+        output = os.path.join(self.tmpdir, 'out.jsonl')
+        with aioresponses() as m:
+            self.mock(m)
+            code = cli.main(['get_bib', self.input, '-o', output,
+                             '--accept', 'json', '--ordered', '--quiet'])
+        self.assertEqual(code, 0)
+        with open(output) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['data'] for line in lines],
+                         [{'mms_id': n} for n in range(3)])
+        self.assertEqual(lines[0]['status'], 200)
+
+    def test_metrics(self):
+        output = os.path.join(self.tmpdir, 'out.jsonl')
+        metrics = os.path.join(self.tmpdir, 'metrics.prom')
+        with aioresponses() as m:
+            self.mock(m)
+            cli.main(['get_bib', self.input, '-o', output, '--accept',
+                      'json', '--metrics', metrics, '--quiet'])
+        with open(metrics) as f:
+            lines = f.read().splitlines()
+        self.assertIn('pyalma_requests_total'
+                      '{resource="bib",method="GET",status="200"} 3', lines)
+
+    def test_expected_calls(self):
+        output = os.path.join(self.tmpdir, 'out.jsonl')
+        with aioresponses() as m:
+            self.mock(m, headers={'X-Exl-Api-Remaining': '1'})
+            code = cli.main(['get_bib', self.input, '-o', output,
+                             '--accept', 'json', '--expected-calls', '3',
+                             '--concurrency', '1', '--quiet'])
+            self.assertEqual(code, 1)
+            # stopped once the first response reported the quota
+            self.assertEqual(len(m._responses), 2)
+
+    def test_get_bibs_journal(self):
+        stderr = io.StringIO()
+        with mock.patch('sys.stderr', stderr):
+            self.assertRaises(SystemExit, cli.main,
+                              ['get_bibs', self.input, '--journal',
+                               os.path.join(self.tmpdir, 'journal')])
+        self.assertIn('--journal is not supported by get_bibs',
+                      stderr.getvalue())
+
+    def test_csv_output_resume(self):
+        output = os.path.join(self.tmpdir, 'out.csv')
+        journal = os.path.join(self.tmpdir, 'journal')
+        args = ['get_bib', self.input, '-o', output, '--accept', 'json',
+                '--journal', journal, '--max-attempts', '1', '--quiet']
+        with aioresponses() as m:
+            self.mock(m, status=400)
+            self.assertEqual(cli.main(args), 1)
+        with aioresponses() as m:
+            self.mock(m)
+            self.assertEqual(cli.main(args), 0)
+        with open(output) as f:
+            rows = list(cli.LineReader(io.BytesIO(f.read().encode()))
+                        .read_rows('csv'))
+        self.assertEqual(len(rows), 3)
+        with aioresponses() as m:
+            # everything succeeded: nothing left to do
+            self.assertEqual(cli.main(args), 0)
+
+    def test_progress(self):
+        stream = io.StringIO()
+        reader = cli.LineReader(io.BytesIO(b''), size=100)
+        progress = cli.Progress(reader, stream=stream, interval=0)
+        reader.bytes_read, reader.rows_read = 50, 10
+        progress.update(alma.Result({}, 200, ''))
+        self.assertIn('1 done, 0 errors', stream.getvalue())
+        self.assertIn('left', stream.getvalue())
+
+    def test_progress_phases(self):
+        stream = io.StringIO()
+        metrics = Metrics()
+        metrics({'event': 'trace', 'resource': 'bib', 'method': 'GET',
+                 'pool': 0.0, 'dns': 0.0, 'connect': 0.05, 'ttfb': 0.3,
+                 'transfer': 0.01, 'reused': False})
+        metrics({'event': 'end', 'resource': 'bib', 'method': 'GET',
+                 'status': 200, 'error': None, 'elapsed': 0.4,
+                 'bytes': 10})
+        reader = cli.LineReader(io.BytesIO(b''))
+        progress = cli.Progress(reader, stream=stream, metrics=metrics)
+        progress.report(final=True)
+        self.assertIn('GET bib: pool 0.000s, dns 0.000s, connect 0.050s, '
+                      'ttfb 0.300s, transfer 0.010s per call, 1 new and 0 '
+                      'reused connections', stream.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
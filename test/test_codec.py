@@ -0,0 +1,50 @@
+import json
+import unittest
+import xml.etree.ElementTree as ET
+
+from pyalma.codec import Codec, RawCodec
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_decode_json(self):
+        codec = Codec()
+        body = {'mms_id': '1', 'title': 'café'}
+        content = json.dumps(body).encode('utf-8')
+        self.assertEqual(codec.decode('application/json;charset=UTF-8',
+                                      content), body)
+
+    def test_decode_xml(self):
+        content = '<bib><title>café</title></bib>'.encode('utf-8')
+        self.assertEqual(Codec().decode('application/xml', content),
+                         '<bib><title>café</title></bib>')
+        element = Codec(xml_tree=True).decode('application/xml', content)
+        self.assertEqual(element.findtext('title'), 'café')
+
+    def test_raw(self):
+        codec = RawCodec()
+        self.assertEqual(codec.decode('application/json', b'{"a": 1}'),
+                         b'{"a": 1}')
+        self.assertEqual(codec.decode('application/xml', b'<a/>'), b'<a/>')
+
+    def test_encode(self):
+        codec = Codec()
+        self.assertIsNone(codec.encode(None))
+        self.assertEqual(codec.encode('<bib/>', 'xml'), '<bib/>')
+        self.assertEqual(codec.encode(b'<bib/>', 'xml'), b'<bib/>')
+        self.assertEqual(json.loads(codec.encode({'a': 'é'}, 'json')
+                                    .decode('utf-8')), {'a': 'é'})
+        element = ET.fromstring('<bib><title>t</title></bib>')
+        self.assertEqual(ET.fromstring(codec.encode(element, 'xml'))
+                         .findtext('title'), 't')
+
+    def test_round_trip(self):
+        codec = Codec()
+        body = {'bib': [{'mms_id': 1}], 'total_record_count': 1}
+        self.assertEqual(codec.loads(codec.dumps(body)), body)
+        self.assertEqual(codec.loads(codec.dumps(body).decode('utf-8')),
+                         body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,23 +1,58 @@
+import itertools
 import json
 import os
+import tempfile
+import time
 from importlib import reload
 
 from pyalma import alma
+from pyalma.cache import MemoryCache
+from pyalma.codec import Codec, RawCodec
+from pyalma.metrics import Metrics
+from pyalma.models import Item
+from pyalma.ratelimit import TokenBucket
+from pyalma.result import Result
+from pyalma.retry import RetryPolicy
 
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import aiohttp
 import asynctest
 from aioresponses import aioresponses
+import responses
 
 from datetime import datetime
 
 
+LIST_KEYS = {'holdings': 'holding', 'items': 'item',
+             'item_requests': 'user_request'}
+
+
 def setUpModule():
     os.environ['ALMA_API_KEY'] = 'my fake key'
     os.environ['ALMA_API_REGION'] = 'APAC'
     reload(alma)
 
 
+def title(record):
+    # module level, so that the process pool can pickle it
+    return record.title()
+
+
+def fail(raw):
+    raise ValueError('cannot parse')
+
+
+def retitle(body):
+    if '<title>1' in body:
+        return body.replace('<title>1', '<title>new 1')
+    if '<title>2' in body:
+        return None
+    if '<title>3' in body:
+        return body.replace('</title>', '</title>\n')
+    raise ValueError('cannot transform')
+
+
 class TestAsyncRequests(asynctest.TestCase):
 
     maxDiff = None
@@ -96,6 +131,8 @@ class TestAsyncRequests(asynctest.TestCase):
 
     def test_rate_limit(self):
         self.api.max_calls = 20
+        # the same bib every time: make separate calls
+        self.api.flights = None
         # self.semaphore_limit = 500
         ids = {'mms_id': 9922405930001552}
         ids_in = {'ids': {'mms_id': 9922405930001552}, 'data': None}
@@ -118,6 +155,589 @@ class TestAsyncRequests(asynctest.TestCase):
         self.assertTrue(self.api.max_calls >= items_finished/time_to_finish)
 
 
+    def test_cor_request_shares_rate_limiter(self):
+        self.api.max_calls = 10
+        self.api.flights = None
+        ids = {'mms_id': 9922405930001552}
+        ids_list = [{'ids': ids, 'data': None}] * 5
+        url = self.api.fullurl('bib', ids)
+        with aioresponses() as m:
+            for i in range(5):
+                m.get(url,
+                      status=200,
+                      content_type='application/json',
+                      body='{}')
+            with asynctest.patch.object(self.api.rate_limiter, 'cor_acquire',
+                                        wraps=self.api.rate_limiter.cor_acquire) as acquire:
+                resp = self.api.cor_get_bib(ids_list)
+        self.assertEqual(acquire.call_count, 5)
+        self.assertEqual([r[1] for r in resp], [200] * 5)
+
+    def test_cor_request_429(self):
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib', ids)
+        with aioresponses() as m:
+            m.get(url,
+                  status=429,
+                  content_type='application/json',
+                  body='{}')
+            m.get(url,
+                  status=200,
+                  content_type='application/json',
+                  body='{}')
+            resp = self.api.cor_get_bib([{'ids': ids, 'data': None}])
+        self.assertEqual(resp[0][1], 200)
+
+    def test_cor_request_retry_5xx(self):
+        self.api.retry_policy = RetryPolicy(backoff=0.01)
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib', ids)
+        with aioresponses() as m:
+            m.get(url, status=502, body='')
+            m.get(url, status=503, body='', headers={'Retry-After': '0.1'})
+            m.get(url, status=200, content_type='application/json', body='{}')
+            begin = time.monotonic()
+            resp = self.api.cor_get_bib([{'ids': ids}], accept='json')
+        self.assertEqual(resp, [(ids, 200, {})])
+        self.assertGreaterEqual(time.monotonic() - begin, 0.1)
+
+    def test_cor_request_retry_gives_up(self):
+        self.api.retry_policy = RetryPolicy(max_attempts=2, backoff=0.01)
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib', ids)
+        with aioresponses() as m:
+            for i in range(3):
+                m.get(url, status=500, body='')
+            resp = self.api.cor_get_bib([{'ids': ids}], accept='json')
+            # the third response was never asked for
+            self.assertEqual(resp[0][1], 500)
+            self.assertEqual(len(m._responses), 1)
+
+    def test_cor_request_no_retry_post(self):
+        self.api.retry_policy = RetryPolicy(backoff=0.01)
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib_requests', ids)
+        with aioresponses() as m:
+            m.post(url, status=503, body='')
+            m.post(url, status=200, body='{}')
+            resp = self.api.cor_post_bib_request([{'ids': ids, 'data': '{}'}])
+        self.assertEqual(resp[0][1], 503)
+
+    def test_cor_stream_retry_budget(self):
+        self.api.retry_policy = RetryPolicy(backoff=0.01, budget_ratio=0,
+                                            budget_minimum=1)
+        ids_list = [{'ids': {'mms_id': n}} for n in range(2)]
+        with aioresponses() as m:
+            for n in range(2):
+                url = self.api.fullurl('bib', {'mms_id': n})
+                m.get(url, status=503, body='')
+                m.get(url, status=503, body='')
+                m.get(url, status=200, body='{}')
+            resp = self.api.cor_get_bib(ids_list, accept='json')
+        # one retry for the whole batch: both calls fail
+        self.assertEqual([r[1] for r in resp], [503, 503])
+
+    def test_cor_put_item_journal(self):
+        self.api.retry_policy = RetryPolicy(max_attempts=1)
+        ids_list = [{'ids': {'mms_id': 1, 'holding_id': 2, 'item_pid': n},
+                     'data': '<item/>'} for n in range(3)]
+        urls = [self.api.fullurl('item', input_param['ids'])
+                for input_param in ids_list]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'journal.jsonl')
+            with aioresponses() as m:
+                m.put(urls[0], status=200, body='<item/>',
+                      content_type='application/xml')
+                m.put(urls[1], status=500, body='')
+                # urls[2] never answers
+                resp = self.api.cor_put_item(ids_list, journal=path)
+            self.assertEqual([r.error for r in resp],
+                             [None, 'server', 'connection'])
+            with aioresponses() as m:
+                m.put(urls[1], status=200, body='<item/>',
+                      content_type='application/xml')
+                m.put(urls[2], status=200, body='<item/>',
+                      content_type='application/xml')
+                resp = self.api.cor_put_item(ids_list, journal=path)
+        self.assertEqual([r[0]['item_pid'] for r in resp], [1, 2])
+        self.assertEqual([r[1] for r in resp], [200, 200])
+
+    def test_cor_request_result(self):
+        self.api.retry_policy = RetryPolicy(backoff=0.01)
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib', ids)
+        with aioresponses() as m:
+            m.get(url, status=503, body='busy')
+            m.get(url, status=200, content_type='application/json',
+                  body='{"mms_id": 1}')
+            result, = self.api.cor_get_bib([{'ids': ids}], accept='json')
+        self.assertTrue(result.ok)
+        self.assertEqual(result.attempts, 2)
+        self.assertGreater(result.elapsed, 0)
+        self.assertEqual(result.raw, b'{"mms_id": 1}')
+        self.assertEqual(result.request['resource'], 'bib')
+
+    def test_cor_stream_errors_isolated(self):
+        self.api.retry_policy = RetryPolicy(max_attempts=1)
+        ids_list = [{'ids': {'mms_id': n}} for n in range(4)]
+        with aioresponses() as m:
+            for n in (0, 1, 3):
+                m.get(self.api.fullurl('bib', {'mms_id': n}), status=200,
+                      content_type='application/json', body='{}')
+            # mms_id 2 fails with a connection error
+            resp = self.api.cor_get_bib(ids_list, accept='json')
+        self.assertEqual([r.status for r in resp], [200, 200, None, 200])
+        self.assertEqual(resp[2].error, 'connection')
+        self.assertIsInstance(resp[2].exception,
+                              aiohttp.errors.ClientConnectionError)
+
+    def test_cor_stream_quota(self):
+        self.api.retry_policy = RetryPolicy(max_attempts=1)
+        self.api.quota.update({'X-Exl-Api-Remaining': '2'})
+        ids_list = [{'ids': {'mms_id': n}} for n in range(3)]
+        # a list is checked before anything is sent
+        self.assertRaises(alma.QuotaExceeded, self.api.cor_get_bib, ids_list)
+        with aioresponses() as m:
+            for n, remaining in ((0, '1'), (1, '0')):
+                m.get(self.api.fullurl('bib', {'mms_id': n}), status=200,
+                      content_type='application/json', body='{}',
+                      headers={'X-Exl-Api-Remaining': remaining})
+            resp = self.api.cor_get_bib(iter(ids_list), accept='json')
+        self.assertEqual([r.error for r in resp], [None, None, 'quota'])
+        self.assertIsInstance(resp[2].exception, alma.QuotaExceeded)
+        self.assertEqual(self.api.quota.remaining, 0)
+
+    def test_cor_stream_quota_unknown(self):
+        # a fresh client learns the quota from the first response
+        self.api.semaphore_limit = 1
+        ids_list = [{'ids': {'mms_id': n}} for n in range(10)]
+        for input_params, expected in ((ids_list, None),
+                                       (iter(ids_list), 10)):
+            with aioresponses() as m:
+                for n in range(10):
+                    m.get(self.api.fullurl('bib', {'mms_id': n}),
+                          status=200, content_type='application/json',
+                          body='{}', headers={'X-Exl-Api-Remaining': '5'})
+                stream = self.api.cor_stream('GET', 'bib', input_params,
+                                             accept='json',
+                                             expected=expected)
+                self.assertRaises(alma.QuotaExceeded, self.api.cor_execute,
+                                  self.api.cor_collect(stream))
+                # the batch stopped after its first calls
+                self.assertGreaterEqual(len(m._responses), 8)
+            self.api.quota = alma.Quota()
+
+    def test_cor_daily_threshold(self):
+        ids = {'mms_id': 1}
+        with aioresponses() as m:
+            m.get(self.api.fullurl('bib', ids), status=429,
+                  headers={'Retry-After': '2'},
+                  body='{"errorList": {"error": [{"errorCode": '
+                       '"DAILY_THRESHOLD"}]}}')
+            begin = time.monotonic()
+            result, = self.api.cor_get_bib([{'ids': ids}])
+        self.assertLess(time.monotonic() - begin, 1)
+        self.assertEqual((result.status, result.error, result.attempts),
+                         (429, 'quota', 1))
+        self.assertEqual(self.api.quota.remaining, 0)
+
+    def test_cor_hooks(self):
+        self.api.retry_policy = RetryPolicy(backoff=0.01)
+        events = []
+        metrics = Metrics()
+        self.api.hooks = [events.append, metrics]
+        ids = {'mms_id': 1}
+        url = self.api.fullurl('bib', ids)
+        with aioresponses() as m:
+            m.get(url, status=503, body='busy')
+            m.get(url, status=200, content_type='application/json',
+                  body='{"mms_id": 1}')
+            self.api.cor_get_bib([{'ids': ids}], accept='json')
+        self.assertEqual([(e['event'], e.get('kind')) for e in events],
+                         [('wait', 'queue'), ('wait', 'semaphore'),
+                          ('start', None),
+                          ('wait', 'rate_limit'), ('wait', 'quota'),
+                          ('retry', None),
+                          ('wait', 'rate_limit'), ('wait', 'quota'),
+                          ('end', None)])
+        retry, end = events[5], events[-1]
+        self.assertEqual((retry['status'], retry['error']), (503, 'server'))
+        self.assertEqual((end['resource'], end['method'], end['ids']),
+                         ('bib', 'GET', ids))
+        self.assertEqual((end['status'], end['attempts'], end['bytes']),
+                         (200, 2, 13))
+        summary = metrics.summary()['GET bib']
+        self.assertEqual((summary['requests'], summary['retries']), (1, 1))
+
+    def test_cor_hooks_cancelled(self):
+        # one call per 0.1 second: the other workers are still waiting
+        self.api.rate_limiter = TokenBucket(10, 1)
+        metrics = Metrics()
+        self.api.hooks = [metrics]
+        ids_list = [{'ids': {'mms_id': n}} for n in range(5)]
+
+        async def first():
+            stream = self.api.cor_stream('GET', 'bib', ids_list,
+                                         accept='json')
+            async for result in stream:
+                break
+            await stream.aclose()
+            # the workers finish cancelling
+            await asyncio.sleep(0.01)
+            return result
+
+        with aioresponses() as m:
+            for n in range(5):
+                m.get(self.api.fullurl('bib', {'mms_id': n}), status=200,
+                      content_type='application/json', body='{}')
+            result = self.api.cor_execute(first())
+        self.assertTrue(result.ok)
+        requests = metrics.requests[('bib', 'GET')]
+        self.assertEqual(requests[200], 1)
+        self.assertGreater(requests['cancelled'], 0)
+        self.assertEqual(metrics.in_flight, {('bib', 'GET'): 0})
+
+    def test_cor_replay(self):
+        self.api.retry_policy = RetryPolicy(max_attempts=1)
+        ids_list = [{'ids': {'mms_id': n}} for n in range(4)]
+        urls = [self.api.fullurl('bib', {'mms_id': n}) for n in range(4)]
+        with aioresponses() as m:
+            m.get(urls[0], status=200, content_type='application/json',
+                  body='{}')
+            m.get(urls[1], status=503, body='')
+            m.get(urls[2], status=404, body='')
+            resp = self.api.cor_get_bib(ids_list, accept='json')
+        self.assertEqual([r.error for r in resp],
+                         [None, 'server', 'client', 'connection'])
+        with aioresponses() as m:
+            # only the server and connection errors are made again
+            m.get(urls[1], status=200, content_type='application/json',
+                  body='{}')
+            m.get(urls[3], status=200, content_type='application/json',
+                  body='{}')
+            replayed = self.api.cor_replay(resp)
+        self.assertEqual([r.status for r in replayed], [200, 200, 404, 200])
+        self.assertEqual([r.ids for r in replayed],
+                         [input_param['ids'] for input_param in ids_list])
+
+    def test_cor_get_marc(self):
+        with open('test/bib.dat.xml', 'r') as dat:
+            body = dat.read()
+        ids_list = [{'ids': {'mms_id': n}} for n in range(3)]
+        with aioresponses() as m:
+            for n in range(2):
+                m.get(self.api.fullurl('bib', {'mms_id': n}), status=200,
+                      content_type='application/xml', body=body)
+            m.get(self.api.fullurl('bib', {'mms_id': 2}), status=400,
+                  body='')
+            resp = self.api.cor_get_marc(ids_list, transform=title,
+                                         processes=2)
+        self.assertEqual([r.body for r in resp[:2]],
+                         ['Envisioning information /'] * 2)
+        self.assertEqual(resp[2].status, 400)
+
+    def test_cor_get_marc_lazy(self):
+        with open('test/bib.dat.xml', 'r') as dat:
+            body = dat.read()
+        ids_list = [{'ids': {'mms_id': n}} for n in range(2)]
+        with aioresponses() as m:
+            m.get(self.api.fullurl('bib', {'mms_id': 0}), status=200,
+                  content_type='application/xml', body=body)
+            m.get(self.api.fullurl('bib', {'mms_id': 1}), status=200,
+                  content_type='application/xml', body=body)
+            resp = self.api.cor_get_marc(ids_list, lazy=True)
+        self.assertEqual([r.body.value('245', 'a') for r in resp],
+                         ['Envisioning information /'] * 2)
+        self.assertEqual(resp[0].body.control('001'), '333281')
+
+    def test_cor_put_unchanged(self):
+        original = '<bib><mms_id>1</mms_id><title>one</title></bib>'
+        ids_list = [{'ids': {'mms_id': 1}, 'original': original,
+                     'data': '<bib>\n  <mms_id>1</mms_id>\n'
+                             '  <title>one</title>\n</bib>'},
+                    {'ids': {'mms_id': 2}, 'original': original,
+                     'data': original.replace('one', 'two')}]
+        with aioresponses() as m:
+            m.put(self.api.fullurl('bib', {'mms_id': 2}), status=200,
+                  content_type='application/xml', body='<bib/>')
+            resp = self.api.cor_put_bib(ids_list)
+            # only the edited bib was sent
+            self.assertEqual(len(m._responses), 0)
+        self.assertEqual([r.status for r in resp], [304, 200])
+        self.assertEqual([r.unchanged for r in resp], [True, False])
+        self.assertTrue(resp[0].ok)
+        self.assertEqual(resp[0].body, original)
+        self.assertEqual(resp[0].attempts, 0)
+
+    def mock_update(self, m):
+        for n in (1, 2, 3, 5):
+            m.get(self.api.fullurl('bib', {'mms_id': n}), status=200,
+                  content_type='application/xml',
+                  body='<bib><title>{}</title></bib>'.format(n))
+        m.get(self.api.fullurl('bib', {'mms_id': 4}), status=404, body='')
+        m.put(self.api.fullurl('bib', {'mms_id': 1}), status=200,
+              content_type='application/xml',
+              body='<bib><title>new 1</title></bib>')
+
+    def check_update(self, resp):
+        resp = dict((r.ids['mms_id'], r) for r in resp)
+        self.assertEqual(sorted(resp), [1, 2, 3, 4, 5])
+        self.assertEqual(resp[1].body, '<bib><title>new 1</title></bib>')
+        self.assertEqual(resp[1].request['method'], 'PUT')
+        # func returned None, or the same record
+        self.assertEqual((resp[2].status, resp[2].unchanged), (304, True))
+        self.assertEqual(resp[2].body, '<bib><title>2</title></bib>')
+        self.assertEqual((resp[3].status, resp[3].unchanged), (304, True))
+        self.assertEqual(resp[4].error, 'client')
+        self.assertEqual(resp[5].error, 'exception')
+
+    def test_cor_update(self):
+        ids_list = [{'ids': {'mms_id': n}} for n in range(1, 6)]
+        with aioresponses() as m:
+            self.mock_update(m)
+            resp = self.api.cor_update('bib', ids_list, retitle)
+            # only bib 1 was sent back
+            self.assertEqual(len(m._responses), 0)
+        self.check_update(resp)
+
+    def test_cor_update_executor(self):
+        ids_list = [{'ids': {'mms_id': n}} for n in range(1, 6)]
+        with aioresponses() as m, ThreadPoolExecutor(2) as executor:
+            self.mock_update(m)
+            resp = self.api.cor_update('bib', ids_list, retitle,
+                                       executor=executor)
+            self.assertEqual(len(m._responses), 0)
+        self.check_update(resp)
+
+    def fake_inventory(self, calls):
+        # two holdings per bib, three items per holding, one request per
+        # item; the items of holding 2 of bib 2 fail
+        async def fake_request(httpmethod, resource, ids, session, **kwargs):
+            params = kwargs['params']
+            calls.append((resource, params['offset']))
+            if resource == 'holdings':
+                records = [{'holding_id': 'h1'}, {'holding_id': 'h2'}]
+            elif resource == 'items':
+                if ids == {'mms_id': 2, 'holding_id': 'h2'}:
+                    return Result(ids, 500, 'error', error='server')
+                records = [{'item_data': {'pid': 'i{}'.format(n)}}
+                           for n in range(3)]
+            else:
+                records = [{'request_id': 'r1'}]
+            page = records[params['offset']:][:params['limit']]
+            return Result(ids, 200, {LIST_KEYS[resource]: page,
+                                     'total_record_count': len(records)})
+        return fake_request
+
+    def test_cor_walk(self):
+        calls = []
+        ids_list = [{'ids': {'mms_id': n}} for n in (1, 2)]
+
+        async def run():
+            return [result async for result in
+                    self.api.cor_walk(ids_list, session=object(),
+                                      workers=3, limit=2)]
+
+        with asynctest.patch.object(self.api, 'cor_request',
+                                    self.fake_inventory(calls)):
+            resp = self.loop.run_until_complete(run())
+        items = sorted((r.ids['mms_id'], r.ids['holding_id'],
+                        r.ids['item_pid']) for r in resp
+                       if r.ok and 'item_pid' in r.ids)
+        self.assertEqual(items, [(1, 'h1', 'i0'), (1, 'h1', 'i1'),
+                                 (1, 'h1', 'i2'), (1, 'h2', 'i0'),
+                                 (1, 'h2', 'i1'), (1, 'h2', 'i2'),
+                                 (2, 'h1', 'i0'), (2, 'h1', 'i1'),
+                                 (2, 'h1', 'i2')])
+        self.assertEqual(len([r for r in resp if 'item_pid' not in r.ids]),
+                         5)
+        errors = [r for r in resp if not r.ok]
+        self.assertEqual(errors[0].ids, {'mms_id': 2, 'holding_id': 'h2'})
+        # 2 holdings lists, 4 item lists of 2 pages
+        self.assertEqual(len(calls), 2 + 2 * 3 + 1)
+
+    def test_cor_walk_slow_consumer(self):
+        calls = []
+
+        async def fake_request(httpmethod, resource, ids, session, **kwargs):
+            # 100 holdings per bib, 100 items per holding
+            calls.append(resource)
+            offset, limit = kwargs['params']['offset'], 10
+            if resource == 'holdings':
+                records = [{'holding_id': n} for n in range(offset,
+                                                            offset + limit)]
+            else:
+                records = [{'item_data': {'pid': n}}
+                           for n in range(offset, offset + limit)]
+            return Result(ids, 200, {LIST_KEYS[resource]: records,
+                                     'total_record_count': 100})
+
+        async def run():
+            walk = self.api.cor_walk(({'ids': {'mms_id': n}}
+                                      for n in itertools.count()),
+                                     session=object(), workers=2, limit=10)
+            for n in range(200):
+                await walk.__anext__()
+                await asyncio.sleep(0)
+            await walk.aclose()
+
+        with asynctest.patch.object(self.api, 'cor_request', fake_request):
+            self.loop.run_until_complete(run())
+        # 200 records taken, at most 2 * 10 waiting and 2 pages in flight
+        self.assertLessEqual(len(calls), (200 + 20) // 10 + 2)
+
+    def test_cor_walk_short_pages(self):
+        async def fake_request(httpmethod, resource, ids, session, **kwargs):
+            # 7 holdings per bib, 7 items per holding: the last page is short
+            offset = kwargs['params']['offset']
+            await asyncio.sleep(0.001 * (offset % 2))
+            if resource == 'holdings':
+                records = [{'holding_id': n}
+                           for n in range(offset, min(offset + 3, 7))]
+            else:
+                records = [{'item_data': {'pid': n}}
+                           for n in range(offset, min(offset + 3, 7))]
+            return Result(ids, 200, {LIST_KEYS[resource]: records,
+                                     'total_record_count': 7})
+
+        async def run():
+            results = []
+            async for result in self.api.cor_walk(
+                    [{'ids': {'mms_id': n}} for n in range(4)],
+                    session=object(), workers=3, limit=3):
+                results.append(result)
+                await asyncio.sleep(0.001)
+            return results
+
+        with asynctest.patch.object(self.api, 'cor_request', fake_request):
+            results = self.loop.run_until_complete(run())
+        items = [r for r in results if 'item_pid' in r.ids]
+        self.assertEqual(len(results) - len(items), 4 * 7)
+        self.assertEqual(len(items), 4 * 7 * 7)
+
+    def test_cor_get_inventory_depth(self):
+        calls = []
+        with asynctest.patch.object(self.api, 'cor_request',
+                                    self.fake_inventory(calls)):
+            resp = self.api.cor_get_inventory([{'ids': {'mms_id': 1}}],
+                                              depth=1)
+        self.assertEqual([r.ids for r in resp],
+                         [{'mms_id': 1, 'holding_id': 'h1'},
+                          {'mms_id': 1, 'holding_id': 'h2'}])
+        self.assertEqual(calls, [('holdings', 0)])
+        calls = []
+        with asynctest.patch.object(self.api, 'cor_request',
+                                    self.fake_inventory(calls)):
+            resp = self.api.cor_get_inventory([{'ids': {'mms_id': 1}}],
+                                              depth=3)
+        self.assertEqual(len([r for r in resp if 'request_id' in r.ids]), 6)
+
+    def test_cor_map_errors(self):
+        ids_list = [{'ids': {'mms_id': n}} for n in range(3)]
+
+        async def run():
+            stream = self.api.cor_stream('GET', 'bib', ids_list)
+            with ThreadPoolExecutor(2) as executor:
+                return [result async for result in
+                        self.api.cor_map(stream, fail, executor=executor)]
+
+        with aioresponses() as m:
+            for n in range(3):
+                m.get(self.api.fullurl('bib', {'mms_id': n}), status=200,
+                      content_type='application/xml', body='<bib/>')
+            resp = self.api.cor_execute(run())
+        self.assertEqual([r.error for r in resp], ['exception'] * 3)
+        self.assertIsInstance(resp[0].exception, ValueError)
+
+    def test_cor_stream(self):
+        ids_list = [{'ids': {'mms_id': n}, 'data': None} for n in range(5)]
+
+        async def collect(ordered):
+            responses = []
+            async for response in self.api.cor_stream('GET', 'bib', ids_list,
+                                                      accept='json',
+                                                      ordered=ordered):
+                responses.append(response)
+            return responses
+
+        with aioresponses() as m:
+            for n in range(5):
+                m.get(self.api.fullurl('bib', {'mms_id': n}),
+                      status=200,
+                      content_type='application/json',
+                      body=json.dumps({'mms_id': n}))
+            resp = self.loop.run_until_complete(collect(ordered=False))
+        self.assertEqual(sorted(r[2]['mms_id'] for r in resp), list(range(5)))
+
+        with aioresponses() as m:
+            for n in range(5):
+                m.get(self.api.fullurl('bib', {'mms_id': n}),
+                      status=200,
+                      content_type='application/json',
+                      body=json.dumps({'mms_id': n}))
+            resp = self.loop.run_until_complete(collect(ordered=True))
+        self.assertEqual([r[0] for r in resp], [p['ids'] for p in ids_list])
+
+    def test_cor_stream_workers(self):
+        in_flight = []
+        most = []
+
+        async def fake_request(httpmethod, resource, ids, session, **kwargs):
+            in_flight.append(ids)
+            most.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(ids)
+            return (ids, 200, '')
+
+        def input_params():
+            for n in range(20):
+                yield {'ids': {'mms_id': n}}
+
+        async def collect():
+            return [r async for r in self.api.cor_stream('GET', 'bib',
+                                                         input_params(),
+                                                         workers=3)]
+
+        with asynctest.patch.object(self.api, 'cor_request', fake_request):
+            resp = self.loop.run_until_complete(collect())
+        self.assertEqual(len(resp), 20)
+        self.assertEqual(max(most), 3)
+
+    def test_cor_stream_reads_lazily(self):
+        read = []
+
+        async def fake_request(httpmethod, resource, ids, session, **kwargs):
+            return (ids, 200, '')
+
+        async def input_params():
+            for n in range(100):
+                read.append(n)
+                yield {'ids': {'mms_id': n}, 'data': None}
+
+        async def first():
+            stream = self.api.cor_stream('GET', 'bib', input_params(),
+                                         workers=2)
+            async for response in stream:
+                await stream.aclose()
+                return response
+
+        with asynctest.patch.object(self.api, 'cor_request', fake_request):
+            resp = self.loop.run_until_complete(first())
+        self.assertEqual(resp[0], {'mms_id': 0})
+        self.assertLess(len(read), 10)
+
+    def test_cor_stream_input_error(self):
+        async def fake_request(httpmethod, resource, ids, session, **kwargs):
+            return (ids, 200, '')
+
+        def input_params():
+            yield {'ids': {'mms_id': 1}, 'data': None}
+            raise ValueError('bad row')
+
+        with asynctest.patch.object(self.api, 'cor_request', fake_request):
+            with self.assertRaises(ValueError):
+                self.api.cor_get_bib(input_params())
+
     def test_cor_get_bib(self):
         ids = {'mms_id': 9922405930001552}
         url = self.api.fullurl('bib', ids)
@@ -134,6 +754,102 @@ class TestAsyncRequests(asynctest.TestCase):
             bib = resp[0][2]
             self.assertEqual(bib, json.loads(body))
 
+    def test_cor_get_bibs(self):
+        url = self.api.fullurl('bibs')
+        body = {'bib': [{'mms_id': 1, 'title': 'one'},
+                        {'mms_id': 3, 'title': 'three'}],
+                'total_record_count': 2}
+        ids_list = [{'ids': {'mms_id': n}} for n in (1, 2, 3)]
+        with aioresponses() as m:
+            m.get(url,
+                  status=200,
+                  content_type='application/json',
+                  body=json.dumps(body))
+            resp = self.api.cor_get_bibs(ids_list, accept='json')
+        self.assertEqual([r[0] for r in resp],
+                         [{'mms_id': '1'}, {'mms_id': '2'}, {'mms_id': '3'}])
+        self.assertEqual([r[1] for r in resp], [200, 404, 200])
+        self.assertEqual(resp[2][2]['title'], 'three')
+
+    def test_cor_get_bibs_xml(self):
+        url = self.api.fullurl('bibs')
+        fh = open('test/bib.dat.xml', 'r')
+        bib = fh.read().split('?>', 1)[1]
+        fh.close()
+        body = '<bibs total_record_count="1">{}</bibs>'.format(bib)
+        with aioresponses() as m:
+            m.get(url,
+                  status=200,
+                  content_type='application/xml',
+                  body=body)
+            resp = self.api.cor_get_bibs([{'ids': {'mms_id': 9922405930001551}}])
+        self.assertEqual(resp[0][1], 200)
+        self.assertTrue(resp[0][2].startswith('<bib><mms_id>9922405930001551'))
+
+    def test_cor_get_bibs_raw(self):
+        self.api.codec = RawCodec()
+        url = self.api.fullurl('bibs')
+        body = {'bib': [{'mms_id': 1, 'title': 'one'}],
+                'total_record_count': 1}
+        with aioresponses() as m:
+            m.get(url,
+                  status=200,
+                  content_type='application/json',
+                  body=json.dumps(body))
+            resp = self.api.cor_get_bibs([{'ids': {'mms_id': 1}}],
+                                         accept='json')
+        self.assertIsInstance(resp[0][2], bytes)
+        self.assertEqual(json.loads(resp[0][2].decode('utf-8'))['title'],
+                         'one')
+
+    def test_cor_get_bibs_xml_tree(self):
+        self.api.codec = Codec(xml_tree=True)
+        url = self.api.fullurl('bibs')
+        body = ('<bibs total_record_count="1"><bib><mms_id>1</mms_id>'
+                '<title>one</title></bib></bibs>')
+        with aioresponses() as m:
+            m.get(url,
+                  status=200,
+                  content_type='application/xml',
+                  body=body)
+            resp = self.api.cor_get_bibs([{'ids': {'mms_id': 1}}])
+        self.assertEqual(resp[0][2].findtext('title'), 'one')
+
+    def test_cor_request_accept(self):
+        ids = {'mms_id': 1}
+        sent = []
+
+        class Session(object):
+            def request(self, method, headers, url, params, data):
+                sent.append((headers, data))
+                raise aiohttp.errors.ClientOSError('no network')
+
+        self.api.retry_policy = RetryPolicy(max_attempts=1)
+        result = self.loop.run_until_complete(self.api.cor_request(
+            'PUT', 'bib', ids, Session(), data={'mms_id': '1'},
+            accept='json', content_type='json'))
+        self.assertEqual(result.error, 'connection')
+        headers, data = sent[0]
+        self.assertEqual(headers['Accept'], 'application/json')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(data.decode('utf-8')), {'mms_id': '1'})
+
+    def test_cor_stream_bibs_chunks(self):
+        calls = []
+
+        async def fake_request(httpmethod, resource, ids, session, **kwargs):
+            calls.append(kwargs['params']['mms_id'])
+            bibs = [{'mms_id': mms_id} for mms_id in ids['mms_id'].split(',')]
+            return Result(ids, 200, {'bib': bibs})
+
+        ids_list = [{'ids': {'mms_id': n}} for n in range(250)]
+        with asynctest.patch.object(self.api, 'cor_request', fake_request):
+            resp = self.api.cor_get_bibs(ids_list)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(calls[0].split(',')), alma.BIBS_LIMIT)
+        self.assertEqual([r[0]['mms_id'] for r in resp],
+                         [str(n) for n in range(250)])
+
     def test_cor_get_holdings(self):
         ids = {'mms_id': 99100383900121}
         url = self.api.fullurl('holdings', ids)
@@ -288,5 +1004,249 @@ class TestAsyncRequests(asynctest.TestCase):
             item_request_response = resp[0][2]
             self.assertEqual(expected, item_request_response)
 
+    def test_cor_batch_twice(self):
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib', ids)
+        fh = open('test/bib.dat', 'r')
+        body = fh.read()
+        fh.close()
+        with aioresponses() as m:
+            m.get(url,
+                  status=200,
+                  content_type='application/json',
+                  body=body)
+            m.get(url,
+                  status=200,
+                  content_type='application/json',
+                  body=body)
+            first = self.api.cor_get_bib([{'ids': ids, 'data': None}])
+            second = self.api.cor_get_bib([{'ids': ids, 'data': None}])
+            self.assertEqual(first, second)
+            self.assertFalse(self.loop.is_closed())
+
+
+    def test_cor_request_single_flight(self):
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib', ids)
+        with aioresponses() as m:
+            # each mock answers once, so a second call would fail
+            m.get(url,
+                  status=200,
+                  content_type='application/json',
+                  body='{"mms_id": 9922405930001552}')
+            resp = self.api.cor_get_bib([{'ids': ids}] * 10, accept='json')
+        self.assertEqual(resp, [(ids, 200, {'mms_id': 9922405930001552})] * 10)
+        self.assertEqual(len(self.api.flights), 0)
+
+    def test_cor_request_cached(self):
+        self.api.cache = MemoryCache()
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib', ids)
+        with aioresponses() as m:
+            # each mock answers once, so a second call would fail
+            m.get(url,
+                  status=200,
+                  content_type='application/json',
+                  body='{"mms_id": 9922405930001552}')
+            first = self.api.cor_get_bib([{'ids': ids}], accept='json')
+            second = self.api.cor_get_bib([{'ids': ids}], accept='json')
+        self.assertEqual(first, second)
+        self.assertEqual(second[0], (ids, 200, {'mms_id': 9922405930001552}))
+        # the synchronous methods share the cache
+        self.assertEqual(self.api.get_bib(ids['mms_id'], accept='json'),
+                         {'mms_id': 9922405930001552})
+
+    @responses.activate
+    def test_cor_request_cached_put(self):
+        self.api.cache = MemoryCache()
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib', ids)
+        responses.add(responses.PUT, url, status=200,
+                      content_type='application/json',
+                      body='{"title": "new"}')
+        update = self.api.quota.update
+
+        def put_first(headers):
+            # the PUT finishes after the GET was sent, before it is stored
+            self.api.quota.update = update
+            self.api.put_bib(ids['mms_id'], '{"title": "new"}',
+                             content_type='json', accept='json')
+            update(headers)
+
+        self.api.quota.update = put_first
+        with aioresponses() as m:
+            m.get(url, status=200, content_type='application/json',
+                  body='{"title": "old"}')
+            old, = self.api.cor_get_bib([{'ids': ids}], accept='json')
+            new, = self.api.cor_get_bib([{'ids': ids}], accept='json')
+        self.assertEqual(old.body, {'title': 'old'})
+        self.assertEqual(new.body, {'title': 'new'})
+        self.assertEqual(new.attempts, 0)
+
+
+class TestAsyncAlma(asynctest.TestCase):
+
+    maxDiff = None
+
+    def setUp(self):
+        self.api = alma.AsyncAlma(apikey='unreal', region='US')
+
+    async def tearDown(self):
+        await self.api.close()
+
+    async def test_get_bib(self):
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib', ids)
+        fh = open('test/bib.dat', 'r')
+        body = fh.read()
+        fh.close()
+        with aioresponses() as m:
+            m.get(url,
+                  status=200,
+                  content_type='application/json',
+                  body=body)
+            bib = await self.api.get_bib(9922405930001552)
+            self.assertEqual(bib, json.loads(body))
+
+    async def test_request_model(self):
+        ids = {'mms_id': 1, 'holding_id': 2, 'item_pid': 3}
+        with open('test/item.dat', 'rb') as dat:
+            body = dat.read()
+        with aioresponses() as m:
+            m.get(self.api.fullurl('item', ids), status=200,
+                  content_type='application/json', body=body)
+            item = await self.api.request_model('GET', 'item', ids)
+        self.assertIsInstance(item, Item)
+        self.assertEqual(item.raw, body)
+        self.assertEqual(item.data, json.loads(body.decode('utf-8')))
+
+    async def test_shared_session(self):
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib', ids)
+        fh = open('test/bib.dat', 'r')
+        body = fh.read()
+        fh.close()
+        with aioresponses() as m:
+            m.get(url,
+                  status=200,
+                  content_type='application/json',
+                  body=body)
+            m.get(url,
+                  status=200,
+                  content_type='application/json',
+                  body=body)
+            session = self.api.client_session
+            await self.api.get_bib(9922405930001552)
+            resp = await self.api.cor_get_bib([{'ids': ids, 'data': None}])
+            self.assertIs(self.api.client_session, session)
+            self.assertEqual(resp[0][2], json.loads(body))
+
+    async def test_get_bib_error(self):
+        ids = {'mms_id': 9922405930001552}
+        url = self.api.fullurl('bib', ids)
+        with aioresponses() as m:
+            m.get(url,
+                  status=400,
+                  content_type='application/xml',
+                  body='bad request')
+            with self.assertRaises(alma.AsyncHTTPError) as cm:
+                await self.api.get_bib(9922405930001552)
+            self.assertEqual(cm.exception.status, 400)
+
+    async def test_iter_items(self):
+        ids = {'mms_id': 9922405930001552, 'holding_id': 22115858660001551}
+        url = self.api.fullurl('items', ids)
+        self.api.max_calls = 1000
+        with aioresponses() as m:
+            for offset in range(0, 250, 100):
+                items = [{'item_data': {'pid': str(n)}}
+                         for n in range(offset, min(offset + 100, 250))]
+                m.get(url,
+                      status=200,
+                      content_type='application/json',
+                      body=json.dumps({'item': items,
+                                       'total_record_count': 250}))
+            items = [item async for item in
+                     self.api.iter_items(9922405930001552, 22115858660001551)]
+            # the mocks match the URL without its query string: check that
+            # each page was asked for
+            offsets = sorted(int(call.kwargs['params']['offset'])
+                             for calls in m.requests.values()
+                             for call in calls)
+        self.assertEqual(offsets, [0, 100, 200])
+        pids = sorted(int(item['item_data']['pid']) for item in items)
+        self.assertEqual(pids, list(range(250)))
+
+    async def test_get_items_stream(self):
+        ids = {'mms_id': 1, 'holding_id': 2}
+        body = '<items total_record_count="2">'
+        body += '<item><item_data><pid>3</pid></item_data></item>'
+        body += '<item><item_data><pid>4</pid></item_data></item></items>'
+        with aioresponses() as m:
+            m.get(self.api.fullurl('items', ids), status=200,
+                  content_type='application/xml', body=body)
+            items = [item.findtext('item_data/pid') async for item in
+                     self.api.get_items(1, 2, stream=True)]
+        self.assertEqual(items, ['3', '4'])
+
+    async def test_get_items_stream_closed(self):
+        metrics = Metrics()
+        self.api.hooks = [metrics]
+        body = '<items total_record_count="2">'
+        body += '<item><item_data><pid>3</pid></item_data></item>'
+        body += '<item><item_data><pid>4</pid></item_data></item></items>'
+        with aioresponses() as m:
+            m.get(self.api.fullurl('items', {'mms_id': 1, 'holding_id': 2}),
+                  status=200, content_type='application/xml', body=body)
+            stream = self.api.get_items(1, 2, stream=True)
+            async for item in stream:
+                break
+            await stream.aclose()
+        self.assertEqual(metrics.requests[('items', 'GET')], {'cancelled': 1})
+        self.assertEqual(metrics.in_flight, {('items', 'GET'): 0})
+
+    async def test_get_items_stream_retry(self):
+        self.api.retry_policy = RetryPolicy(backoff=0.01)
+        events = []
+        self.api.hooks.append(events.append)
+        ids = {'mms_id': 1, 'holding_id': 2}
+        body = '<items><item><item_data><pid>3</pid></item_data></item>'
+        body += '</items>'
+        with aioresponses() as m:
+            m.get(self.api.fullurl('items', ids), status=503, body='busy')
+            m.get(self.api.fullurl('items', ids), status=200,
+                  content_type='application/xml', body=body,
+                  headers={'X-Exl-Api-Remaining': '100'})
+            items = [item.findtext('item_data/pid') async for item in
+                     self.api.get_items(1, 2, stream=True)]
+        self.assertEqual(items, ['3'])
+        self.assertEqual(self.api.quota.remaining, 100)
+        self.assertEqual([e['event'] for e in events
+                          if e['event'] != 'wait'],
+                         ['start', 'retry', 'end'])
+        self.assertEqual((events[-1]['status'], events[-1]['attempts'],
+                          events[-1]['bytes']), (200, 2, len(body)))
+
+    async def test_get_items_stream_error(self):
+        self.api.retry_policy = RetryPolicy(max_attempts=1)
+        ids = {'mms_id': 1, 'holding_id': 2}
+        with aioresponses() as m:
+            m.get(self.api.fullurl('items', ids), status=503, body='busy')
+            with self.assertRaises(alma.AsyncHTTPError) as raised:
+                async for item in self.api.get_items(1, 2, stream=True):
+                    pass
+        self.assertEqual(raised.exception.status, 503)
+
+    async def test_close(self):
+        session = self.api.client_session
+        await self.api.close()
+        self.assertTrue(session.closed)
+
+    async def test_sync_with(self):
+        with self.assertRaises(TypeError):
+            with self.api:
+                pass
+
+
 if __name__ == '__main__':
     asynctest.main()
@@ -0,0 +1,52 @@
+import json
+import unittest
+import xml.etree.ElementTree as ET
+
+from pyalma.diff import canonical, unchanged
+from pyalma.models import Item
+
+
+class TestDiff(unittest.TestCase):
+
+    def test_json(self):
+        original = '{"a": 1, "b": {"c": [1, 2], "d": "é"}}'
+        self.assertTrue(unchanged(original,
+                                  {'b': {'d': 'é', 'c': [1, 2]}, 'a': 1}))
+        self.assertTrue(unchanged(original.encode('utf-8'),
+                                  json.dumps(json.loads(original), indent=4)))
+        self.assertFalse(unchanged(original,
+                                   {'a': 1, 'b': {'c': [2, 1], 'd': 'é'}}))
+
+    def test_xml(self):
+        original = ('<?xml version="1.0" encoding="UTF-8"?>'
+                    '<item><item_data a="1" b="2">\n'
+                    '  <barcode> 123 </barcode>\n</item_data></item>')
+        self.assertTrue(unchanged(original,
+                                  '<item><item_data b="2" a="1">'
+                                  '<barcode>123</barcode></item_data>'
+                                  '</item>'))
+        self.assertTrue(unchanged(original, ET.fromstring(original)))
+        self.assertFalse(unchanged(original,
+                                   original.replace('123', '124')))
+        self.assertFalse(unchanged(original,
+                                   original.replace('a="1"', 'a="2"')))
+
+    def test_escaped(self):
+        self.assertNotEqual(canonical('<a>&lt;b&gt;&lt;/b&gt;</a>'),
+                            canonical('<a><b></b></a>'))
+
+    def test_invalid(self):
+        self.assertFalse(unchanged('<item>', '<item>'))
+        self.assertFalse(unchanged('{"a": 1}', '<a>1</a>'))
+
+    def test_model(self):
+        with open('test/item.dat', 'rb') as dat:
+            item = Item(dat.read())
+        self.assertTrue(unchanged(item, item.data))
+        data = item.data
+        data['item_data']['barcode'] = '1'
+        self.assertFalse(unchanged(item, data))
+
+
+if __name__ == '__main__':
+    unittest.main()
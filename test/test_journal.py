@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyalma.journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'journal.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_record(self):
+        with Journal(self.path) as journal:
+            journal.record('PUT', 'item', {'mms_id': 1, 'item_pid': 2}, 200)
+            journal.record('PUT', 'item', {'mms_id': 1, 'item_pid': 3}, 500)
+            self.assertTrue(journal.succeeded('PUT', 'item',
+                                              {'item_pid': '2', 'mms_id': '1'}))
+        with open(self.path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['status'] for line in lines], [200, 500])
+        self.assertEqual(lines[0]['ids'], {'mms_id': 1, 'item_pid': 2})
+
+    def test_resume(self):
+        with Journal(self.path) as journal:
+            journal.record('PUT', 'item', {'item_pid': 1}, 200)
+            journal.record('PUT', 'item', {'item_pid': 2}, 500)
+        with Journal(self.path) as journal:
+            self.assertTrue(journal.succeeded('PUT', 'item', {'item_pid': 1}))
+            self.assertFalse(journal.succeeded('PUT', 'item', {'item_pid': 2}))
+            self.assertFalse(journal.succeeded('PUT', 'item', {'item_pid': 3}))
+            self.assertFalse(journal.succeeded('GET', 'item', {'item_pid': 1}))
+            journal.record('PUT', 'item', {'item_pid': 2}, 200)
+        with Journal(self.path) as journal:
+            self.assertTrue(journal.succeeded('PUT', 'item', {'item_pid': 2}))
+
+    def test_truncated_line(self):
+        with Journal(self.path) as journal:
+            journal.record('PUT', 'item', {'item_pid': 1}, 200)
+        with open(self.path, 'a') as f:
+            f.write('{"method": "PUT", "reso')
+        with Journal(self.path) as journal:
+            journal.record('PUT', 'item', {'item_pid': 2}, 200)
+        with Journal(self.path) as journal:
+            self.assertTrue(journal.succeeded('PUT', 'item', {'item_pid': 1}))
+            self.assertTrue(journal.succeeded('PUT', 'item', {'item_pid': 2}))
+
+
+if __name__ == '__main__':
+    unittest.main()
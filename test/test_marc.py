@@ -0,0 +1,92 @@
+import json
+import pickle
+import unittest
+
+from pyalma.marc import MarcView
+from pyalma.models import Bib
+
+
+RECORD = '''<?xml version="1.0" encoding="UTF-8"?>
+<bib><mms_id>1</mms_id><record>
+  <leader>00000nam a2200000 a 4500</leader>
+  <controlfield tag="001">1</controlfield>
+  <controlfield tag="005">20170101000000.0</controlfield>
+  <datafield tag="035" ind1=" " ind2=" ">
+    <subfield code="a">(OCoLC)1</subfield>
+  </datafield>
+  <datafield tag="035" ind1=" " ind2=" ">
+    <subfield code="a">(OCoLC)2</subfield>
+    <subfield code="z">(OCoLC)3</subfield>
+  </datafield>
+  <datafield tag="245" ind1="1" ind2="4">
+    <subfield code="a">The title &amp; more :</subfield>
+    <subfield code="b">café /</subfield>
+    <subfield code="c">A. Author.</subfield>
+  </datafield>
+  <datafield tag="500" ind1=" " ind2=" "/>
+</record></bib>'''
+
+
+class TestMarcView(unittest.TestCase):
+
+    def setUp(self):
+        self.view = MarcView(RECORD)
+
+    def test_index(self):
+        self.assertEqual(self.view.tags(), ['001', '005', '035', '245', '500'])
+        self.assertEqual(len(self.view), 6)
+        self.assertIn('245', self.view)
+        self.assertNotIn('100', self.view)
+        self.assertIsNone(self.view['100'])
+
+    def test_fields(self):
+        self.assertEqual(self.view.leader, '00000nam a2200000 a 4500')
+        self.assertEqual(self.view.control('001'), '1')
+        self.assertEqual(self.view.values('035', 'a'),
+                         ['(OCoLC)1', '(OCoLC)2'])
+        title = self.view['245']
+        self.assertEqual(title.indicators, ['1', '4'])
+        self.assertEqual(title['a'], 'The title & more :')
+        self.assertEqual(title.get_subfields('b', 'c'),
+                         ['café /', 'A. Author.'])
+        self.assertEqual(self.view['500'].subfields, [])
+        self.assertEqual([field.tag for field in
+                          self.view.get_fields('245', '001')],
+                         ['001', '245'])
+
+    def test_to_pymarc(self):
+        record = self.view.to_pymarc()
+        self.assertEqual(record['245']['a'], self.view.value('245', 'a'))
+        self.assertEqual(record['001'].data, '1')
+
+    def test_from_bib(self):
+        with open('test/bib.dat', 'r') as dat:
+            body = json.loads(dat.read())
+        view = MarcView.from_bib(body)
+        self.assertEqual(view.value('245', 'a'), 'Envisioning information /')
+        with open('test/bib.dat.xml', 'rb') as dat:
+            bib = Bib(dat.read(), 'xml')
+        self.assertEqual(bib.marc.control('001'), '333281')
+        self.assertEqual(pickle.loads(pickle.dumps(view)).control('001'),
+                         '333281')
+
+    def test_prefixed(self):
+        view = MarcView('<marc:record xmlns:marc="http://www.loc.gov/MARC21/'
+                        'slim"><marc:datafield tag="245" ind1="0" ind2="0">'
+                        '<marc:subfield code="a">T</marc:subfield>'
+                        '</marc:datafield></marc:record>')
+        self.assertEqual(view.value('245', 'a'), 'T')
+
+
+    def test_last_controlfield(self):
+        view = MarcView('<record><controlfield tag="001">123</controlfield>'
+                        '<controlfield tag="005">2017</controlfield>'
+                        '</record>')
+        self.assertEqual(view.control('001'), '123')
+        self.assertEqual(view.control('005'), '2017')
+        view = MarcView('<bib><record><controlfield tag="001">1'
+                        '</controlfield></record>\n</bib>')
+        self.assertEqual(view.control('001'), '1')
+
+if __name__ == '__main__':
+    unittest.main()
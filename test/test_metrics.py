@@ -0,0 +1,90 @@
+import unittest
+
+from pyalma.metrics import Histogram, Metrics
+
+
+def events(resource, method, *outcomes):
+    for status, error, elapsed in outcomes:
+        base = {'resource': resource, 'method': method, 'ids': {}}
+        yield dict(base, event='start')
+        yield dict(base, event='wait', kind='rate_limit', seconds=0.5)
+        if error == 'server':
+            yield dict(base, event='retry', attempt=1, status=status,
+                       error=error, delay=0.1)
+        yield dict(base, event='end', status=status, error=error,
+                   attempts=1, elapsed=elapsed, bytes=100)
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_quantile(self):
+        histogram = Histogram((1.0, 2.0, 4.0))
+        self.assertIsNone(histogram.quantile(0.5))
+        for value in (0.5, 1.5, 1.5, 3.0, 10.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.quantile(0.2), 1.0)
+        self.assertEqual(histogram.quantile(0.4), 1.5)
+        # beyond the last bound only the bound is known
+        self.assertEqual(histogram.quantile(1), 4.0)
+        self.assertEqual(list(histogram.cumulative())[-1],
+                         (float('inf'), 5))
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        for event in events('bib', 'GET', (200, None, 0.2),
+                            (200, None, 0.3), (503, 'server', 1.5),
+                            (None, 'timeout', 60.0)):
+            self.metrics(event)
+        for event in events('item', 'PUT', (200, None, 0.2)):
+            self.metrics(event)
+
+    def test_summary(self):
+        summary = self.metrics.summary()
+        self.assertEqual(sorted(summary), ['GET bib', 'PUT item'])
+        bib = summary['GET bib']
+        self.assertEqual(bib['requests'], 4)
+        self.assertEqual(bib['errors'], 2)
+        self.assertEqual(bib['retries'], 1)
+        self.assertEqual(bib['bytes'], 400)
+        self.assertAlmostEqual(bib['mean'], 62.0 / 4)
+        self.assertEqual(bib['waits'], {'rate_limit': 2.0})
+        self.assertEqual(self.metrics.in_flight[('bib', 'GET')], 0)
+
+    def test_prometheus(self):
+        text = self.metrics.prometheus()
+        lines = text.splitlines()
+        self.assertIn('# TYPE pyalma_requests_total counter', lines)
+        self.assertIn('pyalma_requests_total'
+                      '{resource="bib",method="GET",status="200"} 2', lines)
+        self.assertIn('pyalma_requests_total'
+                      '{resource="bib",method="GET",status="timeout"} 1',
+                      lines)
+        self.assertIn('pyalma_request_duration_seconds_bucket'
+                      '{resource="bib",method="GET",le="0.25"} 1', lines)
+        self.assertIn('pyalma_request_duration_seconds_bucket'
+                      '{resource="bib",method="GET",le="+Inf"} 4', lines)
+        self.assertIn('pyalma_request_duration_seconds_count'
+                      '{resource="bib",method="GET"} 4', lines)
+        self.assertIn('pyalma_wait_seconds_sum'
+                      '{resource="item",method="PUT",kind="rate_limit"} 0.5',
+                      lines)
+        self.assertIn('pyalma_retries_total'
+                      '{resource="bib",method="GET"} 1', lines)
+        # every sample line is "name{labels} value"
+        for line in lines:
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                float(value)
+
+    def test_reset(self):
+        self.metrics.reset()
+        self.assertEqual(self.metrics.summary(), {})
+        self.assertEqual(self.metrics.prometheus(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import json
+import pickle
+import sys
+import unittest
+import xml.etree.ElementTree as ET
+
+from pyalma.codec import Codec
+from pyalma.models import Bib, Item, MODELS, Request
+from pyalma.result import Result
+
+
+class TestModels(unittest.TestCase):
+
+    def setUp(self):
+        with open('test/item.dat', 'rb') as dat:
+            self.raw = dat.read()
+
+    def test_fields_json(self):
+        item = Item(self.raw)
+        self.assertIsNone(item._values)
+        self.assertEqual(item.barcode, '33125006577916')
+        self.assertEqual(item.item_pid, '23115858650001551')
+        self.assertEqual(item.mms_id, 9922405930001552)
+        # codes are read as their value
+        self.assertEqual(item.library, 'GC')
+        self.assertEqual(item.process_type, 'LOAN')
+
+    def test_fields_xml(self):
+        with open('test/bib.dat.xml', 'rb') as dat:
+            raw = dat.read()
+        bib = Bib(raw, 'xml')
+        self.assertEqual(bib.mms_id, '9922405930001551')
+        self.assertEqual(bytes(bib), raw)
+
+    def test_round_trip(self):
+        item = Item(self.raw)
+        item.barcode
+        # reading fields never changes what is sent back
+        self.assertEqual(bytes(item), self.raw)
+        self.assertEqual(Codec().encode(item, 'json'), self.raw)
+        self.assertEqual(pickle.loads(pickle.dumps(item)), item)
+
+    def test_from_data(self):
+        data = Item(self.raw).data
+        data['item_data']['barcode'] = '1'
+        self.assertEqual(Item.from_data(data).barcode, '1')
+        element = ET.fromstring('<user_request><request_id>7</request_id>'
+                                '</user_request>')
+        self.assertEqual(Request.from_data(element, 'xml').request_id, '7')
+
+    def test_from_result(self):
+        result = Result({'mms_id': '1'}, 200, {'mms_id': '1'},
+                        request={'accept': 'json'})
+        self.assertEqual(MODELS['bib'].from_result(result).mms_id, '1')
+
+    def test_compact(self):
+        item = Item(self.raw)
+        item.barcode
+        self.assertFalse(hasattr(item, '__dict__'))
+        size = (sys.getsizeof(item) + sys.getsizeof(item.raw) +
+                _deep_size(list(item._values)))
+        decoded = json.loads(self.raw.decode('utf-8'))
+        self.assertLess(size, _deep_size(decoded) / 2)
+
+
+def _deep_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(k) + _deep_size(v) for k, v in value.items())
+    elif isinstance(value, list):
+        size += sum(_deep_size(v) for v in value)
+    return size
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import time
+import unittest
+from unittest import mock
+
+from pyalma.quota import Quota, QuotaExceeded, QUOTA_HEADER
+
+
+class TestQuota(unittest.TestCase):
+
+    def test_unknown(self):
+        quota = Quota()
+        self.assertIsNone(quota.remaining)
+        quota.check(10 ** 6)
+        self.assertEqual(quota.acquire(), 0)
+        self.assertEqual(quota.state()['calls'], 1)
+
+    def test_update(self):
+        quota = Quota()
+        quota.update({QUOTA_HEADER: '100'})
+        quota.update({'Content-Type': 'application/json'})
+        quota.update({QUOTA_HEADER: 'unknown'})
+        self.assertEqual(quota.remaining, 100)
+        for i in range(3):
+            quota.acquire()
+        # estimated until the next response reports it
+        self.assertEqual(quota.remaining, 97)
+        self.assertEqual(quota.state()['reported'], 100)
+        quota.update({QUOTA_HEADER: '90'})
+        self.assertEqual(quota.remaining, 90)
+
+    def test_reserve(self):
+        quota = Quota(reserve=5)
+        quota.update({QUOTA_HEADER: '7'})
+        quota.check(2)
+        self.assertRaises(QuotaExceeded, quota.check, 3)
+        quota.acquire()
+        quota.acquire()
+        self.assertRaises(QuotaExceeded, quota.acquire)
+        quota.exhausted()
+        self.assertEqual(quota.remaining, 0)
+
+    def test_slow_down(self):
+        quota = Quota(reserve=0, slow_below=10, max_delay=0.1)
+        quota.update({QUOTA_HEADER: '1000'})
+        self.assertEqual(quota.acquire(), 0)
+        quota.update({QUOTA_HEADER: '5'})
+        begin = time.monotonic()
+        for i in range(3):
+            quota.acquire()
+        # spaced out by 0.05, 0.06 and 0.07 seconds
+        self.assertGreaterEqual(time.monotonic() - begin, 0.11)
+
+    def test_wait(self):
+        quota = Quota(wait=True)
+        quota.update({QUOTA_HEADER: '0'})
+        with mock.patch.object(quota, 'until_reset', return_value=0.05):
+            self.assertGreaterEqual(quota.acquire(), 0.04)
+        # after the reset nothing is known until the next response
+        self.assertEqual(quota.acquire(), 0)
+        self.assertIsNone(quota.remaining)
+
+    def test_until_reset(self):
+        seconds = Quota().until_reset()
+        self.assertTrue(0 < seconds <= 24 * 3600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import asyncio
+import time
+import unittest
+
+from pyalma.ratelimit import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_init_errors(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+        self.assertRaises(ValueError, TokenBucket, 25, burst=0)
+
+    def test_reserve_spacing(self):
+        bucket = TokenBucket(25)
+        now = time.monotonic()
+        delays = [bucket.reserve() - now for i in range(5)]
+        # the bucket starts empty, then hands out one token every 1/25 s
+        for i, delay in enumerate(delays):
+            self.assertAlmostEqual(delay, (i + 1) / 25, places=2)
+
+    def test_burst(self):
+        bucket = TokenBucket(10, burst=3)
+        bucket._tokens = bucket.burst
+        bucket._updated = time.monotonic()
+        now = time.monotonic()
+        delays = [bucket.reserve() - now for i in range(4)]
+        for delay in delays[:3]:
+            self.assertAlmostEqual(delay, 0, places=2)
+        self.assertAlmostEqual(delays[3], 0.1, places=2)
+
+    def test_refill_is_capped_at_burst(self):
+        bucket = TokenBucket(100, burst=2)
+        bucket._updated = time.monotonic() - 60
+        now = time.monotonic()
+        delays = [bucket.reserve() - now for i in range(3)]
+        self.assertLess(delays[1], 0.005)
+        self.assertGreater(delays[2], 0.005)
+
+    def test_rate_change(self):
+        bucket = TokenBucket(25, burst=5)
+        bucket._updated = time.monotonic() - 60
+        bucket.rate = 5
+        now = time.monotonic()
+        self.assertAlmostEqual(bucket.reserve() - now, 0.2, places=2)
+
+    def test_acquire_rate(self):
+        begin = time.monotonic()
+        bucket = TokenBucket(50)
+        for i in range(10):
+            bucket.acquire()
+        elapsed = time.monotonic() - begin
+        self.assertLessEqual(10 / elapsed, bucket.rate)
+
+    def test_cor_acquire_shared(self):
+        async def acquire_all():
+            await asyncio.gather(*[bucket.cor_acquire() for i in range(10)])
+
+        loop = asyncio.new_event_loop()
+        begin = time.monotonic()
+        bucket = TokenBucket(50)
+        try:
+            loop.run_until_complete(acquire_all())
+        finally:
+            loop.close()
+        bucket.acquire()
+        elapsed = time.monotonic() - begin
+        self.assertLessEqual(11 / elapsed, bucket.rate)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from pyalma.result import Result, status_error
+
+
+class TestResult(unittest.TestCase):
+
+    def test_tuple(self):
+        result = Result({'mms_id': 1}, 200, {'mms_id': 1}, attempts=2)
+        ids, status, body = result
+        self.assertEqual(result, ({'mms_id': 1}, 200, {'mms_id': 1}))
+        self.assertEqual((ids, status, body), (result.ids, result.status,
+                                               result.body))
+        self.assertTrue(result.ok)
+        self.assertEqual(result.attempts, 2)
+        self.assertEqual(result.request, {})
+
+    def test_replace(self):
+        result = Result({'mms_id': 1}, 500, 'error', error='server',
+                        attempts=3, raw=b'error')
+        other = result._replace(ids={'mms_id': 2})
+        self.assertEqual(other.ids, {'mms_id': 2})
+        self.assertEqual(other.error, 'server')
+        self.assertEqual(other.attempts, 3)
+        self.assertEqual(other.raw, b'error')
+        self.assertFalse(other.ok)
+
+    def test_status_error(self):
+        self.assertIsNone(status_error(200))
+        self.assertEqual(status_error(429), 'rate_limited')
+        self.assertEqual(status_error(404), 'client')
+        self.assertEqual(status_error(503), 'server')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import email.utils
+import time
+import unittest
+
+from pyalma.retry import RetryBudget, RetryPolicy, parse_retry_after
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = RetryPolicy(max_attempts=3, backoff=1, max_backoff=4)
+
+    def test_init_errors(self):
+        self.assertRaises(ValueError, RetryPolicy, max_attempts=0)
+
+    def test_retry_status(self):
+        self.assertTrue(self.policy.retry_status('GET', 429))
+        self.assertTrue(self.policy.retry_status('POST', 429))
+        self.assertTrue(self.policy.retry_status('PUT', 503))
+        self.assertFalse(self.policy.retry_status('POST', 503))
+        self.assertFalse(self.policy.retry_status('GET', 400))
+        self.assertFalse(self.policy.retry_status('GET', 404))
+
+    def test_retry_error(self):
+        self.assertTrue(self.policy.retry_error('GET'))
+        self.assertFalse(self.policy.retry_error('POST'))
+
+    def test_attempt_again(self):
+        self.assertTrue(self.policy.attempt_again(2))
+        self.assertFalse(self.policy.attempt_again(3))
+        self.assertTrue(self.policy.attempt_again(3, max_attempts=4))
+
+    def test_delay(self):
+        for attempt, cap in [(1, 1), (2, 2), (3, 4), (6, 4)]:
+            for i in range(20):
+                delay = self.policy.delay(attempt)
+                self.assertGreaterEqual(delay, 0)
+                self.assertLessEqual(delay, cap)
+
+    def test_delay_retry_after(self):
+        self.assertEqual(self.policy.delay(1, '10'), 10)
+
+    def test_budget(self):
+        budget = RetryBudget(ratio=0.5, minimum=1)
+        self.assertTrue(budget.spend())
+        self.assertFalse(budget.spend())
+        for i in range(4):
+            budget.record_call()
+        self.assertTrue(budget.spend())
+        self.assertTrue(budget.spend())
+        self.assertFalse(budget.spend())
+        self.assertFalse(self.policy.attempt_again(1, budget=budget))
+
+
+class TestParseRetryAfter(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after('3'), 3)
+        self.assertEqual(parse_retry_after('-1'), 0)
+
+    def test_date(self):
+        date = email.utils.formatdate(time.time() + 30, usegmt=True)
+        self.assertAlmostEqual(parse_retry_after(date), 30, delta=2)
+
+    def test_invalid(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from pyalma.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.calls = 0
+
+    def slow(self, value):
+        self.calls += 1
+        time.sleep(0.05)
+        return value
+
+    def test_do(self):
+        results = []
+
+        def call():
+            results.append(self.flights.do('key', self.slow, 'result'))
+
+        threads = [threading.Thread(target=call) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(len(self.flights), 0)
+
+    def test_do_sequential(self):
+        self.flights.do('key', self.slow, 1)
+        self.flights.do('key', self.slow, 2)
+        self.assertEqual(self.calls, 2)
+
+    def test_do_error(self):
+        def fail():
+            raise ValueError('failed')
+
+        self.assertRaises(ValueError, self.flights.do, 'key', fail)
+        self.assertEqual(len(self.flights), 0)
+
+    def test_cor_do(self):
+        async def slow(value):
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            return value
+
+        async def run():
+            return await asyncio.gather(
+                *[self.flights.cor_do('key', slow, 'result')
+                  for i in range(5)],
+                self.flights.cor_do('other', slow, 'other'))
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            results = loop.run_until_complete(run())
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+        self.assertEqual(results, ['result'] * 5 + ['other'])
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(len(self.flights), 0)
+
+    def test_cor_do_cancel(self):
+        finished = []
+
+        async def slow():
+            await asyncio.sleep(0.05)
+            finished.append(True)
+
+        async def run():
+            first = asyncio.ensure_future(self.flights.cor_do('key', slow))
+            second = asyncio.ensure_future(self.flights.cor_do('key', slow))
+            await asyncio.sleep(0)
+            # the call goes on for the caller left
+            first.cancel()
+            await second
+            third = asyncio.ensure_future(self.flights.cor_do('key', slow))
+            await asyncio.sleep(0)
+            third.cancel()
+            await asyncio.sleep(0.1)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        # the call is dropped once its only caller is cancelled
+        self.assertEqual(finished, [True])
+        self.assertEqual(len(self.flights), 0)
+
+    def test_cor_do_after_cancel(self):
+        calls = []
+
+        async def slow():
+            calls.append(True)
+            try:
+                await asyncio.sleep(0.05)
+            finally:
+                # the cancelled call takes a step to unwind
+                await asyncio.sleep(0)
+            return len(calls)
+
+        async def run():
+            first = asyncio.ensure_future(self.flights.cor_do('key', slow))
+            await asyncio.sleep(0)
+            first.cancel()
+            await asyncio.sleep(0)
+            # not cancelled: makes a new call rather than joining the old one
+            second = await self.flights.cor_do('key', slow)
+            await asyncio.sleep(0.01)
+            return second
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(loop.run_until_complete(run()), 2)
+        finally:
+            loop.close()
+        self.assertEqual(len(self.flights), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
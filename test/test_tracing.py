@@ -0,0 +1,83 @@
+import asyncio
+
+import asynctest
+from aiohttp import web
+
+from pyalma import alma
+from pyalma.metrics import Metrics
+from pyalma.ratelimit import TokenBucket
+from pyalma.tracing import PHASES
+
+
+class TestTracing(asynctest.TestCase):
+
+    async def setUp(self):
+        # aioresponses never reaches the connector: serve the calls
+        async def bib(request):
+            await asyncio.sleep(0.05)
+            return web.Response(body=b'{"mms_id": 1}',
+                                content_type='application/json')
+
+        self.app = web.Application(loop=self.loop)
+        self.app.router.add_route('GET', '/almaws/v1/bibs/{mms_id}', bib)
+        self.handler = self.app.make_handler()
+        self.server = await self.loop.create_server(self.handler,
+                                                    '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.events = []
+        self.metrics = Metrics()
+        self.api = alma.AsyncAlma(apikey='unreal', region='US',
+                                  tracing=True,
+                                  rate_limiter=TokenBucket(1000, 100),
+                                  hooks=[self.events.append, self.metrics])
+        self.api.endpoint = 'http://127.0.0.1:{}'.format(port)
+
+    async def tearDown(self):
+        await self.api.close()
+        self.server.close()
+        await self.server.wait_closed()
+        await self.handler.shutdown(1)
+        await self.app.cleanup()
+
+    def traces(self):
+        return [event for event in self.events if event['event'] == 'trace']
+
+    async def test_phases(self):
+        for n in range(2):
+            result, = await self.api.cor_get_bib([{'ids': {'mms_id': n}}],
+                                                 accept='json')
+            self.assertEqual(result.body, {'mms_id': 1})
+        first, second = self.traces()
+        self.assertFalse(first['reused'])
+        self.assertGreater(first['connect'], 0)
+        # the keep-alive connection is used again
+        self.assertTrue(second['reused'])
+        self.assertEqual((second['dns'], second['connect']), (0, 0))
+        for trace in (first, second):
+            self.assertEqual(trace['resource'], 'bib')
+            self.assertGreaterEqual(trace['ttfb'], 0.04)
+            self.assertGreaterEqual(min(trace[phase] for phase in PHASES), 0)
+        summary = self.metrics.summary()['GET bib']
+        self.assertEqual(summary['connections'], {'new': 1, 'reused': 1})
+        self.assertEqual(sorted(summary['phases']), sorted(PHASES))
+        lines = self.metrics.prometheus().splitlines()
+        self.assertIn('pyalma_connections_total{resource="bib",method="GET",'
+                      'connection="reused"} 1', lines)
+        self.assertIn('pyalma_phase_seconds_count{resource="bib",'
+                      'method="GET",phase="ttfb"} 2', lines)
+
+    async def test_pool(self):
+        self.api.connector_limit = 1
+        await self.api.cor_get_bib([{'ids': {'mms_id': n}}
+                                    for n in range(3)])
+        traces = self.traces()
+        self.assertEqual(len(traces), 3)
+        # one connection at a time: the others wait for it
+        self.assertGreaterEqual(max(trace['pool'] for trace in traces), 0.04)
+
+    async def test_no_hooks(self):
+        self.api.hooks = []
+        result, = await self.api.cor_get_bib([{'ids': {'mms_id': 1}}])
+        self.assertTrue(result.ok)
+        self.assertEqual(self.events, [])
+        self.assertEqual(len(self.api.client_session.connector.traces), 0)
@@ -0,0 +1,47 @@
+import unittest
+
+from pyalma.xmlstream import ElementParser, iter_elements
+
+
+ITEMS = (b'<?xml version="1.0" encoding="UTF-8"?>'
+         b'<items total_record_count="3">'
+         b'<item><bib_data><mms_id>1</mms_id></bib_data>'
+         b'<item_data><pid>11</pid></item_data></item>'
+         b'<item><bib_data><mms_id>1</mms_id></bib_data>'
+         b'<item_data><pid>12</pid></item_data></item>'
+         b'<item><bib_data><mms_id>1</mms_id></bib_data>'
+         b'<item_data><pid>13</pid></item_data></item>'
+         b'</items>')
+
+
+class TestElementParser(unittest.TestCase):
+
+    def test_iter_elements(self):
+        # one byte at a time
+        chunks = (ITEMS[i:i + 1] for i in range(len(ITEMS)))
+        elements = list(iter_elements(chunks, 'item'))
+        self.assertEqual([e.findtext('item_data/pid') for e in elements],
+                         ['11', '12', '13'])
+
+    def test_detached(self):
+        parser = ElementParser('item')
+        half = len(ITEMS) // 2
+        elements = parser.feed(ITEMS[:half])
+        self.assertEqual(len(elements), 1)
+        self.assertEqual(parser.total_record_count, 3)
+        # yielded records are no longer part of the tree
+        self.assertEqual(len(parser.root), 1)
+        elements += parser.feed(ITEMS[half:]) + parser.close()
+        self.assertEqual(len(elements), 3)
+        self.assertEqual(len(parser.root), 0)
+
+    def test_nested_tag(self):
+        # only children of the root are records
+        body = b'<holdings><holding><holding>x</holding></holding></holdings>'
+        elements = list(iter_elements([body], 'holding'))
+        self.assertEqual(len(elements), 1)
+        self.assertEqual(elements[0][0].text, 'x')
+
+
+if __name__ == '__main__':
+    unittest.main()